@@ -31,6 +31,7 @@ from utils.rag.rag_worker import gen_rag_db # RAG 相关配置
 from utils.tools import resize_image
 
 from utils.model_loader import RAG_RETRIEVER  # 读入相关模型
+from utils.digital_human.digital_human_worker import get_role_avatar_id
 
 
 # 这段代码定义了一个 Streamlit 对话框函数，用于显示产品说明书
@@ -272,8 +273,15 @@ def init_tts():
 # 数字人 初始化
 def init_digital_human():
     # 数字人 初始化
+    if "digital_human_avatar_id" not in st.session_state:
+        # 根据当前角色选择形象
+        st.session_state.digital_human_avatar_id = get_role_avatar_id(WEB_CONFIGS.SALES_NAME)
     if "digital_human_video_path" not in st.session_state:
-        st.session_state.digital_human_video_path = WEB_CONFIGS.DIGITAL_HUMAN_VIDEO_PATH
+        avatar_id = st.session_state.digital_human_avatar_id
+        if avatar_id in WEB_CONFIGS.DIGITAL_HUMAN_AVATARS:
+            st.session_state.digital_human_video_path = WEB_CONFIGS.DIGITAL_HUMAN_AVATARS[avatar_id][0]
+        else:
+            st.session_state.digital_human_video_path = WEB_CONFIGS.DIGITAL_HUMAN_VIDEO_PATH
     if "gen_digital_human_checkbox" not in st.session_state:
         st.session_state.gen_digital_human_checkbox = WEB_CONFIGS.ENABLE_DIGITAL_HUMAN
 
@@ -0,0 +1,96 @@
+"""
+GPT-SoVITS BERT 特征提取 micro-benchmark
+
+对比：
+- 原版：每个中文片段单独分词，跑一次完整的 MaskedLM 前向（含 MLM head）并返回全部 hidden states
+- batch：整段回复的中文片段 padding 后只跑一次 BERT 主干，主干去掉了用不到的最后 2 层
+
+语料为一段多句的催收回复，统计整段回复的 BERT 耗时。
+"""
+
+import os
+import time
+
+import torch
+from prettytable import PrettyTable
+from transformers import AutoModelForMaskedLM
+
+from utils.tts.gpt_sovits.inference_gpt_sovits import (
+    DEVICE,
+    get_bert_feature_batch,
+    get_target_text,
+    get_text_segments,
+    load_tts_bert_model,
+)
+from utils.web_configs import WEB_CONFIGS
+
+BERT_PATH = os.path.join(WEB_CONFIGS.TTS_MODEL_DIR, "pretrain", "chinese-roberta-wwm-ext-large")
+REPLY = [
+    "您好，请问是张先生本人吗？",
+    "您在2024年3月5日的借款5000元已经逾期15天了。",
+    "根据合同约定，逾期期间每天会产生0.05%的罚息。",
+    "如果您今天18:30之前还款，我们可以帮您申请减免部分逾期费用。",
+    "您可以通过APP首页的还款入口进行还款。",
+    "我理解您最近资金比较紧张，我们也可以帮您申请分期还款方案。",
+    "请您务必重视这笔欠款，持续逾期会影响您的个人征信记录。",
+    "感谢您的配合，祝您生活愉快！",
+]
+REPEAT = 20
+
+
+def get_bert_feature_before(text, bert_tokenizer, bert_model, word2ph):
+    with torch.no_grad():
+        inputs = bert_tokenizer(text, return_tensors="pt")
+        for i in inputs:
+            inputs[i] = inputs[i].to(DEVICE)
+        res = bert_model(**inputs, output_hidden_states=True)
+        res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
+    phone_level_feature = []
+    for i in range(len(word2ph)):
+        phone_level_feature.append(res[i].repeat(word2ph[i], 1))
+    return torch.cat(phone_level_feature, dim=0).T
+
+
+def bench(fn):
+    fn()  # warmup
+    torch.cuda.synchronize()
+    start_time = time.time()
+    for _ in range(REPEAT):
+        fn()
+    torch.cuda.synchronize()
+    return (time.time() - start_time) / REPEAT * 1000
+
+
+if __name__ == "__main__":
+    bert_tokenizer, bert_model = load_tts_bert_model(BERT_PATH, is_half=True)
+    # 原版使用完整的 24 层模型
+    full_bert_model = AutoModelForMaskedLM.from_pretrained(BERT_PATH).half().to(DEVICE)
+
+    zh_segments = [
+        segment
+        for text in REPLY
+        for segment in get_text_segments(get_target_text(text, "zh"), "zh")
+        if segment[3] == "zh"
+    ]
+    norm_text_list = [norm_text for _, _, norm_text, _ in zh_segments]
+    word2ph_list = [word2ph for _, word2ph, _, _ in zh_segments]
+
+    def run_before():
+        return [
+            get_bert_feature_before(norm_text, bert_tokenizer, full_bert_model, word2ph)
+            for norm_text, word2ph in zip(norm_text_list, word2ph_list)
+        ]
+
+    def run_batch():
+        return get_bert_feature_batch(norm_text_list, word2ph_list, bert_tokenizer, bert_model)
+
+    max_diff = max(
+        (before.to(DEVICE).float() - after.float()).abs().max().item() for before, after in zip(run_before(), run_batch())
+    )
+    print(f"{len(zh_segments)} zh segments, max abs diff: {max_diff:.4f}")
+
+    table = PrettyTable()
+    table.field_names = ["BERT", "Launches per reply", "Time per reply (ms)"]
+    table.add_row(["per segment", len(zh_segments), round(bench(run_before), 1)])
+    table.add_row(["batched", 1, round(bench(run_batch), 1)])
+    print(table)
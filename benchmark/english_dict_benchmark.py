@@ -0,0 +1,66 @@
+"""
+GPT-SoVITS 英文 G2P 字典加载 micro-benchmark
+
+对比：
+- 原版：pickle 整本 CMU 字典，加载时反序列化成 dict of list，再逐行解析 engdict-hot.rep
+- 二进制：排序后的词 + 偏移写成一个文件，mmap 打开后二分查找，按需解码
+
+统计加载耗时、加载后常驻的 Python 对象内存以及单词查询耗时。
+"""
+
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+
+from prettytable import PrettyTable
+
+from utils.tts.gpt_sovits.text import english
+
+WORDS = ["hello", "please", "payment", "account", "overdue", "credit", "app", "service", "thank", "goodbye"]
+REPEAT = 1000
+
+
+def load_pickle(pickle_path):
+    with open(pickle_path, "rb") as pickle_file:
+        g2p_dict = pickle.load(pickle_file)
+    return english.hot_reload_hot(g2p_dict)
+
+
+def measure_load(fn):
+    tracemalloc.start()
+    start_time = time.time()
+    g2p_dict = fn()
+    cost = (time.time() - start_time) * 1000
+    memory = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+    return g2p_dict, cost, memory
+
+
+def measure_lookup(g2p_dict):
+    start_time = time.time()
+    for _ in range(REPEAT):
+        for word in WORDS:
+            g2p_dict[word][0]
+    return (time.time() - start_time) / (REPEAT * len(WORDS)) * 1e6
+
+
+if __name__ == "__main__":
+    pickle_path = os.path.join(tempfile.mkdtemp(), "engdict_cache.pickle")
+    with open(pickle_path, "wb") as pickle_file:
+        pickle.dump(english.read_dict_new(), pickle_file)
+    english.get_dict()  # 确保二进制字典已生成
+
+    pickle_dict, pickle_cost, pickle_memory = measure_load(lambda: load_pickle(pickle_path))
+    bin_dict, bin_cost, bin_memory = measure_load(english.get_dict)
+    for word in WORDS:
+        assert pickle_dict[word] == bin_dict[word], word
+
+    table = PrettyTable()
+    table.field_names = ["CMU dict", "Load (ms)", "Python memory (MB)", "Lookup (us)"]
+    table.add_row(["pickle", round(pickle_cost, 1), round(pickle_memory, 1), round(measure_lookup(pickle_dict), 2)])
+    table.add_row(["mmap binary", round(bin_cost, 1), round(bin_memory, 1), round(measure_lookup(bin_dict), 2)])
+    print(table)
+
+    os.remove(pickle_path)
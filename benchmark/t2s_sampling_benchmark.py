@@ -0,0 +1,82 @@
+"""
+GPT-SoVITS T2S 采样步骤的 micro-benchmark
+
+对比：
+- 原版：逐句调用 sample，每步 EOS 判断都同步到 CPU
+- 融合版：整个 batch 调用 sample_fused，EOS 状态留在 GPU，每 N 步同步一次
+
+只测采样 + EOS 判断，不包含 transformer 前向，用随机 logits 模拟 1500 步解码。
+没有 GPU 时在 CPU 上运行，此时没有 host-device 同步开销，只能反映采样本身的差异。
+"""
+
+import datetime
+
+import torch
+from prettytable import PrettyTable
+
+from utils.tts.gpt_sovits.AR.models.utils import sample, sample_fused
+
+VOCAB_SIZE = 1025
+EOS = 1024
+PREFIX_LEN = 150  # 参考音频 semantic token 长度
+STEPS = 1500
+SAMPLING_KWARGS = dict(top_k=5, top_p=1, temperature=1, repetition_penalty=1.35)
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def synchronize():
+    if DEVICE == "cuda":
+        torch.cuda.synchronize()
+
+
+def get_speed(start_time, bsz):
+    synchronize()
+    delta_time = datetime.datetime.now() - start_time
+    delta_time = delta_time.seconds + delta_time.microseconds / 1000000.0
+    return bsz * STEPS / delta_time
+
+
+def bench_origin(bsz, device=DEVICE):
+    y = torch.randint(0, EOS, (bsz, PREFIX_LEN + STEPS), dtype=torch.int, device=device)
+    logits_list = torch.randn(STEPS, bsz, VOCAB_SIZE, device=device)
+
+    synchronize()
+    start_time = datetime.datetime.now()
+    for idx in range(STEPS):
+        prev = y[:, : PREFIX_LEN + idx]
+        for row in range(bsz):
+            samples = sample(logits_list[idx, row].clone(), prev[row : row + 1], **SAMPLING_KWARGS)[0].unsqueeze(0)
+            if torch.argmax(logits_list[idx, row], dim=-1) == EOS or samples[0, 0] == EOS:  # 每步同步
+                pass
+    return get_speed(start_time, bsz)
+
+
+def bench_fused(bsz, eos_check_interval=8, device=DEVICE):
+    y = torch.randint(0, EOS, (bsz, PREFIX_LEN + STEPS), dtype=torch.int, device=device)
+    logits_list = torch.randn(STEPS, bsz, VOCAB_SIZE, device=device)
+    finished = torch.zeros(bsz, dtype=torch.bool, device=device)
+
+    synchronize()
+    start_time = datetime.datetime.now()
+    for idx in range(STEPS):
+        logits = logits_list[idx]
+        samples = sample_fused(logits, y[:, : PREFIX_LEN + idx], **SAMPLING_KWARGS)
+        finished |= (torch.argmax(logits, dim=-1) == EOS) | (samples[:, 0] == EOS)
+        if (idx + 1) % eos_check_interval == 0 and finished.all():  # 每 N 步同步一次
+            pass
+    return get_speed(start_time, bsz)
+
+
+if __name__ == "__main__":
+
+    # warmup
+    bench_origin(1)
+    bench_fused(1)
+
+    print(f"device: {torch.cuda.get_device_name() if DEVICE == 'cuda' else 'cpu'}")
+    table = PrettyTable()
+    table.field_names = ["Batch size", "Sampler", "Speed (tokens/s)"]
+    for bsz in [1, 4, 8]:
+        table.add_row([bsz, "sample + per-step sync", round(bench_origin(bsz), 1)])
+        table.add_row([bsz, "sample_fused + sync every 8 steps", round(bench_fused(bsz), 1)])
+    print(table)
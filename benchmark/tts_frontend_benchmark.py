@@ -0,0 +1,135 @@
+"""
+GPT-SoVITS 中文前端（文本规范化 + G2P）micro-benchmark
+
+对比：
+- 原版：每次调用新建 TextNormalizer、现场编译正则（TextNormalizerBefore 为原版实现的拷贝），每个词都重新跑 pypinyin + 变调
+- 优化版：共用 TextNormalizer、模块级预编译正则，(词, 词性) 的 G2P 结果走缓存
+
+语料为常见的催收话术，统计平均每句耗时。
+"""
+
+import re
+import time
+
+from prettytable import PrettyTable
+
+from utils.tts.gpt_sovits.text import chinese
+from utils.tts.gpt_sovits.text.symbols import punctuation
+from utils.tts.gpt_sovits.text.zh_normalization.text_normlization import TextNormalizer
+
+CORPUS = [
+    "您好，请问是张先生本人吗？我这边是消费金融公司的客服专员。",
+    "您在2024年3月5日的借款5000元已经逾期15天了，请问您什么时候方便处理一下？",
+    "根据合同约定，逾期期间每天会产生0.05%的罚息，逾期越久费用越高。",
+    "如果您今天18:30之前还款，我们可以帮您申请减免部分逾期费用。",
+    "您可以通过APP首页的还款入口，或者拨打客服电话4001234567进行还款。",
+    "我理解您最近资金比较紧张，我们也可以帮您申请分期还款方案。",
+    "请您务必重视这笔欠款，持续逾期会影响您的个人征信记录。",
+    "好的，那我们约定本周五之前还款3000元，剩余部分下个月15号前结清，可以吗？",
+    "感谢您的配合，还款成功后系统会给您发送短信通知，祝您生活愉快！",
+    "如有疑问，请在工作日9:00~18:00联系我们，再见。",
+]
+REPEAT = 20
+
+
+def replace_punctuation_before(text):
+    text = text.replace("嗯", "恩").replace("呣", "母")
+    pattern = re.compile("|".join(re.escape(p) for p in chinese.rep_map.keys()))
+    replaced_text = pattern.sub(lambda x: chinese.rep_map[x.group()], text)
+    return re.sub(r"[^\u4e00-\u9fa5" + "".join(punctuation) + r"]+", "", replaced_text)
+
+
+class TextNormalizerBefore(TextNormalizer):
+    """原版 TextNormalizer：每次实例化编译分句正则，过滤特殊字符现场编译，_post_replace 逐个 str.replace"""
+
+    def __init__(self):
+        self.SENTENCE_SPLITOR = re.compile(r'([：、，；。？！,;?!][”’]?)')
+
+    def _split(self, text, lang="zh"):
+        if lang == "zh":
+            text = text.replace(" ", "")
+            text = re.sub(r'[——《》【】<>{}()（）#&@“”^_|\\]', '', text)
+        text = self.SENTENCE_SPLITOR.sub(r'\1\n', text)
+        text = text.strip()
+        return [sentence.strip() for sentence in re.split(r'\n+', text)]
+
+    def _post_replace(self, sentence):
+        sentence = sentence.replace('/', '每')
+        sentence = sentence.replace('①', '一')
+        sentence = sentence.replace('②', '二')
+        sentence = sentence.replace('③', '三')
+        sentence = sentence.replace('④', '四')
+        sentence = sentence.replace('⑤', '五')
+        sentence = sentence.replace('⑥', '六')
+        sentence = sentence.replace('⑦', '七')
+        sentence = sentence.replace('⑧', '八')
+        sentence = sentence.replace('⑨', '九')
+        sentence = sentence.replace('⑩', '十')
+        sentence = sentence.replace('α', '阿尔法')
+        sentence = sentence.replace('β', '贝塔')
+        sentence = sentence.replace('γ', '伽玛').replace('Γ', '伽玛')
+        sentence = sentence.replace('δ', '德尔塔').replace('Δ', '德尔塔')
+        sentence = sentence.replace('ε', '艾普西龙')
+        sentence = sentence.replace('ζ', '捷塔')
+        sentence = sentence.replace('η', '依塔')
+        sentence = sentence.replace('θ', '西塔').replace('Θ', '西塔')
+        sentence = sentence.replace('ι', '艾欧塔')
+        sentence = sentence.replace('κ', '喀帕')
+        sentence = sentence.replace('λ', '拉姆达').replace('Λ', '拉姆达')
+        sentence = sentence.replace('μ', '缪')
+        sentence = sentence.replace('ν', '拗')
+        sentence = sentence.replace('ξ', '克西').replace('Ξ', '克西')
+        sentence = sentence.replace('ο', '欧米克伦')
+        sentence = sentence.replace('π', '派').replace('Π', '派')
+        sentence = sentence.replace('ρ', '肉')
+        sentence = sentence.replace('ς', '西格玛').replace('Σ', '西格玛').replace('σ', '西格玛')
+        sentence = sentence.replace('τ', '套')
+        sentence = sentence.replace('υ', '宇普西龙')
+        sentence = sentence.replace('φ', '服艾').replace('Φ', '服艾')
+        sentence = sentence.replace('χ', '器')
+        sentence = sentence.replace('ψ', '普赛').replace('Ψ', '普赛')
+        sentence = sentence.replace('ω', '欧米伽').replace('Ω', '欧米伽')
+        sentence = re.sub(r'[-——《》【】<=>{}()（）#&@“”^_|\\]', '', sentence)
+        return sentence
+
+
+def text_normalize_before(text):
+    tx = TextNormalizerBefore()
+    return "".join(replace_punctuation_before(sentence) for sentence in tx.normalize(text))
+
+
+def frontend_before(text):
+    # 不走 (词, 词性) 缓存
+    cached_fn = chinese._get_word_initials_finals
+    chinese._get_word_initials_finals = cached_fn.__wrapped__
+    try:
+        return chinese.g2p(text_normalize_before(text))
+    finally:
+        chinese._get_word_initials_finals = cached_fn
+
+
+def frontend_after(text):
+    return chinese.g2p(chinese.text_normalize(text))
+
+
+def bench(fn):
+    start_time = time.time()
+    for _ in range(REPEAT):
+        for text in CORPUS:
+            fn(text)
+    return (time.time() - start_time) / (REPEAT * len(CORPUS)) * 1000
+
+
+if __name__ == "__main__":
+    for text in CORPUS:
+        assert frontend_before(text) == frontend_after(text), text
+
+    chinese._get_word_initials_finals.cache_clear()
+    table = PrettyTable()
+    table.field_names = ["Frontend", "Time per sentence (ms)"]
+    table.add_row(["text_normalize only (before)", round(bench(text_normalize_before), 3)])
+    table.add_row(["text_normalize only (after)", round(bench(chinese.text_normalize), 3)])
+    table.add_row(["normalize + g2p (before)", round(bench(frontend_before), 3)])
+    table.add_row(["normalize + g2p (after)", round(bench(frontend_after), 3)])
+    print(table)
+    print(f"G2P cache: {chinese._get_word_initials_finals.cache_info()}")
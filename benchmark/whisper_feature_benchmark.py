@@ -0,0 +1,61 @@
+"""
+数字人 whisper 音频特征提取 micro-benchmark
+
+对比：
+- 原版：transcribe 逐个 30s 窗口在 CPU 上算 log-mel 后编码
+- encoder-only：整段 log-mel 在 GPU 上计算，所有窗口一个 batch 编码
+
+用随机噪声模拟 2 分钟的 16k 音频。
+"""
+
+import time
+
+import numpy as np
+import torch
+from prettytable import PrettyTable
+
+from utils.digital_human.musetalk.whisper.audio2feature import encode_mel
+from utils.digital_human.musetalk.whisper.whisper import load_model
+from utils.digital_human.musetalk.whisper.whisper.audio import SAMPLE_RATE, log_mel_spectrogram
+
+MODEL_PATH = "./weights/digital_human_weights/whisper/tiny.pt"
+AUDIO_SEC = 120
+REPEAT = 10
+
+
+def audio2feat_transcribe(model, audio):
+    result = model.transcribe(audio)
+    embed_list = []
+    for emb in result["segments"]:
+        encoder_embeddings = emb["encoder_embeddings"].transpose(0, 2, 1, 3).squeeze(0)
+        embed_list.append(encoder_embeddings[: int((emb["end"] - emb["start"]) / 2)])
+    return np.concatenate(embed_list, axis=0)
+
+
+def audio2feat_encoder_only(model, audio):
+    return encode_mel(model, log_mel_spectrogram(torch.from_numpy(audio).to(model.device)))
+
+
+def bench(fn):
+    fn()  # warmup
+    torch.cuda.synchronize()
+    start_time = time.time()
+    for _ in range(REPEAT):
+        fn()
+    torch.cuda.synchronize()
+    return (time.time() - start_time) / REPEAT * 1000
+
+
+if __name__ == "__main__":
+    model = load_model(MODEL_PATH)
+    audio = (np.random.randn(AUDIO_SEC * SAMPLE_RATE) * 0.1).astype(np.float32)
+
+    feat_transcribe = audio2feat_transcribe(model, audio)
+    feat_encoder_only = audio2feat_encoder_only(model, audio)
+    print(f"shape: {feat_transcribe.shape} vs {feat_encoder_only.shape}")
+
+    table = PrettyTable()
+    table.field_names = ["Audio2Feature", f"Time for {AUDIO_SEC}s audio (ms)"]
+    table.add_row(["transcribe (per window)", round(bench(lambda: audio2feat_transcribe(model, audio)), 1)])
+    table.add_row(["encoder-only (batched)", round(bench(lambda: audio2feat_encoder_only(model, audio)), 1)])
+    print(table)
@@ -0,0 +1,12 @@
+# importlib 方式导入测试时会先导入上层包，digital_human 包的 __init__ 依赖 torch，缺少时整个目录跳过
+import importlib.util
+
+PACKAGE_REQUIREMENTS = {
+    "digital_human/*": ["torch"],
+}
+
+collect_ignore_glob = [
+    pattern
+    for pattern, modules in PACKAGE_REQUIREMENTS.items()
+    if any(importlib.util.find_spec(module) is None for module in modules)
+]
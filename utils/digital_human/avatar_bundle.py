@@ -0,0 +1,119 @@
+"""
+数字人形象素材包
+
+把一个形象预处理后的素材打包成几个 .npy 文件，启动时用 mmap 只读打开，按需分页读入，多个进程共享同一份 page cache：
+
+- frames.npy       uint8 [N, H, W, 3]，原视频的每一帧
+- masks.npy        uint8 一维数组，每帧的融合 mask（大小随 crop_box 变化）拼接在一起
+- mask_shapes.npy  int32 [N, 2]，每个 mask 的 (h, w)
+- coords.npy       int32 [N, 4]，人脸框
+- mask_coords.npy  int32 [N, 4]，crop_box
+- latents.npy      float16 [M, 8, 32, 32]，UNet 输入的参考 latent（检测不到人脸的帧没有 latent）
+
+推理时使用的循环序列是 正序 + 倒序，倒序部分只是索引，不再复制一份素材。
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import torch
+
+BUNDLE_FILES = ["frames.npy", "masks.npy", "mask_shapes.npy", "coords.npy", "mask_coords.npy", "latents.npy"]
+
+
+def get_cycle_index(length):
+    """正序 + 倒序的循环索引"""
+    index = np.arange(length, dtype=np.int64)
+    return np.concatenate([index, index[::-1]])
+
+
+class CycleView:
+    """按循环索引访问素材，行为和原来的 xxx_list_cycle 列表一致（len / 下标访问）"""
+
+    def __init__(self, items, cycle_index):
+        self.items = items
+        self.cycle_index = cycle_index
+
+    def __len__(self):
+        return len(self.cycle_index)
+
+    def __getitem__(self, idx):
+        return self.items[self.cycle_index[idx]]
+
+
+def save_avatar_bundle(bundle_dir, frame_list, coord_list, mask_list, mask_coords_list, latent_list):
+    """保存素材包，各个 list 都是不含倒序部分的原始序列"""
+    bundle_dir = Path(bundle_dir)
+    bundle_dir.mkdir(parents=True, exist_ok=True)
+
+    def _save(name, array):
+        # 先写临时文件再替换，避免中途出错留下半个文件
+        tmp_path = bundle_dir.joinpath(f"{name}.{os.getpid()}.tmp.npy")
+        np.save(tmp_path, array)
+        os.replace(tmp_path, bundle_dir.joinpath(name))
+
+    # 逐帧写入，避免 stack 时内存里多一份完整视频
+    frames_tmp_path = bundle_dir.joinpath(f"frames.npy.{os.getpid()}.tmp.npy")
+    frames = np.lib.format.open_memmap(frames_tmp_path, mode="w+", dtype=np.uint8, shape=(len(frame_list),) + frame_list[0].shape)
+    for i, frame in enumerate(frame_list):
+        frames[i] = frame
+    frames.flush()
+    del frames
+    os.replace(frames_tmp_path, bundle_dir.joinpath("frames.npy"))
+
+    mask_list = [mask[:, :, 0] if mask.ndim == 3 else mask for mask in mask_list]
+    _save("masks.npy", np.concatenate([mask.reshape(-1) for mask in mask_list]).astype(np.uint8))
+    _save("mask_shapes.npy", np.array([mask.shape for mask in mask_list], dtype=np.int32))
+
+    _save("coords.npy", np.array(coord_list, dtype=np.int32).reshape(-1, 4))
+    _save("mask_coords.npy", np.array(mask_coords_list, dtype=np.int32).reshape(-1, 4))
+    _save("latents.npy", torch.cat(latent_list, dim=0).half().cpu().numpy())
+
+
+def avatar_bundle_exists(bundle_dir):
+    return all(Path(bundle_dir).joinpath(name).exists() for name in BUNDLE_FILES)
+
+
+class AvatarBundle:
+    """只读加载素材包
+
+    Args:
+        bundle_dir (str): 素材包目录
+        device (str): latent 放置的设备
+    """
+
+    def __init__(self, bundle_dir, device="cuda"):
+        bundle_dir = Path(bundle_dir)
+
+        self.frames = np.load(bundle_dir.joinpath("frames.npy"), mmap_mode="r")
+        self.coords = np.load(bundle_dir.joinpath("coords.npy")).tolist()
+        self.mask_coords = np.load(bundle_dir.joinpath("mask_coords.npy")).tolist()
+
+        # mask 是 mmap 上的 view，不会读入内存
+        masks_flat = np.load(bundle_dir.joinpath("masks.npy"), mmap_mode="r")
+        mask_shapes = np.load(bundle_dir.joinpath("mask_shapes.npy"))
+        offsets = np.concatenate([[0], np.cumsum(mask_shapes[:, 0] * mask_shapes[:, 1])])
+        self.masks = [masks_flat[offsets[i] : offsets[i + 1]].reshape(h, w) for i, (h, w) in enumerate(mask_shapes)]
+
+        frame_cycle = get_cycle_index(len(self.frames))
+        self.frame_list_cycle = CycleView(self.frames, frame_cycle)
+        self.coord_list_cycle = CycleView(self.coords, frame_cycle)
+        self.mask_list_cycle = CycleView(self.masks, frame_cycle)
+        self.mask_coords_list_cycle = CycleView(self.mask_coords, frame_cycle)
+
+        # latent 很小，整体作为一个连续的 fp16 tensor 放到 GPU 上
+        self.latents = torch.from_numpy(np.load(bundle_dir.joinpath("latents.npy")))
+        self.to(device)
+
+    def to(self, device):
+        """把 latent 移动到 device，用于多形象时在 GPU / CPU 之间换入换出"""
+        self.latents = self.latents.to(device)
+        self.device = self.latents.device
+        # prefetch_datagen 直接用循环索引从 latents 里按 batch 取
+        self.latent_cycle_index = torch.from_numpy(get_cycle_index(len(self.latents))).to(self.device)
+        # 和原来一样每个元素是 [1, 8, 32, 32]
+        self.input_latent_list_cycle = CycleView(
+            [self.latents[i : i + 1] for i in range(len(self.latents))], get_cycle_index(len(self.latents))
+        )
+        return self
@@ -1,6 +1,18 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
+
+import librosa
+import numpy as np
+import soundfile as sf
 import streamlit as st
-from utils.digital_human.realtime_inference import gen_digital_human_video
+
+from utils.digital_human.musetalk.whisper.audio2feature import StreamAudio2Feature, get_ready_frame_num
+from utils.digital_human.realtime_inference import Avatar, FramePostProcessor, gen_digital_human_video
+from utils.digital_human.video_writer import FFmpegVideoWriter, concat_videos
 from utils.model_loader import DIGITAL_HUMAN_HANDLER
 from utils.web_configs import WEB_CONFIGS
 
@@ -14,6 +26,16 @@ def show_video(video_path, autoplay=True, loop=False, muted=False):
     st.video(video_bytes, format="video/mp4", autoplay=autoplay, loop=loop, muted=muted)
 
 
+def get_role_avatar_id(role_name):
+    """角色对应的形象 ID，没有配置的角色使用默认形象"""
+    return WEB_CONFIGS.DIGITAL_HUMAN_ROLE_AVATARS.get(role_name, WEB_CONFIGS.DIGITAL_HUMAN_AVATAR_ID)
+
+
+def get_avatar_id():
+    # 不同角色可以使用不同的形象，模型共用
+    return st.session_state.get("digital_human_avatar_id", get_role_avatar_id(WEB_CONFIGS.SALES_NAME))
+
+
 def gen_digital_human_video_in_spinner(audio_path):
     save_path = None
     if st.session_state.gen_digital_human_checkbox and DIGITAL_HUMAN_HANDLER is not None:
@@ -22,16 +44,264 @@ def gen_digital_human_video_in_spinner(audio_path):
         ):
             # save_tag = datetime.now().strftime("%Y-%m-%d-%H-%M-%S") + ".wav"
 
-            st.session_state.digital_human_video_path = gen_digital_human_video(
-                DIGITAL_HUMAN_HANDLER,
-                audio_path,
-                work_dir=str(Path(WEB_CONFIGS.DIGITAL_HUMAN_GEN_PATH).absolute()),
-                video_path=st.session_state.digital_human_video_path,
-                fps=DIGITAL_HUMAN_HANDLER.model_handler.fps,
-            )
+            # 生成期间形象固定在 GPU 上，不会被其他会话换出
+            with DIGITAL_HUMAN_HANDLER.use(get_avatar_id()) as avatar_handler:
+                st.session_state.digital_human_video_path = gen_digital_human_video(
+                    avatar_handler,
+                    audio_path,
+                    work_dir=str(Path(WEB_CONFIGS.DIGITAL_HUMAN_GEN_PATH).absolute()),
+                    video_path=st.session_state.digital_human_video_path,
+                    fps=avatar_handler.model_handler.fps,
+                )
 
             st.session_state.video_placeholder.empty()  # 清空
             with st.session_state.video_placeholder.container():
                 show_video(st.session_state.digital_human_video_path)
             st.toast("生成数字人视频成功!")
     return save_path
+
+
+class StreamDigitalHumanWorker:
+    """流式数字人：TTS 音频边到边生成口型视频，按段输出 fragmented MP4
+
+    用法：
+        worker = StreamDigitalHumanWorker(avatar, output_dir, fps)
+        stream_tts = StreamTTSWorker(on_chunk=worker.feed)  # TTS 每合成一句就送进来
+        ...
+        for segment_path, duration in worker.get_ready_segments():
+            ...  # 播放这一段
+        worker.finish()
+        worker.save_video(path)  # 所有段拼接成完整视频
+    """
+
+    _FINISH_TAG = None
+    WHISPER_SAMPLING_RATE = 16000
+
+    def __init__(self, avatar: Avatar, output_dir, fps, segment_sec=2.0, on_close=None):
+        self.avatar = avatar
+        self.on_close = on_close  # 全部生成完成后调用，用于释放形象
+        self.fps = fps
+        self.segment_frames = max(1, int(segment_sec * fps))
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        self.feature_extractor = StreamAudio2Feature(avatar.model_handler.audio_processor.model)
+        # 融合线程池和帧 buffer 整个回复只创建一次，每段换一个 video_writer
+        self.post_processor = FramePostProcessor(avatar, None)
+        self.pcm_list = []  # TTS 原始采样率的 int16 音频，拼接完整视频时一次性编码
+        self.pending_pcm = np.zeros(0, dtype=np.int16)  # 还没有写进视频段的音频
+        self.pending_pcm_start = 0  # pending_pcm 第一个采样点在整段音频中的位置
+        self.sampling_rate = None
+        self.frame_done = 0  # 已经生成的帧数
+        self.segment_paths = []
+
+        self.audio_queue = queue.Queue()
+        self.segment_queue = queue.Queue()
+        self.all_segments_ready = False
+        self.finished = False
+
+        # 页面播放用：等待播放的视频段，以及当前段播放结束的时间
+        self.pending_segments = []
+        self.play_until = 0.0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def feed(self, chunk, sampling_rate):
+        """送入 TTS 合成好的 int16 音频"""
+        self.audio_queue.put((chunk, sampling_rate))
+
+    def finish(self):
+        """TTS 结束或者回复被中断时调用，后台线程处理完剩余音频后退出并释放形象，重复调用无影响"""
+        if self.finished:
+            return
+        self.finished = True
+        self.audio_queue.put(self._FINISH_TAG)
+
+    def _run(self):
+        try:
+            self._run_loop()
+        finally:
+            # 无论是否出错，形象都要释放，否则会一直固定在 GPU 上
+            try:
+                self.post_processor.close()
+            except Exception as e:
+                print(f"Stream digital human 生成失败: {e}")
+            if self.on_close is not None:
+                self.on_close()
+            self.segment_queue.put(self._FINISH_TAG)
+
+    def _run_loop(self):
+        while True:
+            item = self.audio_queue.get()
+            finished = item is self._FINISH_TAG
+
+            try:
+                if finished:
+                    self.feature_extractor.finish()
+                else:
+                    chunk, self.sampling_rate = item
+                    self.pcm_list.append(chunk)
+                    self.pending_pcm = np.concatenate([self.pending_pcm, chunk])
+                    audio = librosa.resample(
+                        chunk.astype(np.float32) / 32768, orig_sr=self.sampling_rate, target_sr=self.WHISPER_SAMPLING_RATE
+                    )
+                    self.feature_extractor.feed(audio)
+                self._render(finished)
+            except Exception as e:
+                print(f"Stream digital human 生成失败: {e}")
+
+            if finished:
+                break
+
+    def _render(self, finished):
+        """音频特征足够时，按段生成视频"""
+        features = self.feature_extractor.features
+        ready_num = get_ready_frame_num(len(features), self.feature_extractor.stable_length, self.fps, finished)
+
+        while ready_num - self.frame_done >= self.segment_frames or (finished and ready_num > self.frame_done):
+            frame_end = min(ready_num, self.frame_done + self.segment_frames)
+            segment_path = self._write_segment(features, self.frame_done, frame_end)
+            self.segment_paths.append(segment_path)
+            self.segment_queue.put((segment_path, (frame_end - self.frame_done) / self.fps))
+            self.frame_done = frame_end
+
+    def _write_segment(self, features, frame_start, frame_end):
+        audio_processor = self.avatar.model_handler.audio_processor
+        whisper_chunks = audio_processor.get_sliced_features(features, np.arange(frame_start, frame_end), fps=self.fps)
+
+        # 这一段对应的音频，结尾不够时补静音
+        sample_start = round(frame_start / self.fps * self.sampling_rate)
+        sample_end = round(frame_end / self.fps * self.sampling_rate)
+        segment_pcm = np.zeros(sample_end - sample_start, dtype=np.int16)
+        valid_pcm = self.pending_pcm[sample_start - self.pending_pcm_start : sample_end - self.pending_pcm_start]
+        segment_pcm[: len(valid_pcm)] = valid_pcm
+
+        # 用过的音频直接丢掉，不用每段都把整段回复的音频拼一遍
+        consumed = min(sample_end - self.pending_pcm_start, len(self.pending_pcm))
+        self.pending_pcm = self.pending_pcm[consumed:]
+        self.pending_pcm_start += consumed
+
+        segment_idx = len(self.segment_paths)
+        segment_path = self.output_dir.joinpath(f"{segment_idx:04d}.mp4")
+        wav_path = self.output_dir.joinpath(f"{segment_idx:04d}.wav")
+        sf.write(wav_path, segment_pcm, self.sampling_rate)
+
+        height, width = self.avatar.frame_list_cycle[0].shape[:2]
+        video_writer = FFmpegVideoWriter(
+            segment_path,
+            width,
+            height,
+            self.fps,
+            audio_path=wav_path,
+            extra_args=["-movflags", "frag_keyframe+empty_moov+default_base_moof"],
+        )
+        try:
+            self.avatar.render_frames(whisper_chunks, frame_start, video_writer, post_processor=self.post_processor)
+        finally:
+            video_writer.close()
+            os.remove(wav_path)
+        return str(segment_path)
+
+    def get_ready_segments(self, block=False):
+        """获取已经生成好的视频段 (路径, 时长)
+
+        Args:
+            block (bool): True 则一直等到全部生成完成
+        """
+        while True:
+            try:
+                segment = self.segment_queue.get(block=block)
+            except queue.Empty:
+                return
+            if segment is self._FINISH_TAG:
+                self.all_segments_ready = True
+                return
+            yield segment
+
+    def save_video(self, video_path_output):
+        """拼接所有视频段，整段回复的音频重新编码一次后合成进去"""
+        if len(self.segment_paths) == 0:
+            return None
+
+        wav_path = self.output_dir.joinpath("full.wav")
+        sf.write(wav_path, np.concatenate(self.pcm_list), self.sampling_rate)
+        try:
+            return concat_videos(self.segment_paths, video_path_output, audio_path=wav_path)
+        finally:
+            os.remove(wav_path)
+
+
+def start_stream_digital_human():
+    """开启流式数字人，需要同时开启流式 TTS，未启用时返回 None"""
+    if (
+        DIGITAL_HUMAN_HANDLER is None
+        or not st.session_state.gen_digital_human_checkbox
+        or not WEB_CONFIGS.DIGITAL_HUMAN_STREAMING
+        or not WEB_CONFIGS.TTS_STREAMING
+    ):
+        return None
+
+    # 形象在整个流式生成期间固定在 GPU 上，worker 结束时释放
+    avatar_id = get_avatar_id()
+    avatar_handler = DIGITAL_HUMAN_HANDLER.acquire(avatar_id)
+    save_tag = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+    try:
+        return StreamDigitalHumanWorker(
+            avatar_handler,
+            output_dir=Path(avatar_handler.video_out_path).joinpath(save_tag),
+            fps=avatar_handler.model_handler.fps,
+            segment_sec=WEB_CONFIGS.DIGITAL_HUMAN_STREAM_SEGMENT_SEC,
+            on_close=lambda: DIGITAL_HUMAN_HANDLER.release(avatar_id),
+        )
+    except Exception:
+        # worker 没有创建成功，on_close 不会被调用
+        DIGITAL_HUMAN_HANDLER.release(avatar_id)
+        raise
+
+
+def show_stream_digital_human_segments(stream_digital_human: StreamDigitalHumanWorker, block=False):
+    """上一段播放完后再显示下一段
+
+    Args:
+        block (bool): True 则一直等到最后一段开始播放
+    """
+    if stream_digital_human is None:
+        return
+
+    while True:
+        stream_digital_human.pending_segments += list(stream_digital_human.get_ready_segments())
+
+        if len(stream_digital_human.pending_segments) == 0:
+            if not block or stream_digital_human.all_segments_ready:
+                return
+            time.sleep(0.1)
+            continue
+
+        if stream_digital_human.play_until > time.time():
+            if not block:
+                return
+            time.sleep(0.1)
+            continue
+
+        segment_path, duration = stream_digital_human.pending_segments.pop(0)
+        st.session_state.video_placeholder.empty()  # 清空
+        with st.session_state.video_placeholder.container():
+            show_video(segment_path)
+        stream_digital_human.play_until = time.time() + duration
+
+
+def finish_stream_digital_human_in_spinner(stream_digital_human: StreamDigitalHumanWorker):
+    """TTS 完成后，等待剩余视频段生成完毕，并拼接成完整视频"""
+    if stream_digital_human is None:
+        return None
+
+    stream_digital_human.finish()
+    with st.spinner("正在生成数字人，请稍等..."):
+        show_stream_digital_human_segments(stream_digital_human, block=True)
+
+    video_path = stream_digital_human.save_video(str(stream_digital_human.output_dir.with_suffix(".mp4")))
+    if video_path is not None:
+        st.session_state.digital_human_video_path = video_path
+        st.toast("生成数字人视频成功!")
+    return video_path
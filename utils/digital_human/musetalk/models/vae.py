@@ -122,6 +122,18 @@ class VAE():
         latent_model_input = torch.cat([masked_latents, ref_latents], dim=1)
         return latent_model_input
 
+    def get_latents_for_unet_batch(self, img_list):
+        """
+        get_latents_for_unet 的批量版本，多张人脸一次送入 VAE 编码
+        :param img_list: 多张 256x256 BGR 人脸
+        :return: [N, 8, 32, 32] tensor
+        """
+        masked_image = torch.cat([self.preprocess_img(img, half_mask=True) for img in img_list], dim=0)
+        ref_image = torch.cat([self.preprocess_img(img, half_mask=False) for img in img_list], dim=0)
+        latents = self.encode_latents(torch.cat([masked_image, ref_image], dim=0))  # [2N, 4, 32, 32]
+        masked_latents, ref_latents = latents.chunk(2, dim=0)
+        return torch.cat([masked_latents, ref_latents], dim=1)
+
 if __name__ == "__main__":
     vae_mode_path = "./models/sd-vae-ft-mse/"
     vae = VAE(model_path = vae_mode_path,use_float16=False)
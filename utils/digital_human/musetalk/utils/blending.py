@@ -68,43 +68,94 @@ def get_image(image, face, face_box, fp_model, upper_boundary_ratio=0.5, expand=
 
 
 def get_image_prepare_material(image, face_box, fp_model, upper_boundary_ratio=0.5, expand=1.2):
-    body = Image.fromarray(image[:, :, ::-1])
-
+    masks, crop_boxes = get_image_prepare_material_batch([image], [face_box], fp_model, upper_boundary_ratio, expand)
+    return masks[0], crop_boxes[0]
+
+
+def get_image_prepare_material_batch(images, face_boxes, fp_model, upper_boundary_ratio=0.5, expand=1.2):
+    """多帧一起做人脸分割，生成融合用的 mask，返回 (mask_list, crop_box_list)"""
+    face_large_list = []
+    crop_box_list = []
+    for image, face_box in zip(images, face_boxes):
+        body = Image.fromarray(image[:, :, ::-1])
+        crop_box, s = get_crop_box(face_box, expand)
+        face_large_list.append(body.crop(crop_box))
+        crop_box_list.append(crop_box)
+
+    seg_image_list = fp_model.batch(face_large_list)
+
+    mask_list = []
+    for face_large, seg_image, face_box, crop_box in zip(face_large_list, seg_image_list, face_boxes, crop_box_list):
+        x, y, x1, y1 = face_box
+        x_s, y_s, x_e, y_e = crop_box
+        ori_shape = face_large.size
+
+        mask_image = seg_image.resize(ori_shape)
+        mask_small = mask_image.crop((x - x_s, y - y_s, x1 - x_s, y1 - y_s))
+        mask_image = Image.new("L", ori_shape, 0)
+        mask_image.paste(mask_small, (x - x_s, y - y_s, x1 - x_s, y1 - y_s))
+
+        # keep upper_boundary_ratio of talking area
+        width, height = mask_image.size
+        top_boundary = int(height * upper_boundary_ratio)
+        modified_mask_image = Image.new("L", ori_shape, 0)
+        modified_mask_image.paste(mask_image.crop((0, top_boundary, width, height)), (0, top_boundary))
+
+        blur_kernel_size = int(0.1 * ori_shape[0] // 2 * 2) + 1
+        mask_list.append(cv2.GaussianBlur(np.array(modified_mask_image), (blur_kernel_size, blur_kernel_size), 0))
+    return mask_list, crop_box_list
+
+
+def get_blending_region(image_shape, face_box, crop_box):
+    """人脸框和画面、crop_box 的交集，越界的部分不参与融合"""
+    height, width = image_shape[:2]
     x, y, x1, y1 = face_box
-    # print(x1-x,y1-y)
-    crop_box, s = get_crop_box(face_box, expand)
     x_s, y_s, x_e, y_e = crop_box
-
-    face_large = body.crop(crop_box)
-    ori_shape = face_large.size
-
-    mask_image = face_seg(face_large, fp_model)
-    mask_small = mask_image.crop((x - x_s, y - y_s, x1 - x_s, y1 - y_s))
-    mask_image = Image.new("L", ori_shape, 0)
-    mask_image.paste(mask_small, (x - x_s, y - y_s, x1 - x_s, y1 - y_s))
-
-    # keep upper_boundary_ratio of talking area
-    width, height = mask_image.size
-    top_boundary = int(height * upper_boundary_ratio)
-    modified_mask_image = Image.new("L", ori_shape, 0)
-    modified_mask_image.paste(mask_image.crop((0, top_boundary, width, height)), (0, top_boundary))
-
-    blur_kernel_size = int(0.1 * ori_shape[0] // 2 * 2) + 1
-    mask_array = cv2.GaussianBlur(np.array(modified_mask_image), (blur_kernel_size, blur_kernel_size), 0)
-    return mask_array, crop_box
-
-
-def get_image_blending(image, face, face_box, mask_array, crop_box):
-    body = Image.fromarray(image[:, :, ::-1])
-    face = Image.fromarray(face[:, :, ::-1])
-
-    x, y, x1, y1 = face_box
-    x_s, y_s, x_e, y_e = crop_box
-    face_large = body.crop(crop_box)
-
-    mask_image = Image.fromarray(mask_array)
-    mask_image = mask_image.convert("L")
-    face_large.paste(face, (x - x_s, y - y_s, x1 - x_s, y1 - y_s))
-    body.paste(face_large, crop_box[:2], mask_image)
-    body = np.array(body)
-    return body[:, :, ::-1]
+    return max(x, x_s, 0), max(y, y_s, 0), min(x1, x_e, width), min(y1, y_e, height)
+
+
+def get_blending_alpha(image_shape, face_box, mask_array, crop_box):
+    """预先计算融合用的 float mask，只保留人脸框区域
+
+    crop_box 中人脸框以外的区域融合前后都是原图，所以只需要人脸框内的 mask
+
+    Returns:
+        np.ndarray: [h, w, 1] float32，取值 0~1
+    """
+    if mask_array.ndim == 3:
+        mask_array = mask_array[:, :, 0]
+    x_s, y_s, _, _ = crop_box
+    bx, by, bx1, by1 = get_blending_region(image_shape, face_box, crop_box)
+    alpha = mask_array[by - y_s : by1 - y_s, bx - x_s : bx1 - x_s].astype(np.float32) / 255
+    return alpha[:, :, None]
+
+
+def blend_face(out, face, face_box, alpha, crop_box):
+    """把 face 按 alpha 融合进 out（原地修改），只处理人脸框区域"""
+    x, y, _, _ = face_box
+    bx, by, bx1, by1 = get_blending_region(out.shape, face_box, crop_box)
+    if bx1 <= bx or by1 <= by:
+        return out
+
+    body_region = out[by:by1, bx:bx1]
+    face_region = face[by - y : by1 - y, bx - x : bx1 - x]
+    blended = body_region + (face_region.astype(np.float32) - body_region) * alpha
+    np.copyto(body_region, blended + 0.5, casting="unsafe")  # 四舍五入
+    return out
+
+
+def get_image_blending(image, face, face_box, mask_array, crop_box, alpha=None, out=None):
+    """把生成的人脸融合回原图
+
+    Args:
+        alpha (np.ndarray | None): get_blending_alpha 预先算好的 mask，None 则现算
+        out (np.ndarray | None): 复用的输出 buffer，None 则新建，image 本身不会被修改
+    """
+    if alpha is None:
+        alpha = get_blending_alpha(image.shape, face_box, mask_array, crop_box)
+
+    if out is None:
+        out = image.copy()
+    else:
+        np.copyto(out, image)
+    return blend_face(out, face, face_box, alpha, crop_box)
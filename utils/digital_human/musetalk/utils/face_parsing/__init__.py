@@ -51,6 +51,21 @@ class FaceParsing:
         parsing = Image.fromarray(parsing.astype(np.uint8))
         return parsing
 
+    def batch(self, images, size=(512, 512)):
+        """多张 PIL 图像拼成一个 batch 做人脸分割，返回每张图的 mask（大小为 size）"""
+        if len(images) == 0:
+            return []
+
+        with torch.no_grad():
+            img = torch.stack([self.preprocess(image.resize(size, Image.BILINEAR)) for image in images])
+            if torch.cuda.is_available():
+                img = img.cuda()
+            out = self.net(img)[0]
+            parsing = out.argmax(1).cpu().numpy()
+            parsing[np.where(parsing > 13)] = 0
+            parsing[np.where(parsing >= 1)] = 255
+        return [Image.fromarray(p.astype(np.uint8)) for p in parsing]
+
 
 if __name__ == "__main__":
     fp = FaceParsing()
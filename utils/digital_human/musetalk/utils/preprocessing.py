@@ -1,11 +1,12 @@
+import glob
+import os
 import pickle
 
 import cv2
 import numpy as np
 import torch
 from face_detection import FaceAlignment, LandmarksType
-from mmpose.apis import inference_topdown
-from mmpose.structures import merge_data_samples
+from mmengine.dataset import Compose, pseudo_collate
 from tqdm import tqdm
 
 # initialize the face detection model
@@ -33,110 +34,147 @@ def read_imgs(img_list):
     return frames
 
 
-def get_bbox_range(img_list, model, upperbondrange=0):
-    frames = read_imgs(img_list)
-    batch_size_fa = 1
-    batches = [frames[i : i + batch_size_fa] for i in range(0, len(frames), batch_size_fa)]
+def read_frames(video_path, chunk_size=32):
+    """
+    分块读取视频帧，每次 yield chunk_size 帧，内存里最多只有一块
+    :param video_path: 视频文件，或者存放 png / jpg 帧的目录
+    """
+    if os.path.isfile(video_path):
+        cap = cv2.VideoCapture(video_path)
+        frames = []
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+            if len(frames) >= chunk_size:
+                yield frames
+                frames = []
+        cap.release()
+        if len(frames) > 0:
+            yield frames
+        return
+
+    img_list = sorted(glob.glob(os.path.join(video_path, "*.[jpJP][pnPN]*[gG]")))
+    for i in range(0, len(img_list), chunk_size):
+        yield [cv2.imread(img_path) for img_path in img_list[i : i + chunk_size]]
+
+
+def inference_topdown_batch(model, frames):
+    """
+    多帧一起跑 DWPose，返回每帧的 68 个人脸关键点
+
+    和 mmpose 的 inference_topdown 一样用整张图作为 bbox，只是把多帧的数据拼成一个 batch
+    """
+    pipeline = Compose(model.cfg.test_dataloader.dataset.pipeline)
+    data_list = []
+    for frame in frames:
+        h, w = frame.shape[:2]
+        data_info = dict(img=frame, bbox=np.array([[0, 0, w, h]], dtype=np.float32), bbox_score=np.ones(1, dtype=np.float32))
+        data_info.update(model.dataset_meta)
+        data_list.append(pipeline(data_info))
+
+    with torch.no_grad():
+        results = model.test_step(pseudo_collate(data_list))
+    return [result.pred_instances.keypoints[0][23:91].astype(np.int32) for result in results]
+
+
+def get_face_bboxes(frames, model, upperbondrange=0):
+    """
+    一个 batch 的人脸框：S3FD 人脸检测 + DWPose 关键点修正上边界
+    :return: (coords_list, range_minus_list, range_plus_list)
+    """
+    face_land_marks = inference_topdown_batch(model, frames)
+    # get bounding boxes by face detetion
+    if all(frame.shape == frames[0].shape for frame in frames):
+        bboxes = fa.get_detections_for_batch(np.asarray(frames))
+    else:
+        # 图片目录里的帧尺寸可能不一致，没法拼成一个 batch，逐帧检测
+        bboxes = [fa.get_detections_for_batch(np.asarray([frame]))[0] for frame in frames]
+
     coords_list = []
-    landmarks = []
+    average_range_minus = []
+    average_range_plus = []
+    # adjust the bounding box refer to landmark
+    # Add the bounding box to a tuple and append it to the coordinates list
+    for f, face_land_mark in zip(bboxes, face_land_marks):
+        if f is None:  # no face in the image
+            coords_list += [coord_placeholder]
+            continue
+
+        half_face_coord = face_land_mark[29]  # np.mean([face_land_mark[28], face_land_mark[29]], axis=0)
+        range_minus = (face_land_mark[30] - face_land_mark[29])[1]
+        range_plus = (face_land_mark[29] - face_land_mark[28])[1]
+        average_range_minus.append(range_minus)
+        average_range_plus.append(range_plus)
+        if upperbondrange != 0:
+            half_face_coord[1] = upperbondrange + half_face_coord[1]  # 手动调整  + 向下（偏29）  - 向上（偏28）
+        half_face_dist = np.max(face_land_mark[:, 1]) - half_face_coord[1]
+        upper_bond = half_face_coord[1] - half_face_dist
+
+        f_landmark = (
+            np.min(face_land_mark[:, 0]),
+            int(upper_bond),
+            np.max(face_land_mark[:, 0]),
+            np.max(face_land_mark[:, 1]),
+        )
+        x1, y1, x2, y2 = f_landmark
+
+        if y2 - y1 <= 0 or x2 - x1 <= 0 or x1 < 0:  # if the landmark bbox is not suitable, reuse the bbox
+            coords_list += [f]
+            print("error bbox:", f)
+        else:
+            coords_list += [f_landmark]
+
+    return coords_list, average_range_minus, average_range_plus
+
+
+def get_bbox_range_text(frame_num, average_range_minus, average_range_plus, upperbondrange):
+    return f"Total frame:「{frame_num}」 Manually adjust range : [ -{int(sum(average_range_minus) / len(average_range_minus))}~{int(sum(average_range_plus) / len(average_range_plus))} ] , the current value: {upperbondrange}"
+
+
+def print_bbox_range(frame_num, average_range_minus, average_range_plus, upperbondrange):
+    print(
+        "********************************************bbox_shift parameter adjustment**********************************************************"
+    )
+    print(get_bbox_range_text(frame_num, average_range_minus, average_range_plus, upperbondrange))
+    print(
+        "*************************************************************************************************************************************"
+    )
+
+
+def get_bbox_range(img_list, model, upperbondrange=0, batch_size=16):
+    frames = read_imgs(img_list)
     if upperbondrange != 0:
         print("get key_landmark and face bounding boxes with the bbox_shift:", upperbondrange)
     else:
         print("get key_landmark and face bounding boxes with the default value")
     average_range_minus = []
     average_range_plus = []
-    for fb in tqdm(batches):
-        results = inference_topdown(model, np.asarray(fb)[0])
-        results = merge_data_samples(results)
-        keypoints = results.pred_instances.keypoints
-        face_land_mark = keypoints[0][23:91]
-        face_land_mark = face_land_mark.astype(np.int32)
-
-        # get bounding boxes by face detetion
-        bbox = fa.get_detections_for_batch(np.asarray(fb))
-
-        # adjust the bounding box refer to landmark
-        # Add the bounding box to a tuple and append it to the coordinates list
-        for j, f in enumerate(bbox):
-            if f is None:  # no face in the image
-                coords_list += [coord_placeholder]
-                continue
-
-            half_face_coord = face_land_mark[29]  # np.mean([face_land_mark[28], face_land_mark[29]], axis=0)
-            range_minus = (face_land_mark[30] - face_land_mark[29])[1]
-            range_plus = (face_land_mark[29] - face_land_mark[28])[1]
-            average_range_minus.append(range_minus)
-            average_range_plus.append(range_plus)
-            if upperbondrange != 0:
-                half_face_coord[1] = upperbondrange + half_face_coord[1]  # 手动调整  + 向下（偏29）  - 向上（偏28）
-
-    text_range = f"Total frame:「{len(frames)}」 Manually adjust range : [ -{int(sum(average_range_minus) / len(average_range_minus))}~{int(sum(average_range_plus) / len(average_range_plus))} ] , the current value: {upperbondrange}"
-    return text_range
-
-
-def get_landmark_and_bbox(img_list, model, upperbondrange=0):
+    for i in tqdm(range(0, len(frames), batch_size)):
+        _, range_minus, range_plus = get_face_bboxes(frames[i : i + batch_size], model, upperbondrange)
+        average_range_minus += range_minus
+        average_range_plus += range_plus
+
+    return get_bbox_range_text(len(frames), average_range_minus, average_range_plus, upperbondrange)
+
+
+def get_landmark_and_bbox(img_list, model, upperbondrange=0, batch_size=16):
     frames = read_imgs(img_list)
-    batch_size_fa = 1
-    batches = [frames[i : i + batch_size_fa] for i in range(0, len(frames), batch_size_fa)]
     coords_list = []
-    landmarks = []
     if upperbondrange != 0:
         print("get key_landmark and face bounding boxes with the bbox_shift:", upperbondrange)
     else:
         print("get key_landmark and face bounding boxes with the default value")
     average_range_minus = []
     average_range_plus = []
-    for fb in tqdm(batches):
-        results = inference_topdown(model, np.asarray(fb)[0])
-        results = merge_data_samples(results)
-        keypoints = results.pred_instances.keypoints
-        face_land_mark = keypoints[0][23:91]
-        face_land_mark = face_land_mark.astype(np.int32)
-
-        # get bounding boxes by face detetion
-        bbox = fa.get_detections_for_batch(np.asarray(fb))
-
-        # adjust the bounding box refer to landmark
-        # Add the bounding box to a tuple and append it to the coordinates list
-        for j, f in enumerate(bbox):
-            if f is None:  # no face in the image
-                coords_list += [coord_placeholder]
-                continue
-
-            half_face_coord = face_land_mark[29]  # np.mean([face_land_mark[28], face_land_mark[29]], axis=0)
-            range_minus = (face_land_mark[30] - face_land_mark[29])[1]
-            range_plus = (face_land_mark[29] - face_land_mark[28])[1]
-            average_range_minus.append(range_minus)
-            average_range_plus.append(range_plus)
-            if upperbondrange != 0:
-                half_face_coord[1] = upperbondrange + half_face_coord[1]  # 手动调整  + 向下（偏29）  - 向上（偏28）
-            half_face_dist = np.max(face_land_mark[:, 1]) - half_face_coord[1]
-            upper_bond = half_face_coord[1] - half_face_dist
-
-            f_landmark = (
-                np.min(face_land_mark[:, 0]),
-                int(upper_bond),
-                np.max(face_land_mark[:, 0]),
-                np.max(face_land_mark[:, 1]),
-            )
-            x1, y1, x2, y2 = f_landmark
-
-            if y2 - y1 <= 0 or x2 - x1 <= 0 or x1 < 0:  # if the landmark bbox is not suitable, reuse the bbox
-                coords_list += [f]
-                w, h = f[2] - f[0], f[3] - f[1]
-                print("error bbox:", f)
-            else:
-                coords_list += [f_landmark]
+    for i in tqdm(range(0, len(frames), batch_size)):
+        coords, range_minus, range_plus = get_face_bboxes(frames[i : i + batch_size], model, upperbondrange)
+        coords_list += coords
+        average_range_minus += range_minus
+        average_range_plus += range_plus
 
-    print(
-        "********************************************bbox_shift parameter adjustment**********************************************************"
-    )
-    print(
-        f"Total frame:「{len(frames)}」 Manually adjust range : [ -{int(sum(average_range_minus) / len(average_range_minus))}~{int(sum(average_range_plus) / len(average_range_plus))} ] , the current value: {upperbondrange}"
-    )
-    print(
-        "*************************************************************************************************************************************"
-    )
+    print_bbox_range(len(frames), average_range_minus, average_range_plus, upperbondrange)
     return coords_list, frames
 
 
@@ -0,0 +1,78 @@
+"""
+numpy 融合和原来 PIL paste 的结果一致（PIL 内部整数取整，允许 1 的误差）
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("cv2")
+blending = pytest.importorskip("utils.digital_human.musetalk.utils.blending")
+
+
+def get_image_blending_pil(image, face, face_box, mask_array, crop_box):
+    """原来的 PIL 版本"""
+    body = Image.fromarray(image[:, :, ::-1])
+    face = Image.fromarray(face[:, :, ::-1])
+
+    x, y, x1, y1 = face_box
+    x_s, y_s, x_e, y_e = crop_box
+    face_large = body.crop(crop_box)
+
+    mask_image = Image.fromarray(mask_array)
+    mask_image = mask_image.convert("L")
+    face_large.paste(face, (x - x_s, y - y_s, x1 - x_s, y1 - y_s))
+    body.paste(face_large, crop_box[:2], mask_image)
+    body = np.array(body)
+    return body[:, :, ::-1]
+
+
+def make_inputs(image_shape, face_box, seed=0):
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 256, (*image_shape, 3), dtype=np.uint8)
+    x, y, x1, y1 = face_box
+    face = rng.integers(0, 256, (y1 - y, x1 - x, 3), dtype=np.uint8)
+    crop_box, _ = blending.get_crop_box(face_box, 1.2)
+    crop_w, crop_h = crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]
+    mask_array = rng.integers(0, 256, (crop_h, crop_w), dtype=np.uint8)
+    mask_array[: crop_h // 4] = 0  # 和真实 mask 一样，上半部分有全 0 的区域
+    mask_array[-4:] = 255
+    return image, face, mask_array, crop_box
+
+
+@pytest.mark.parametrize(
+    "face_box",
+    [
+        (60, 50, 160, 150),  # crop_box 在画面内
+        (5, 8, 105, 108),  # crop_box 超出左上边界
+        (140, 100, 200, 160),  # crop_box 超出右下边界
+    ],
+)
+def test_matches_pil(face_box):
+    image, face, mask_array, crop_box = make_inputs((160, 200), face_box)
+    expected = get_image_blending_pil(image, face, face_box, mask_array, crop_box)
+
+    image_copy = image.copy()
+    result = blending.get_image_blending(image, face, face_box, mask_array, crop_box)
+    np.testing.assert_array_equal(image, image_copy)  # 不修改输入
+    assert result.shape == expected.shape
+    assert result.dtype == np.uint8
+    assert np.abs(result.astype(np.int16) - expected.astype(np.int16)).max() <= 1
+
+
+def test_precomputed_alpha_and_out_buffer():
+    face_box = (60, 50, 160, 150)
+    image, face, mask_array, crop_box = make_inputs((160, 200), face_box, seed=1)
+    expected = blending.get_image_blending(image, face, face_box, mask_array, crop_box)
+
+    alpha = blending.get_blending_alpha(image.shape, face_box, mask_array, crop_box)
+    out = np.zeros_like(image)
+    result = blending.get_image_blending(image, face, face_box, mask_array, crop_box, alpha=alpha, out=out)
+    assert result is out
+    np.testing.assert_array_equal(result, expected)
+
+    # 复用同一个 buffer 融合下一帧，不会残留上一帧的结果
+    next_image, next_face, _, _ = make_inputs((160, 200), face_box, seed=2)
+    expected = blending.get_image_blending(next_image, next_face, face_box, mask_array, crop_box)
+    result = blending.get_image_blending(next_image, next_face, face_box, mask_array, crop_box, alpha=alpha, out=out)
+    np.testing.assert_array_equal(result, expected)
@@ -43,6 +43,16 @@ def datagen(whisper_chunks,
             vae_encode_latents,
             batch_size=8,
             delay_frame=0):
+    if isinstance(whisper_chunks, np.ndarray):
+        # feature2chunks 返回的连续数组直接按 batch 切片，不需要逐帧 np.stack
+        for start in range(0, len(whisper_chunks), batch_size):
+            whisper_batch = whisper_chunks[start : start + batch_size]
+            latent_batch = torch.cat(
+                [vae_encode_latents[(i + delay_frame) % len(vae_encode_latents)] for i in range(start, start + len(whisper_batch))], dim=0
+            )
+            yield whisper_batch, latent_batch
+        return
+
     whisper_batch, latent_batch = [], []
     for i, w in enumerate(whisper_chunks):
         idx = (i+delay_frame)%len(vae_encode_latents)
@@ -62,3 +72,65 @@ def datagen(whisper_chunks,
         latent_batch = torch.cat(latent_batch, dim=0)
 
         yield whisper_batch, latent_batch
+
+
+def prefetch_datagen(whisper_chunks,
+                     latents,
+                     latent_cycle_index,
+                     batch_size=8,
+                     delay_frame=0):
+    """
+    datagen 的 GPU 版本，yield 的 whisper_batch / latent_batch 都已经在 latents 所在的设备上
+
+    - latent 整体常驻 GPU，按 (帧下标 + delay_frame) 取循环索引后用 index_select 一次取出一个 batch
+    - whisper 特征先拷进两块轮换的 pinned buffer，在单独的 CUDA stream 上异步上传，
+      下一个 batch 的准备和上传与当前 batch 的 UNet / VAE 计算重叠
+    :param whisper_chunks: feature2chunks 返回的 [frames, 50, 384] 数组
+    :param latents: [M, 8, 32, 32] 所有参考 latent
+    :param latent_cycle_index: latent 的循环索引（正序 + 倒序）
+    """
+    device = latents.device
+    latent_cycle_index = torch.as_tensor(latent_cycle_index, device=device)
+    if device.type != "cuda":
+        for start in range(0, len(whisper_chunks), batch_size):
+            whisper_batch = torch.from_numpy(np.ascontiguousarray(whisper_chunks[start:start + batch_size]))
+            frame_idx = torch.arange(start, start + len(whisper_batch), device=device) + delay_frame
+            yield whisper_batch, latents.index_select(0, latent_cycle_index[frame_idx % len(latent_cycle_index)])
+        return
+
+    copy_stream = torch.cuda.Stream(device)
+    pinned_buffers = [
+        torch.empty((batch_size,) + whisper_chunks.shape[1:], dtype=torch.from_numpy(whisper_chunks[:0]).dtype).pin_memory()
+        for _ in range(2)
+    ]
+    copy_events = [None, None]
+
+    def _upload(batch_idx):
+        start = batch_idx * batch_size
+        chunk = whisper_chunks[start:start + batch_size]
+        buffer_idx = batch_idx % 2
+        if copy_events[buffer_idx] is not None:
+            copy_events[buffer_idx].synchronize()  # 上一次用这块 buffer 的拷贝完成后才能覆盖
+        pinned = pinned_buffers[buffer_idx][:len(chunk)]
+        pinned.numpy()[...] = chunk
+
+        with torch.cuda.stream(copy_stream):
+            whisper_batch = pinned.to(device, non_blocking=True)
+            copy_events[buffer_idx] = torch.cuda.Event()
+            copy_events[buffer_idx].record(copy_stream)
+
+        frame_idx = torch.arange(start, start + len(chunk), device=device) + delay_frame
+        latent_batch = latents.index_select(0, latent_cycle_index[frame_idx % len(latent_cycle_index)])
+        return whisper_batch, latent_batch, copy_events[buffer_idx]
+
+    batch_num = (len(whisper_chunks) + batch_size - 1) // batch_size
+    next_batch = _upload(0) if batch_num > 0 else None
+    for batch_idx in range(batch_num):
+        whisper_batch, latent_batch, copy_event = next_batch
+        if batch_idx + 1 < batch_num:
+            next_batch = _upload(batch_idx + 1)
+
+        current_stream = torch.cuda.current_stream(device)
+        current_stream.wait_event(copy_event)
+        whisper_batch.record_stream(current_stream)
+        yield whisper_batch, latent_batch
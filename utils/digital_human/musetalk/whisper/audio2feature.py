@@ -1,11 +1,40 @@
 import os
 from .whisper import load_model
+from .whisper.audio import HOP_LENGTH, N_FRAMES, SAMPLE_RATE, load_audio, log_mel_spectrogram, pad_or_trim
 import soundfile as sf
 import numpy as np
 import time
 import sys
+import torch
 sys.path.append("..")
 
+
+@torch.no_grad()
+def encode_mel(model, mel, batch_size=8):
+    """
+    只跑 whisper encoder，返回每层的 embedding
+
+    mel 按 30s 窗口切分，最后一个窗口补齐，多个窗口拼成一个 batch 送入 encoder，
+    和 transcribe 一样每个窗口只保留有效部分（mel 帧数 / 2）
+    :param mel: [80, n_frames] 整段音频的 log-mel
+    :param batch_size: 每次送入 encoder 的窗口数
+    :return: [n_frames // 2, layers, 384]
+    """
+    dtype = torch.float16 if model.device.type == "cuda" else torch.float32
+    num_frames = mel.shape[-1]
+    window_starts = list(range(0, num_frames, N_FRAMES))
+    segments = torch.stack([pad_or_trim(mel[:, seek : seek + N_FRAMES], N_FRAMES) for seek in window_starts])
+
+    embed_list = []
+    for i in range(0, len(segments), batch_size):
+        batch = segments[i : i + batch_size].to(model.device).to(dtype)
+        _, embeddings = model.encoder(batch, include_embeddings=True)  # [B, layers, 1500, 384]
+        embeddings = embeddings.transpose(0, 2, 1, 3)  # [B, 1500, layers, 384]
+        for seek, encoder_embeddings in zip(window_starts[i : i + batch_size], embeddings):
+            embed_list.append(encoder_embeddings[: (min(seek + N_FRAMES, num_frames) - seek) // 2])
+    return np.concatenate(embed_list, axis=0)
+
+
 class Audio2Feature():
     def __init__(self, 
                  whisper_model_type="tiny",
@@ -44,6 +73,23 @@ class Audio2Feature():
         selected_feature = selected_feature.reshape(-1, 384)# 50*384
         return selected_feature,selected_idx
 
+    def get_sliced_features(self, feature_array, vid_idx, audio_feat_length=[2, 2], fps=25):
+        """
+        get_sliced_feature 的向量化版本，一次取出多帧的特征
+
+        所有帧的窗口下标算成一个 [frames, window] 的整数数组，一次 fancy index 取出
+        :param feature_array: [T, layers, 384]
+        :param vid_idx: 视频帧下标数组
+        :return: [frames, 50, 384] 连续数组
+        """
+        vid_idx = np.asarray(vid_idx, dtype=np.int64)
+        center_idx = (vid_idx * 50 / fps).astype(np.int64)
+        offsets = np.arange(-audio_feat_length[0] * 2, (audio_feat_length[1] + 1) * 2)
+        selected_idx = np.clip(center_idx[:, None] + offsets[None, :], 0, len(feature_array) - 1)
+
+        selected_feature = feature_array[selected_idx]  # [frames, window, layers, 384]
+        return selected_feature.reshape(len(vid_idx), -1, 384)  # frames*50*384
+
     def get_sliced_feature_sparse(self,feature_array, vid_idx, audio_feat_length= [2,2],fps = 25):
         """
         Get sliced features based on a given index
@@ -79,35 +125,125 @@ class Audio2Feature():
     
 
     def feature2chunks(self,feature_array,fps,audio_feat_length = [2,2]):
-        whisper_chunks = []
-        whisper_idx_multiplier = 50./fps 
-        i = 0
+        """
+        所有视频帧的音频特征，返回 [frames, 50, 384] 连续数组，datagen 可以直接按 batch 切片
+        帧数和原来逐帧循环一致：一直生成到第一个 int(i * 50 / fps) > len(feature_array) 的帧（包含该帧）
+        """
         print(f"video in {fps} FPS, audio idx in 50FPS")
-        while 1:
-            start_idx = int(i * whisper_idx_multiplier)
-            selected_feature,selected_idx = self.get_sliced_feature(feature_array= feature_array,vid_idx = i,audio_feat_length=audio_feat_length,fps=fps)
-            #print(f"i:{i},selected_idx {selected_idx}")
-            whisper_chunks.append(selected_feature)
-            i += 1
-            if start_idx>len(feature_array):
-                break
-
-        return whisper_chunks
+        frame_num = get_frame_num(len(feature_array), fps)
+        return self.get_sliced_features(feature_array, np.arange(frame_num), audio_feat_length=audio_feat_length, fps=fps)
 
     def audio2feat(self,audio_path):
-        # get the sample rate of the audio
-        result = self.model.transcribe(audio_path)
-        embed_list = []
-        for emb in result['segments']:
-            encoder_embeddings = emb['encoder_embeddings']
-            encoder_embeddings = encoder_embeddings.transpose(0,2,1,3)
-            encoder_embeddings = encoder_embeddings.squeeze(0)
-            start_idx = int(emb['start'])
-            end_idx = int(emb['end'])
-            emb_end_idx = int((end_idx - start_idx)/2)
-            embed_list.append(encoder_embeddings[:emb_end_idx])
-        concatenated_array = np.concatenate(embed_list, axis=0)
-        return concatenated_array
+        # 只需要 encoder 的 embedding，不走 transcribe，整段 log-mel 在 GPU 上计算，所有 30s 窗口批量编码
+        audio = torch.from_numpy(load_audio(audio_path)).to(self.model.device)
+        mel = log_mel_spectrogram(audio)
+        return encode_mel(self.model, mel)
+
+class StreamAudio2Feature():
+    """
+    流式 whisper 特征：音频分段送入，特征按块计算，输出后不再变化
+
+    whisper 的 log-mel 按整个窗口归一化（clamp 到 max - 8），encoder 又在整个补齐的 30s 窗口上做双向 attention，
+    同一个窗口里每一帧的特征都会随后续音频变化，没法只把末尾几帧当成不稳定。
+    这里按 hop_sec 切块：每块连同左边 left_context_sec、右边 lookahead_sec 的音频单独编码一次，只取块内的特征，
+    音频到达块终点 + lookahead 时这一块就关闭，特征固定下来；finish 时剩余音频作为最后一块。
+    因为上下文只有几秒，输出的特征和离线 audio2feat（30s 窗口）并不完全相同，但已经生成的视频段和最终特征一致。
+    """
+
+    SAMPLES_PER_FEATURE = HOP_LENGTH * 2  # 每个特征帧对应的采样点数（50Hz）
+
+    def __init__(self, model, hop_sec=2.0, left_context_sec=1.0, lookahead_sec=1.0):
+        self.model = model
+        self.hop_samples = self.sec_to_samples(hop_sec)
+        self.left_context_samples = self.sec_to_samples(left_context_sec)
+        self.lookahead_samples = self.sec_to_samples(lookahead_sec)
+
+        self.audio = np.zeros(0, dtype=np.float32)  # 16k 单声道，只保留还会用到的部分
+        self.audio_start = 0  # self.audio 第一个采样点在整段音频中的位置
+        self.audio_len = 0  # 已经送入的总采样点数
+        self.done_samples = 0  # 已经输出特征的采样点数，始终是 SAMPLES_PER_FEATURE 的整数倍
+        self.done_features = []
+        self.finished = False
+
+    @classmethod
+    def sec_to_samples(cls, sec):
+        return max(1, int(sec * SAMPLE_RATE / cls.SAMPLES_PER_FEATURE)) * cls.SAMPLES_PER_FEATURE
+
+    def encode(self, audio):
+        """编码一段音频（不超过 30s），返回 [T, layers, 384]，T = mel 帧数 / 2"""
+        return encode_mel(self.model, log_mel_spectrogram(torch.from_numpy(audio)))
+
+    def _encode_block(self, block_end):
+        """编码 [done_samples, block_end) 这一块（带左右上下文），把块内的特征加入输出"""
+        context_start = max(0, self.done_samples - self.left_context_samples)
+        context_end = min(self.audio_len, block_end + self.lookahead_samples)
+        features = self.encode(self.audio[context_start - self.audio_start : context_end - self.audio_start])
+
+        offset = (self.done_samples - context_start) // self.SAMPLES_PER_FEATURE
+        if block_end >= self.audio_len:
+            block_features = features[offset:]  # 最后一块，和离线一样取到音频结尾
+        else:
+            block_features = features[offset : offset + (block_end - self.done_samples) // self.SAMPLES_PER_FEATURE]
+        self.done_features.append(block_features)
+        self.done_samples = block_end
+
+        # 之后的块只会用到 done_samples - left_context 之后的音频
+        keep_start = max(0, self.done_samples - self.left_context_samples)
+        self.audio = self.audio[keep_start - self.audio_start :]
+        self.audio_start = keep_start
+
+    def feed(self, audio):
+        """送入新的 16k float32 音频"""
+        self.audio = np.concatenate([self.audio, audio.astype(np.float32)])
+        self.audio_len += len(audio)
+
+        # 右边的 lookahead 已经到达的块可以关闭
+        while self.done_samples + self.hop_samples + self.lookahead_samples <= self.audio_len:
+            self._encode_block(self.done_samples + self.hop_samples)
+
+    def finish(self):
+        """音频结束，剩余的音频作为最后一块"""
+        if self.finished:
+            return
+        self.finished = True
+        if self.audio_len > self.done_samples:
+            self._encode_block(self.audio_len)
+
+    @property
+    def features(self):
+        if len(self.done_features) == 0:
+            return np.zeros((0, 5, 384), dtype=np.float32)
+        return np.concatenate(self.done_features, axis=0)
+
+    @property
+    def stable_length(self):
+        """不会再变化的特征帧数，输出的特征都已经固定"""
+        return sum(len(f) for f in self.done_features)
+
+
+def get_frame_num(feature_len, fps):
+    """feature2chunks 生成的帧数：一直生成到第一个 int(i * 50 / fps) > feature_len 的帧（包含该帧）"""
+    whisper_idx_multiplier = 50. / fps
+    vid_idx = np.arange(int(feature_len / whisper_idx_multiplier) + 3)
+    start_idx = (vid_idx * whisper_idx_multiplier).astype(np.int64)
+    return int(np.argmax(start_idx > feature_len)) + 1
+
+
+def get_ready_frame_num(feature_len, stable_len, fps, finished, audio_feat_length=[2, 2]):
+    """
+    流式生成时可以生成的视频帧数
+
+    第 i 帧用到的特征下标最大为 int(i * 50 / fps) + (audio_feat_length[1] + 1) * 2 - 1（同 get_sliced_features），
+    全部稳定后才能生成；结束时和 feature2chunks 保持一致
+    """
+    if finished:
+        return get_frame_num(feature_len, fps) if feature_len > 0 else 0
+    limit = stable_len - (audio_feat_length[1] + 1) * 2  # center_idx 的上限
+    if limit < 0:
+        return 0
+    vid_idx = np.arange(int(limit * fps / 50) + 2)
+    return int(np.sum((vid_idx * 50 / fps).astype(np.int64) <= limit))
+
 
 if __name__ == "__main__":
     audio_processor = Audio2Feature(model_path="../../models/whisper/whisper_tiny.pt")
@@ -0,0 +1,130 @@
+"""
+feature2chunks 向量化后和原来逐帧循环的结果一致，流式特征输出后不再变化
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+audio2feature = pytest.importorskip("utils.digital_human.musetalk.whisper.audio2feature")
+
+Audio2Feature = audio2feature.Audio2Feature
+StreamAudio2Feature = audio2feature.StreamAudio2Feature
+
+
+@pytest.fixture
+def audio_processor():
+    # 只测切片逻辑，不加载 whisper 模型
+    return Audio2Feature.__new__(Audio2Feature)
+
+
+def make_feature_array(length, layers=5):
+    return np.random.default_rng(length).standard_normal((length, layers, 384)).astype(np.float32)
+
+
+def feature2chunks_loop(audio_processor, feature_array, fps, audio_feat_length=[2, 2]):
+    """原来的逐帧循环版本"""
+    whisper_chunks = []
+    whisper_idx_multiplier = 50.0 / fps
+    i = 0
+    while 1:
+        start_idx = int(i * whisper_idx_multiplier)
+        selected_feature, _ = audio_processor.get_sliced_feature(
+            feature_array=feature_array, vid_idx=i, audio_feat_length=audio_feat_length, fps=fps
+        )
+        whisper_chunks.append(selected_feature)
+        i += 1
+        if start_idx > len(feature_array):
+            break
+    return whisper_chunks
+
+
+@pytest.mark.parametrize("fps", [25, 30, 24])
+@pytest.mark.parametrize("length", [1, 7, 50, 123])
+def test_feature2chunks_matches_loop(audio_processor, fps, length):
+    feature_array = make_feature_array(length)
+    expected = np.stack(feature2chunks_loop(audio_processor, feature_array, fps))
+    chunks = audio_processor.feature2chunks(feature_array, fps)
+
+    assert chunks.shape == expected.shape
+    assert chunks.flags["C_CONTIGUOUS"]
+    np.testing.assert_array_equal(chunks, expected)
+    assert audio2feature.get_frame_num(length, fps) == len(expected)
+
+
+@pytest.mark.parametrize("audio_feat_length", [[2, 2], [1, 3]])
+def test_get_sliced_features_matches_loop(audio_processor, audio_feat_length):
+    feature_array = make_feature_array(40)
+    vid_idx = [0, 1, 5, 19, 20, 25]
+    expected = np.stack(
+        [
+            audio_processor.get_sliced_feature(feature_array, i, audio_feat_length=audio_feat_length, fps=25)[0]
+            for i in vid_idx
+        ]
+    )
+    np.testing.assert_array_equal(
+        audio_processor.get_sliced_features(feature_array, vid_idx, audio_feat_length=audio_feat_length, fps=25),
+        expected,
+    )
+
+
+@pytest.mark.parametrize("fps", [25, 30])
+def test_get_ready_frame_num(fps):
+    audio_feat_length = [2, 2]
+    feature_len = 200
+    last_ready = 0
+    for stable_len in range(feature_len + 1):
+        ready = audio2feature.get_ready_frame_num(feature_len, stable_len, fps, False, audio_feat_length)
+        assert ready >= last_ready
+        last_ready = ready
+        # 已生成的帧用到的特征都已经稳定
+        for i in range(ready):
+            assert int(i * 50 / fps) + (audio_feat_length[1] + 1) * 2 - 1 < stable_len
+        # 再多一帧就会用到还没稳定的特征
+        assert int(ready * 50 / fps) + (audio_feat_length[1] + 1) * 2 - 1 >= stable_len
+
+    assert last_ready <= audio2feature.get_frame_num(feature_len, fps)
+    assert audio2feature.get_ready_frame_num(feature_len, feature_len, fps, True) == audio2feature.get_frame_num(
+        feature_len, fps
+    )
+    assert audio2feature.get_ready_frame_num(0, 0, fps, True) == 0
+
+
+class PositionStreamAudio2Feature(StreamAudio2Feature):
+    """不跑 whisper：每个特征帧的值就是它对应的第一个采样点，方便检查对齐"""
+
+    def encode(self, audio):
+        num = len(audio) // self.SAMPLES_PER_FEATURE
+        values = audio[: num * self.SAMPLES_PER_FEATURE : self.SAMPLES_PER_FEATURE]
+        return np.broadcast_to(values[:, None, None], (num, 5, 384)).astype(np.float32)
+
+
+@pytest.mark.parametrize("total_samples", [1000, 16000 * 3 + 123, 16000 * 7])
+def test_stream_features_are_stable(total_samples):
+    audio = np.arange(total_samples, dtype=np.float32)
+    stream = PositionStreamAudio2Feature(model=None)
+
+    rng = np.random.default_rng(total_samples)
+    history = []
+    pos = 0
+    while pos < total_samples:
+        step = int(rng.integers(1, 8000))
+        stream.feed(audio[pos : pos + step])
+        pos += step
+
+        features = stream.features
+        assert stream.stable_length == len(features)
+        history.append(features.copy())
+
+    stream.finish()
+    stream.finish()  # 重复调用不会再编码
+    features = stream.features
+
+    # 总帧数和离线一致：mel 帧数 / 2
+    assert len(features) == total_samples // StreamAudio2Feature.SAMPLES_PER_FEATURE
+    np.testing.assert_array_equal(
+        features[:, 0, 0], np.arange(len(features), dtype=np.float32) * StreamAudio2Feature.SAMPLES_PER_FEATURE
+    )
+    # 已经输出的特征之后不再变化
+    for old_features in history:
+        np.testing.assert_array_equal(features[: len(old_features)], old_features)
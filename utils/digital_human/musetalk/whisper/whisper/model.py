@@ -154,18 +154,19 @@ class AudioEncoder(nn.Module):
         assert x.shape[1:] == self.positional_embedding.shape, "incorrect audio shape"
         x = (x + self.positional_embedding).to(x.dtype)
 
+        # 每层的输出先留在 GPU 上，最后一次性拷回 CPU，避免每层同步一次
         if include_embeddings:
-            embeddings = [x.cpu().detach().numpy()]
+            embeddings = [x.detach()]
 
         for block in self.blocks:
             x = block(x)
             if include_embeddings:
-                embeddings.append(x.cpu().detach().numpy())
+                embeddings.append(x.detach())
 
         x = self.ln_post(x)
 
         if include_embeddings:
-            embeddings = np.stack(embeddings, axis=1)
+            embeddings = torch.stack(embeddings, dim=1).cpu().numpy()
             return x, embeddings
         else:
             return x
@@ -1,5 +1,3 @@
-import copy
-from datetime import datetime
 import glob
 import json
 import os
@@ -8,6 +6,9 @@ import queue
 import shutil
 import threading
 import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Optional
@@ -21,11 +22,17 @@ from tqdm import tqdm
 
 from utils.digital_human.musetalk.models.unet import PositionalEncoding, UNet
 from utils.digital_human.musetalk.models.vae import VAE
-from utils.digital_human.musetalk.utils.blending import get_image_blending, get_image_prepare_material, init_face_parsing_model
+from utils.digital_human.musetalk.utils.blending import (
+    get_image_blending,
+    get_image_prepare_material_batch,
+    init_face_parsing_model,
+)
 from utils.digital_human.musetalk.utils.face_parsing import FaceParsing
-from utils.digital_human.musetalk.utils.preprocessing import get_landmark_and_bbox, read_imgs
-from utils.digital_human.musetalk.utils.utils import datagen, load_all_model
+from utils.digital_human.musetalk.utils.preprocessing import get_face_bboxes, print_bbox_range, read_frames, read_imgs
+from utils.digital_human.musetalk.utils.utils import load_all_model, prefetch_datagen
 from utils.digital_human.musetalk.whisper.audio2feature import Audio2Feature
+from utils.digital_human.avatar_bundle import BUNDLE_FILES, AvatarBundle, avatar_bundle_exists, save_avatar_bundle
+from utils.digital_human.video_writer import FFmpegVideoWriter
 
 
 def setup_ffmpeg_env(model_dir):
@@ -147,20 +154,6 @@ def load_face_parsing_model(model_dir):
     return face_parsing_model
 
 
-def video2imgs(vid_path, save_path, ext=".png", cut_frame=10000000):
-    cap = cv2.VideoCapture(vid_path)
-    count = 0
-    while True:
-        if count > cut_frame:
-            break
-        ret, frame = cap.read()
-        if ret:
-            cv2.imwrite(f"{save_path}/{count:08d}.png", frame)
-            count += 1
-        else:
-            break
-
-
 def osmakedirs(path_list):
     for path in path_list:
         os.makedirs(path) if not os.path.exists(path) else None
@@ -181,17 +174,93 @@ class HandlerDigitalHuman:
     fps: int = 25
     bbox_shift: int = 0
     use_float16: bool = False
+    timesteps: Optional[torch.Tensor] = None
+
+
+def load_digital_human_models(model_dir):
+    """加载数字人用到的模型，多个形象共用一份"""
+    # 模型初始化，防止 pose 导致 OOM，放到最后加载
+    face_parsing_model = load_face_parsing_model(model_dir)
+    audio_processor, vae, unet, pe = init_digital_model(model_dir, use_float16=False)
+    pe = pe.half()
+    vae.vae = vae.vae.half()
+    unet.model = unet.model.half()
+
+    return HandlerDigitalHuman(
+        audio_processor=audio_processor,
+        vae=vae,
+        unet=unet,
+        pe=pe,
+        face_parsing_model=face_parsing_model,
+        timesteps=torch.tensor([0], device=unet.device),
+    )
+
+
+def unet_decode(models: HandlerDigitalHuman, audio_feature_batch, latent_batch):
+    """一个 batch 的 UNet + VAE 解码，返回 BGR 人脸图像"""
+    if isinstance(audio_feature_batch, np.ndarray):
+        audio_feature_batch = torch.from_numpy(audio_feature_batch)
+    audio_feature_batch = audio_feature_batch.to(device=models.unet.device, dtype=models.unet.model.dtype)
+    audio_feature_batch = models.pe(audio_feature_batch)
+    latent_batch = latent_batch.to(device=models.unet.device, dtype=models.unet.model.dtype)
+
+    pred_latents = models.unet.model(latent_batch, models.timesteps, encoder_hidden_states=audio_feature_batch).sample
+    return models.vae.decode_latents(pred_latents)
+
+
+@torch.no_grad()
+def auto_batch_size(models: HandlerDigitalHuman, memory_budget_gb, max_batch_size=32):
+    """
+    在给定的显存预算内估算 UNet + VAE 解码能用的最大 batch size
+
+    分别跑一次 batch 1 和 batch 2 测峰值显存，差值作为每帧增加的显存。
+    启动时 RAG / TTS / ASR / LLM 还没有加载，LLM 的 KV cache 也按之后剩余的显存分配，
+    所以这里不按当前剩余显存估算，只用配置里给数字人预留的预算。
+    """
+    device = models.unet.device
+    if device.type != "cuda":
+        return 8
+
+    def _peak_memory(batch_size):
+        torch.cuda.synchronize(device)
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+        base_memory = torch.cuda.memory_allocated(device)
+        audio_feature_batch = torch.zeros((batch_size, 50, 384), device=device)
+        latent_batch = torch.zeros((batch_size, 8, 32, 32), device=device)
+        unet_decode(models, audio_feature_batch, latent_batch)
+        return torch.cuda.max_memory_allocated(device) - base_memory
+
+    peak_1 = _peak_memory(1)
+    frame_memory = max(_peak_memory(2) - peak_1, 1)
+    torch.cuda.empty_cache()
+    batch_size = int((memory_budget_gb * 1024**3 - peak_1) / frame_memory) + 1
+    batch_size = max(1, min(max_batch_size, batch_size))
+    print(f"digital human auto batch size = {batch_size}, memory budget = {memory_budget_gb:.2f} GB")
+    return batch_size
 
 
 @torch.no_grad()
 class Avatar:
-    def __init__(self, avatar_id, work_dir, model_dir, video_path, bbox_shift, batch_size, fps, preparation_force):
+    def __init__(
+        self,
+        avatar_id,
+        work_dir,
+        model_dir,
+        video_path,
+        bbox_shift,
+        batch_size,
+        fps,
+        preparation_force,
+        models: Optional[HandlerDigitalHuman] = None,
+    ):
         self.avatar_id = avatar_id
         self.video_path = video_path
         self.bbox_shift = bbox_shift
         self.avatar_path = work_dir
         self.model_dir = model_dir
         self.full_imgs_path = f"{self.avatar_path}/full_imgs"
+        self.bundle_path = f"{self.avatar_path}/bundle"
         self.coords_path = f"{self.avatar_path}/coords.pkl"
         self.latents_out_path = f"{self.avatar_path}/latents.pt"
         self.video_out_path = f"{self.avatar_path}/vid_output/"
@@ -201,23 +270,19 @@ class Avatar:
         self.avatar_info = {"avatar_id": avatar_id, "video_path": video_path, "bbox_shift": bbox_shift}
         self.preparation_force = preparation_force
         self.batch_size = batch_size
-        self.idx = 0
 
-        # 模型初始化，防止 pose 导致 OOM，放到最后加载
-        face_parsing_model = load_face_parsing_model(self.model_dir)
-        audio_processor, vae, unet, pe = init_digital_model(self.model_dir, use_float16=False)
-        pe = pe.half()
-        vae.vae = vae.vae.half()
-        unet.model = unet.model.half()
+        # 没有传入共享的模型时自己加载
+        if models is None:
+            models = load_digital_human_models(self.model_dir)
 
-        self.init(vae_model=vae, face_parsing_model=face_parsing_model)
+        self.init(vae_model=models.vae, face_parsing_model=models.face_parsing_model)
 
         self.model_handler = HandlerDigitalHuman(
-            audio_processor=audio_processor,
-            vae=vae,
-            unet=unet,
-            pe=pe,
-            face_parsing_model=face_parsing_model,
+            audio_processor=models.audio_processor,
+            vae=models.vae,
+            unet=models.unet,
+            pe=models.pe,
+            face_parsing_model=models.face_parsing_model,
             frame_list_cycle=self.frame_list_cycle,
             coord_list_cycle=self.coord_list_cycle,
             input_latent_list_cycle=self.input_latent_list_cycle,
@@ -225,6 +290,7 @@ class Avatar:
             mask_list_cycle=self.mask_list_cycle,
             fps=fps,
             bbox_shift=bbox_shift,
+            timesteps=models.timesteps,
         )
 
     def init(self, vae_model, face_parsing_model):
@@ -244,15 +310,15 @@ class Avatar:
                 need_to_prepare = True
                 shutil.rmtree(self.avatar_path)
 
+        if need_to_prepare is False and not avatar_bundle_exists(self.bundle_path) and self.legacy_materials_exist():
+            # 旧版本生成的 PNG + pickle 素材，转换成素材包，不需要重新预处理
+            self.convert_legacy_materials()
+
         if need_to_prepare is False:
             # 对文件再进行一个判断，避免中途出错导致文件没生成全
             for prepare_file in [
-                self.full_imgs_path,
-                self.coords_path,
-                self.latents_out_path,
+                *[os.path.join(self.bundle_path, name) for name in BUNDLE_FILES],
                 self.video_out_path,
-                self.mask_out_path,
-                self.mask_coords_path,
                 self.avatar_info_path,
             ]:
                 if not os.path.exists(prepare_file):
@@ -266,110 +332,166 @@ class Avatar:
             print("*********************************")
             print(f"  creating avator: {self.avatar_id}")
             print("*********************************")
-            osmakedirs([self.avatar_path, self.full_imgs_path, self.video_out_path, self.mask_out_path])
+            osmakedirs([self.avatar_path, self.video_out_path])
             self.prepare_material(vae_model=vae_model, face_parsing_model=face_parsing_model)
 
-        self.input_latent_list_cycle = torch.load(self.latents_out_path)
+        # 素材包 mmap 只读加载，倒序部分只是索引
+        self.bundle = bundle = AvatarBundle(self.bundle_path, device=vae_model.device)
+        self.frame_list_cycle = bundle.frame_list_cycle
+        self.coord_list_cycle = bundle.coord_list_cycle
+        self.input_latent_list_cycle = bundle.input_latent_list_cycle
+        self.mask_list_cycle = bundle.mask_list_cycle
+        self.mask_coords_list_cycle = bundle.mask_coords_list_cycle
+
+    @property
+    def device(self):
+        return self.bundle.device
+
+    def to(self, device):
+        """把 latent 换入 / 换出 GPU，帧和 mask 始终是 mmap，不占显存"""
+        self.bundle.to(device)
+        self.input_latent_list_cycle = self.bundle.input_latent_list_cycle
+        self.model_handler.input_latent_list_cycle = self.input_latent_list_cycle
+        return self
+
+    def legacy_materials_exist(self):
+        return all(
+            os.path.exists(path)
+            for path in [self.full_imgs_path, self.coords_path, self.latents_out_path, self.mask_out_path, self.mask_coords_path]
+        )
+
+    def convert_legacy_materials(self):
+        """把旧版本的 full_imgs / mask PNG + pickle 素材转换成素材包，旧素材里保存的是 正序 + 倒序 两份，只取正序部分"""
+        print(f"converting legacy avatar materials to bundle: {self.bundle_path}")
+
+        def _sorted_imgs(img_dir):
+            img_list = glob.glob(os.path.join(img_dir, "*.[jpJP][pnPN]*[gG]"))
+            return sorted(img_list, key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
+
         with open(self.coords_path, "rb") as f:
-            self.coord_list_cycle = pickle.load(f)
-        input_img_list = glob.glob(os.path.join(self.full_imgs_path, "*.[jpJP][pnPN]*[gG]"))
-        input_img_list = sorted(input_img_list, key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
-        self.frame_list_cycle = read_imgs(input_img_list)
+            coord_list_cycle = pickle.load(f)
         with open(self.mask_coords_path, "rb") as f:
-            self.mask_coords_list_cycle = pickle.load(f)
-        input_mask_list = glob.glob(os.path.join(self.mask_out_path, "*.[jpJP][pnPN]*[gG]"))
-        input_mask_list = sorted(input_mask_list, key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
-        self.mask_list_cycle = read_imgs(input_mask_list)
+            mask_coords_list_cycle = pickle.load(f)
+        input_latent_list_cycle = torch.load(self.latents_out_path)
+
+        frame_num = len(coord_list_cycle) // 2
+        save_avatar_bundle(
+            self.bundle_path,
+            frame_list=read_imgs(_sorted_imgs(self.full_imgs_path)[:frame_num]),
+            coord_list=coord_list_cycle[:frame_num],
+            mask_list=read_imgs(_sorted_imgs(self.mask_out_path)[:frame_num]),
+            mask_coords_list=mask_coords_list_cycle[:frame_num],
+            latent_list=input_latent_list_cycle[: len(input_latent_list_cycle) // 2],
+        )
+
+        for legacy_path in [self.full_imgs_path, self.mask_out_path]:
+            shutil.rmtree(legacy_path)
+        for legacy_path in [self.coords_path, self.latents_out_path, self.mask_coords_path]:
+            os.remove(legacy_path)
 
-    def prepare_material(self, vae_model, face_parsing_model):
+    def prepare_material(self, vae_model, face_parsing_model, chunk_size=32):
+        """
+        分块流式预处理：每次解码 chunk_size 帧，人脸检测 + DWPose、VAE 编码、人脸分割都按 batch 计算，
+        帧直接追加写入磁盘，内存里最多只有一块帧
+        """
         print("preparing data materials ... ...")
         with open(self.avatar_info_path, "w") as f:
             json.dump(self.avatar_info, f)
 
-        if os.path.isfile(self.video_path):
-            video2imgs(self.video_path, self.full_imgs_path, ext="png")
-        else:
-            print(f"copy files in {self.video_path}")
-            files = os.listdir(self.video_path)
-            files.sort()
-            files = [file for file in files if file.split(".")[-1] == "png"]
-            for filename in files:
-                shutil.copyfile(f"{self.video_path}/{filename}", f"{self.full_imgs_path}/{filename}")
-        input_img_list = sorted(glob.glob(os.path.join(self.full_imgs_path, "*.[jpJP][pnPN]*[gG]")))
+        Path(self.bundle_path).mkdir(parents=True, exist_ok=True)
+        frames_raw_path = Path(self.bundle_path).joinpath("frames.raw")
 
         print("extracting landmarks...")
         pose_model = load_pose_model(self.model_dir)
-        coord_list, frame_list = get_landmark_and_bbox(input_img_list, pose_model, self.bbox_shift)
-        del pose_model
 
+        coord_list = []
         input_latent_list = []
-        idx = -1
+        mask_list = []
+        mask_coords_list = []
+        average_range_minus = []
+        average_range_plus = []
+        frame_shape = None
         # maker if the bbox is not sufficient
         coord_placeholder = (0.0, 0.0, 0.0, 0.0)
-        for bbox, frame in zip(coord_list, frame_list):
-            idx = idx + 1
-            if bbox == coord_placeholder:
-                continue
-            x1, y1, x2, y2 = bbox
-            crop_frame = frame[y1:y2, x1:x2]
-            resized_crop_frame = cv2.resize(crop_frame, (256, 256), interpolation=cv2.INTER_LANCZOS4)
-            latents = vae_model.get_latents_for_unet(resized_crop_frame)
-            input_latent_list.append(latents)
-
-        self.frame_list_cycle = frame_list + frame_list[::-1]
-        self.coord_list_cycle = coord_list + coord_list[::-1]
-        self.input_latent_list_cycle = input_latent_list + input_latent_list[::-1]
-        self.mask_coords_list_cycle = []
-        self.mask_list_cycle = []
-
-        for i, frame in enumerate(tqdm(self.frame_list_cycle)):
-            cv2.imwrite(f"{self.full_imgs_path}/{str(i).zfill(8)}.png", frame)
-
-            face_box = self.coord_list_cycle[i]
-            mask, crop_box = get_image_prepare_material(frame, face_box, face_parsing_model)
-            cv2.imwrite(f"{self.mask_out_path}/{str(i).zfill(8)}.png", mask)
-            self.mask_coords_list_cycle += [crop_box]
-            self.mask_list_cycle.append(mask)
-
-        with open(self.mask_coords_path, "wb") as f:
-            pickle.dump(self.mask_coords_list_cycle, f)
-
-        with open(self.coords_path, "wb") as f:
-            pickle.dump(self.coord_list_cycle, f)
-
-        torch.save(self.input_latent_list_cycle, os.path.join(self.latents_out_path))
-
-    def process_frames(self, res_frame_queue, video_len, skip_save_images, save_dir_name):
-        print(video_len)
-        while True:
-            if self.idx >= video_len - 1:
-                break
-            try:
-                res_frame = res_frame_queue.get(block=True, timeout=1)
-            except queue.Empty:
-                continue
-
-            bbox = self.coord_list_cycle[self.idx % (len(self.coord_list_cycle))]
-            ori_frame = copy.deepcopy(self.frame_list_cycle[self.idx % (len(self.frame_list_cycle))])
-            x1, y1, x2, y2 = bbox
-            try:
-                res_frame = cv2.resize(res_frame.astype(np.uint8), (x2 - x1, y2 - y1))
-            except:
-                continue
-            mask = self.mask_list_cycle[self.idx % (len(self.mask_list_cycle))]
-            mask_crop_box = self.mask_coords_list_cycle[self.idx % (len(self.mask_coords_list_cycle))]
-            # combine_frame = get_image(ori_frame,res_frame,bbox)
-            combine_frame = get_image_blending(ori_frame, res_frame, bbox, mask, mask_crop_box)
+        with open(frames_raw_path, "wb") as f_frames:
+            for frames in tqdm(read_frames(self.video_path, chunk_size)):
+                frame_shape = frames[0].shape
+                coords, range_minus, range_plus = get_face_bboxes(frames, pose_model, self.bbox_shift)
+                coord_list += coords
+                average_range_minus += range_minus
+                average_range_plus += range_plus
+
+                crop_frames = []
+                for bbox, frame in zip(coords, frames):
+                    if bbox == coord_placeholder:
+                        continue
+                    x1, y1, x2, y2 = bbox
+                    crop_frame = frame[y1:y2, x1:x2]
+                    crop_frames.append(cv2.resize(crop_frame, (256, 256), interpolation=cv2.INTER_LANCZOS4))
+                if len(crop_frames) > 0:
+                    input_latent_list.append(vae_model.get_latents_for_unet_batch(crop_frames).cpu())
+
+                # 倒序部分和正序完全一样，只处理正序部分，加载时用索引构造循环序列
+                masks, crop_boxes = get_image_prepare_material_batch(frames, coords, face_parsing_model)
+                mask_list += masks
+                mask_coords_list += crop_boxes
+
+                for frame in frames:
+                    f_frames.write(np.ascontiguousarray(frame).data)
+        del pose_model
+        print_bbox_range(len(coord_list), average_range_minus, average_range_plus, self.bbox_shift)
+
+        # 从磁盘上的原始帧逐帧写入素材包，不需要把整段视频读进内存
+        frame_list = np.memmap(frames_raw_path, dtype=np.uint8, mode="r", shape=(len(coord_list),) + frame_shape)
+        save_avatar_bundle(self.bundle_path, frame_list, coord_list, mask_list, mask_coords_list, input_latent_list)
+        del frame_list
+        os.remove(frames_raw_path)
+
+    def blend_frame(self, res_frame, idx, out):
+        """把 VAE 解码出的人脸融合回第 idx 帧，写入 out，失败返回 None"""
+        bbox = self.coord_list_cycle[idx % (len(self.coord_list_cycle))]
+        ori_frame = self.frame_list_cycle[idx % (len(self.frame_list_cycle))]
+        x1, y1, x2, y2 = bbox
+        try:
+            res_frame = cv2.resize(res_frame.astype(np.uint8), (x2 - x1, y2 - y1))
+        except:
+            return None
+        mask = self.mask_list_cycle[idx % (len(self.mask_list_cycle))]
+        mask_crop_box = self.mask_coords_list_cycle[idx % (len(self.mask_coords_list_cycle))]
+        # combine_frame = get_image(ori_frame,res_frame,bbox)
+        # 融合用的 float mask 只取人脸框区域，在融合线程里现算，不在启动时为每一帧常驻一份
+        return get_image_blending(ori_frame, res_frame, bbox, mask, mask_crop_box, out=out)
+
+    def unet_decode(self, whisper_batch, latent_batch):
+        """一个 batch 的 UNet + VAE 解码，返回 BGR 人脸图像"""
+        return unet_decode(self.model_handler, whisper_batch, latent_batch)
+
+    def datagen(self, whisper_chunks, delay_frame=0):
+        """按 batch 产出已经在 GPU 上的 whisper 特征和参考 latent"""
+        return prefetch_datagen(whisper_chunks, self.bundle.latents, self.bundle.latent_cycle_index, self.batch_size, delay_frame)
+
+    def render_frames(self, whisper_chunks, frame_offset, video_writer: FFmpegVideoWriter, post_processor=None):
+        """同步生成从 frame_offset 开始的一段帧并写入 video_writer，用于流式生成
+
+        Args:
+            post_processor (FramePostProcessor | None): 复用的后处理器，None 则这一段临时创建一个
+        """
+        if post_processor is None:
+            post_processor = FramePostProcessor(self, video_writer, frame_offset=frame_offset)
+            finish = post_processor.close
+        else:
+            post_processor.reset(video_writer, frame_offset)
+            finish = post_processor.flush
 
-            if skip_save_images is False:
-                cv2.imwrite(f"{self.avatar_path}/{save_dir_name}/{str(self.idx).zfill(8)}.png", combine_frame)
-            self.idx = self.idx + 1
+        try:
+            for whisper_batch, latent_batch in self.datagen(whisper_chunks, delay_frame=frame_offset):
+                for res_frame in self.unet_decode(whisper_batch, latent_batch):
+                    post_processor.put(res_frame)
+        finally:
+            finish()
 
     def inference(self, audio_path, output_vid, fps, skip_save_images=False):
 
-        tmp_tag = "tmp_" + datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-
-        os.makedirs(self.avatar_path + f"/{tmp_tag}", exist_ok=True)
         print("start inference")
         ############################################## extract audio feature ##############################################
         start_time = time.time()
@@ -377,71 +499,285 @@ class Avatar:
         whisper_chunks = self.model_handler.audio_processor.feature2chunks(feature_array=whisper_feature, fps=fps)
         print(f"processing audio:{audio_path} costs {(time.time() - start_time) * 1000}ms")
         ############################################## inference batch by batch ##############################################
-        video_num = len(whisper_chunks)
-        res_frame_queue = queue.Queue()
-        self.idx = 0
-        # # Create a sub-thread and start it
-        process_thread = threading.Thread(
-            target=self.process_frames, args=(res_frame_queue, video_num, skip_save_images, tmp_tag)
-        )
-        process_thread.start()
+        # 和原来一样，最后一帧不写入
+        video_num = len(whisper_chunks) - 1
+
+        # 帧直接通过管道送进 ffmpeg 编码，并在同一个进程中合成音频
+        video_writer = None
+        if skip_save_images is False:
+            height, width = self.frame_list_cycle[0].shape[:2]
+            video_writer = FFmpegVideoWriter(output_vid, width, height, fps, audio_path=audio_path)
+
+        # 多线程融合，按帧序号写入 ffmpeg
+        post_processor = FramePostProcessor(self, video_writer)
 
-        gen = datagen(whisper_chunks, self.input_latent_list_cycle, self.batch_size)
+        gen = self.datagen(whisper_chunks[:video_num])
         start_time = time.time()
 
-        for i, (whisper_batch, latent_batch) in enumerate(tqdm(gen, total=int(np.ceil(float(video_num) / self.batch_size)))):
-            audio_feature_batch = torch.from_numpy(whisper_batch)
-            audio_feature_batch = audio_feature_batch.to(
-                device=self.model_handler.unet.device, dtype=self.model_handler.unet.model.dtype
-            )
-            audio_feature_batch = self.model_handler.pe(audio_feature_batch)
-            latent_batch = latent_batch.to(dtype=self.model_handler.unet.model.dtype)
-
-            timesteps = torch.tensor([0], device="cuda")
-            pred_latents = self.model_handler.unet.model(
-                latent_batch, timesteps, encoder_hidden_states=audio_feature_batch
-            ).sample
-            recon = self.model_handler.vae.decode_latents(pred_latents)
-            for res_frame in recon:
-                res_frame_queue.put(res_frame)
-        # Close the queue and sub-thread after all tasks are completed
-        process_thread.join()
-
-        print("Total process time of {} frames including saving images = {}s".format(video_num, time.time() - start_time))
-
-        cmd_img2video = f"ffmpeg -y -v warning -r {fps} -f image2 -i {self.avatar_path}/{tmp_tag}/%08d.png -vcodec libx264 -vf format=rgb24,scale=out_color_matrix=bt709,format=yuv420p -crf 18 {self.avatar_path}/{tmp_tag}.mp4"
-        print(cmd_img2video)
-        os.system(cmd_img2video)
-
-        # output_vid = os.path.join(self.video_out_path, out_vid_name + ".mp4")  # on
-        cmd_combine_audio = f"ffmpeg -y -v warning -i {audio_path} -i {self.avatar_path}/{tmp_tag}.mp4 {output_vid}"
-        print(cmd_combine_audio)
-        os.system(cmd_combine_audio)
-
-        os.remove(f"{self.avatar_path}/{tmp_tag}.mp4")
-        shutil.rmtree(f"{self.avatar_path}/{tmp_tag}")
+        finished = False
+        try:
+            try:
+                for i, (whisper_batch, latent_batch) in enumerate(tqdm(gen, total=int(np.ceil(float(video_num) / self.batch_size)))):
+                    recon = self.unet_decode(whisper_batch, latent_batch)
+                    for res_frame in recon:
+                        post_processor.put(res_frame)
+            finally:
+                # 等待所有帧融合并写入完成
+                post_processor.close()
+            finished = True
+        finally:
+            if video_writer is not None:
+                if finished:
+                    video_writer.close()
+                else:
+                    # 出错时结束 ffmpeg，不留下孤儿进程
+                    video_writer.kill()
+
+        print("Total process time of {} frames including encoding video = {}s".format(video_num, time.time() - start_time))
         print(f"result is save to {output_vid}")
 
         return str(output_vid)
 
 
+class FramePostProcessor:
+    """
+    并行的人脸融合 + 按序写入
+
+    UNet 解码出的人脸按到达顺序编号后交给线程池做 resize + 融合（cv2 / numpy 计算时会释放 GIL），
+    写入线程按编号顺序取结果写入 ffmpeg，future 队列本身就是重排缓冲。
+    输出 buffer 池大小固定为 max_pending，用完时 put 阻塞，UNet 产出快于融合时不会无限堆积帧。
+    流式生成时同一个实例可以跨段复用：每段 reset 换 video_writer，段末 flush，全部结束后 close。
+
+    Args:
+        avatar (Avatar): 提供原始帧和融合素材
+        video_writer (FFmpegVideoWriter | None): None 则只融合不写入
+        frame_offset (int): 第一帧对应的帧序号
+        num_workers (int): 融合线程数
+        max_pending (int): 最多同时在处理 / 等待写入的帧数
+    """
+
+    _FINISH_TAG = None
+
+    def __init__(self, avatar: Avatar, video_writer: Optional[FFmpegVideoWriter], frame_offset=0, num_workers=4, max_pending=16):
+        self.avatar = avatar
+        self.video_writer = video_writer
+        self.frame_idx = frame_offset
+
+        frame_shape = avatar.frame_list_cycle[0].shape
+        self.free_buffers = queue.Queue()
+        for _ in range(max_pending):
+            self.free_buffers.put(np.empty(frame_shape, dtype=np.uint8))
+
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.pending_queue = queue.Queue(maxsize=max_pending)  # 按帧序号排列的 future
+        self.error = None
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def _blend(self, res_frame, frame_idx, out):
+        try:
+            if self.avatar.blend_frame(res_frame, frame_idx, out) is None:
+                # 融合失败直接用原图，保证音画同步
+                frame_list_cycle = self.avatar.frame_list_cycle
+                np.copyto(out, frame_list_cycle[frame_idx % len(frame_list_cycle)])
+        except Exception as e:
+            self.error = e
+        return out  # buffer 总是要还回去，否则 put 会一直阻塞
+
+    def put(self, res_frame):
+        """送入下一帧 UNet 解码出的人脸"""
+        if self.error is not None:
+            raise self.error
+        out = self.free_buffers.get()  # 没有空闲 buffer 时阻塞
+        self.pending_queue.put(self.executor.submit(self._blend, res_frame, self.frame_idx, out))
+        self.frame_idx += 1
+
+    def _write_loop(self):
+        while True:
+            future = self.pending_queue.get()
+            if future is self._FINISH_TAG:
+                self.pending_queue.task_done()
+                break
+            frame = future.result()
+            if self.video_writer is not None and self.error is None:
+                try:
+                    self.video_writer.write(frame)
+                except Exception as e:
+                    # 记录错误，下次 put / flush / close 时抛出
+                    self.error = e
+            self.free_buffers.put(frame)
+            self.pending_queue.task_done()
+
+    def reset(self, video_writer: Optional[FFmpegVideoWriter], frame_offset=0):
+        """开始下一段：换成新的 video_writer，帧序号从 frame_offset 开始，需要在 flush 之后调用"""
+        self.video_writer = video_writer
+        self.frame_idx = frame_offset
+
+    def flush(self):
+        """等待已送入的帧全部写入完成，线程池和 buffer 保留，之后可以 reset 继续使用"""
+        self.pending_queue.join()
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """等待所有帧写入完成，并结束写入线程和线程池"""
+        try:
+            self.flush()
+        finally:
+            self.pending_queue.put(self._FINISH_TAG)
+            self.thread.join()
+            self.executor.shutdown()
+
+
+class AvatarRegistry:
+    """多形象管理：所有形象共用一套模型，形象素材按需加载
+
+    最近使用的 max_gpu_avatars 个形象的 latent 放在 GPU 上，其余的挪回 CPU，
+    不同的催收角色可以在同一个进程里使用不同的形象，显存不会随形象数量成倍增加。
+    正在渲染的形象通过 acquire / release 计数固定在 GPU 上，不会被换出。
+
+    用法：
+        with registry.use(avatar_id) as avatar:
+            avatar.inference(...)
+
+    Args:
+        model_dir (str): 模型目录
+        work_dir (str): 形象素材根目录，每个形象保存在 work_dir/<avatar_id>
+        batch_size (int): 推理 batch size，0 则在 memory_budget_gb 内自动选择
+        fps (int): 帧率
+        max_gpu_avatars (int): 最多同时在 GPU 上的形象数，正在使用的形象多于该值时暂时超出
+        memory_budget_gb (float): batch_size 为 0 时，UNet + VAE 解码可以使用的显存（GB）
+    """
+
+    def __init__(self, model_dir, work_dir, batch_size=8, fps=25, max_gpu_avatars=2, memory_budget_gb=2.0):
+        self.model_dir = model_dir
+        self.work_dir = work_dir
+        self.fps = fps
+        self.max_gpu_avatars = max_gpu_avatars
+
+        self.models = load_digital_human_models(model_dir)
+        self.batch_size = batch_size if batch_size > 0 else auto_batch_size(self.models, memory_budget_gb)
+        self.avatar_configs = dict()  # avatar_id -> {"video_path", "bbox_shift"}
+        self.avatars = dict()  # 已加载的形象
+        self.gpu_avatars = OrderedDict()  # latent 在 GPU 上的形象，按最近使用排序（最旧的在前）
+        self.ref_counts = defaultdict(int)  # 正在使用的次数，大于 0 的形象不会被换出
+        self.lock = threading.Lock()  # 保护上面的状态，只做轻量操作
+        self.load_locks = dict()  # 每个形象一把锁，预处理耗时很长，不能持有全局锁
+
+    def register(self, avatar_id, video_path, bbox_shift=0):
+        """注册形象，素材在第一次使用时才加载 / 预处理"""
+        with self.lock:
+            self.avatar_configs[avatar_id] = {"video_path": video_path, "bbox_shift": bbox_shift}
+            self.load_locks.setdefault(avatar_id, threading.Lock())
+
+    def _load(self, avatar_id) -> Avatar:
+        """加载形象，同一形象只预处理一次，不同形象可以同时预处理"""
+        with self.lock:
+            if avatar_id not in self.avatar_configs:
+                raise KeyError(f"avatar {avatar_id} not registered")
+            avatar_config = self.avatar_configs[avatar_id]
+            load_lock = self.load_locks[avatar_id]
+
+        with load_lock:
+            with self.lock:
+                avatar = self.avatars.get(avatar_id)
+            if avatar is not None:
+                return avatar
+
+            avatar = Avatar(
+                avatar_id=avatar_id,
+                work_dir=str(Path(self.work_dir).joinpath(avatar_id)),
+                model_dir=self.model_dir,
+                video_path=avatar_config["video_path"],
+                bbox_shift=avatar_config["bbox_shift"],
+                batch_size=self.batch_size,
+                fps=self.fps,
+                preparation_force=False,
+                models=self.models,
+            )
+            with self.lock:
+                self.avatars[avatar_id] = avatar
+            return avatar
+
+    def acquire(self, avatar_id) -> Avatar:
+        """获取形象并固定在 GPU 上，用完需要调用 release"""
+        avatar = self._load(avatar_id)
+
+        with self.lock:
+            self.ref_counts[avatar_id] += 1
+            if avatar_id not in self.gpu_avatars:
+                avatar.to(self.models.vae.device)
+            self.gpu_avatars[avatar_id] = avatar
+            self.gpu_avatars.move_to_end(avatar_id)
+            self._offload()
+
+        return avatar
+
+    def release(self, avatar_id):
+        with self.lock:
+            self.ref_counts[avatar_id] = max(0, self.ref_counts[avatar_id] - 1)
+            self._offload()
+
+    @contextmanager
+    def use(self, avatar_id):
+        avatar = self.acquire(avatar_id)
+        try:
+            yield avatar
+        finally:
+            self.release(avatar_id)
+
+    def _offload(self):
+        """超出上限时，把最久没用且没有在使用的形象挪回 CPU，需要持有 self.lock"""
+        for old_id in list(self.gpu_avatars.keys()):
+            if len(self.gpu_avatars) <= self.max_gpu_avatars:
+                break
+            if self.ref_counts[old_id] > 0:
+                continue
+            old_avatar = self.gpu_avatars.pop(old_id)
+            print(f"offload avatar {old_id} to cpu")
+            old_avatar.to("cpu")
+
+
 @st.cache_resource
-def digital_human_preprocess(model_dir, use_float16, video_path, work_dir, fps, bbox_shift):
+def digital_human_preprocess(
+    model_dir,
+    use_float16,
+    video_path,
+    work_dir,
+    fps,
+    bbox_shift,
+    avatar_id="lelemiao",
+    max_gpu_avatars=2,
+    batch_size=8,
+    avatars=None,
+    memory_budget_gb=2.0,
+):
+    """
+    Args:
+        avatars (dict | None): 其他形象，形象 ID -> (视频路径, bbox_shift)，只注册，第一次使用时预处理
+    """
 
-    avatar = Avatar(
-        avatar_id="lelemiao",
-        work_dir=work_dir,
+    registry = AvatarRegistry(
         model_dir=model_dir,
-        video_path=video_path,
-        bbox_shift=bbox_shift,
-        batch_size=8,
+        work_dir=work_dir,
+        batch_size=batch_size,
         fps=fps,
-        preparation_force=False,
+        max_gpu_avatars=max_gpu_avatars,
+        memory_budget_gb=memory_budget_gb,
     )
 
+    for other_avatar_id, (other_video_path, other_bbox_shift) in (avatars or {}).items():
+        registry.register(other_avatar_id, video_path=other_video_path, bbox_shift=other_bbox_shift)
+
+    # 默认形象，启动时就完成预处理
+    registry.register(avatar_id, video_path=video_path, bbox_shift=bbox_shift)
+    with registry.use(avatar_id):
+        pass
+
     setup_ffmpeg_env(model_dir)
 
-    return avatar
+    return registry
 
 
 @torch.no_grad()
@@ -0,0 +1,98 @@
+"""
+数字人视频编码
+
+把合成好的 BGR 帧以 raw video 的形式直接写入常驻的 ffmpeg 子进程 stdin，同一个进程里完成 H.264 编码和音频合成，
+不再先把每一帧保存成 PNG，再调用两次 ffmpeg 编码 + 合成音频。
+"""
+
+import os
+import subprocess
+
+import numpy as np
+
+
+class FFmpegVideoWriter:
+    """通过管道把帧写入 ffmpeg
+
+    Args:
+        output_path (str): 输出 mp4 路径
+        width (int): 帧宽
+        height (int): 帧高
+        fps (int): 帧率
+        audio_path (str | None): 需要合成进视频的音频，None 则只输出视频
+        crf (int): x264 质量参数
+        extra_args (list | None): 额外的输出参数，例如输出 fragmented MP4 时的 -movflags
+    """
+
+    def __init__(self, output_path, width, height, fps, audio_path=None, crf=18, extra_args=None):
+        self.output_path = str(output_path)
+        self.frame_size = width * height * 3
+
+        cmd = [
+            "ffmpeg", "-y", "-v", "warning",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", f"{fps}", "-i", "-",
+        ]  # fmt: skip
+        if audio_path is not None:
+            cmd += ["-i", str(audio_path), "-map", "0:v", "-map", "1:a", "-c:a", "aac"]
+        cmd += [
+            "-vcodec", "libx264", "-vf", "scale=out_color_matrix=bt709,format=yuv420p", "-crf", f"{crf}",
+        ]  # fmt: skip
+        if extra_args is not None:
+            cmd += list(extra_args)
+        cmd += [self.output_path]
+
+        print(" ".join(cmd))
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        self.frame_count = 0
+
+    def write(self, frame):
+        """写入一帧 BGR uint8 图像"""
+        if frame.nbytes != self.frame_size:
+            raise ValueError(f"frame size mismatch: got {frame.shape}, expect {self.frame_size} bytes")
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+        self.frame_count += 1
+
+    def close(self):
+        """结束写入并等待 ffmpeg 完成编码"""
+        if self.process.stdin is not None and not self.process.stdin.closed:
+            self.process.stdin.close()
+        return_code = self.process.wait()
+        if return_code != 0:
+            raise RuntimeError(f"ffmpeg exit with code {return_code}, output: {self.output_path}")
+        return self.output_path
+
+    def kill(self):
+        """出错时直接结束 ffmpeg，不等待编码完成，避免残留子进程"""
+        self.process.kill()
+        if self.process.stdin is not None and not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass  # 进程已结束，管道可能已经断开
+        self.process.wait()
+
+
+def concat_videos(video_paths, output_path, audio_path=None):
+    """无损拼接多段编码参数相同的视频
+
+    Args:
+        audio_path (str | None): 整段音频，不为 None 时丢弃各段自带的音频，用这段音频重新编码一次，
+            避免每段 AAC 各自的 priming 在拼接处产生空隙 / 爆音
+    """
+    list_path = f"{output_path}.txt"
+    with open(list_path, "w") as f:
+        for video_path in video_paths:
+            f.write(f"file '{os.path.abspath(video_path)}'\n")
+
+    cmd = ["ffmpeg", "-y", "-v", "warning", "-f", "concat", "-safe", "0", "-i", list_path]
+    if audio_path is not None:
+        cmd += ["-i", str(audio_path), "-map", "0:v", "-map", "1:a", "-c:v", "copy", "-c:a", "aac"]
+    else:
+        cmd += ["-c", "copy"]
+    cmd += [str(output_path)]
+    print(" ".join(cmd))
+    try:
+        subprocess.run(cmd, check=True)
+    finally:
+        os.remove(list_path)
+    return str(output_path)
@@ -8,9 +8,14 @@ from lagent.agents.internlm2_agent import Internlm2Protocol
 from lagent.schema import ActionReturn, AgentReturn
 from lmdeploy import GenerationConfig
 
-from utils.digital_human.digital_human_worker import gen_digital_human_video_in_spinner
+from utils.digital_human.digital_human_worker import (
+    finish_stream_digital_human_in_spinner,
+    gen_digital_human_video_in_spinner,
+    show_stream_digital_human_segments,
+    start_stream_digital_human,
+)
 from utils.rag.rag_worker import build_rag_prompt
-from utils.tts.tts_worker import gen_tts_in_spinner
+from utils.tts.tts_worker import finish_stream_tts_in_spinner, gen_tts_in_spinner, show_stream_tts_chunks, start_stream_tts
 
 
 
@@ -205,18 +210,48 @@ def get_turbomind_response(
 
     with st.chat_message("assistant", avatar=robot_avator):
         message_placeholder = st.empty()
+        # 流式 TTS，边生成边逐句合成；流式数字人，TTS 每合成一句就生成对应的视频段
+        stream_tts = None
+        stream_digital_human = None
         cur_response = ""
-        for item in model_pipe.stream_infer(real_prompt, gen_config=prepare_generation_config()):
+        try:
+            stream_digital_human = start_stream_digital_human()
+            stream_tts = start_stream_tts(on_chunk=stream_digital_human.feed if stream_digital_human is not None else None)
+            if stream_tts is None and stream_digital_human is not None:
+                stream_digital_human.finish()  # 没有开启 TTS，不会有音频送进来
+                stream_digital_human = None
 
-            if "~" in item.text:
-                item.text = item.text.replace("~", "。").replace("。。", "。")
+            for item in model_pipe.stream_infer(real_prompt, gen_config=prepare_generation_config()):
 
-            cur_response += item.text
-            message_placeholder.markdown(cur_response + "▌")
-        message_placeholder.markdown(cur_response)
+                if "~" in item.text:
+                    item.text = item.text.replace("~", "。").replace("。。", "。")
 
-        tts_save_path = gen_tts_in_spinner(cur_response)  # 一整句生成
-        gen_digital_human_video_in_spinner(tts_save_path)
+                cur_response += item.text
+                message_placeholder.markdown(cur_response + "▌")
+
+                if stream_tts is not None:
+                    stream_tts.feed(item.text)
+                    if stream_digital_human is not None:
+                        show_stream_digital_human_segments(stream_digital_human)
+                    else:
+                        show_stream_tts_chunks(stream_tts)
+            message_placeholder.markdown(cur_response)
+
+            if stream_tts is not None:
+                tts_save_path = finish_stream_tts_in_spinner(stream_tts, show_chunks=stream_digital_human is None)
+            else:
+                tts_save_path = gen_tts_in_spinner(cur_response)  # 一整句生成
+
+            if stream_digital_human is not None:
+                finish_stream_digital_human_in_spinner(stream_digital_human)
+            else:
+                gen_digital_human_video_in_spinner(tts_save_path)
+        finally:
+            # 生成出错或者 Streamlit rerun 中断脚本时，也要通知后台线程结束，否则会一直阻塞在 queue.get()
+            if stream_tts is not None:
+                stream_tts.finish()
+            if stream_digital_human is not None:
+                stream_digital_human.finish()
 
         # Add robot response to chat history
         session_messages.append(
@@ -29,6 +29,11 @@ if WEB_CONFIGS.ENABLE_DIGITAL_HUMAN:
         work_dir=WEB_CONFIGS.DIGITAL_HUMAN_GEN_PATH,
         fps=WEB_CONFIGS.DIGITAL_HUMAN_FPS,
         bbox_shift=WEB_CONFIGS.DIGITAL_HUMAN_BBOX_SHIFT,
+        avatar_id=WEB_CONFIGS.DIGITAL_HUMAN_AVATAR_ID,
+        avatars=WEB_CONFIGS.DIGITAL_HUMAN_AVATARS,
+        max_gpu_avatars=WEB_CONFIGS.DIGITAL_HUMAN_MAX_GPU_AVATARS,
+        batch_size=WEB_CONFIGS.DIGITAL_HUMAN_BATCH_SIZE,
+        memory_budget_gb=WEB_CONFIGS.DIGITAL_HUMAN_MEMORY_BUDGET_GB,
     )
 else:
     DIGITAL_HUMAN_HANDLER = None
@@ -1,6 +1,7 @@
 """extract feature and search with user query."""
 
 import argparse
+import hashlib
 import json
 import os
 import re
@@ -24,11 +25,11 @@ from torch.cuda import empty_cache
 
 try:
     from utils.rag.file_operation import FileName, FileOperation
-    from utils.rag.retriever import CacheRetriever, Retriever
+    from utils.rag.retriever import MANIFEST_NAME, CacheRetriever, Retriever
 except:
     # 用于 DEBUG
     from file_operation import FileName, FileOperation
-    from retriever import CacheRetriever, Retriever
+    from retriever import MANIFEST_NAME, CacheRetriever, Retriever
 
 
 def read_and_save(file: FileName):
@@ -51,6 +52,45 @@ def read_and_save(file: FileName):
         f.write(content)
 
 
+FEATURE_NAMES = ["db_response", "db_reject"]
+
+
+def load_manifest(work_dir: str):
+    """Load the vector db manifest: file origin -> {"md5", "read", "ids": {feature name -> chunk ids}}."""
+    manifest_path = os.path.join(work_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, work_dir: str):
+    manifest_path = os.path.join(work_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def diff_manifest(files: list, manifest: dict):
+    """Compare scanned files with the manifest by content hash.
+
+    Returns:
+        tuple: (added or changed files, origins of removed files)
+    """
+    file_opr = FileOperation()
+    dirty_files = []
+    for file in files:
+        file.md5 = file_opr.md5(file.origin)
+        record = manifest.get(file.origin)
+        if record is None or record["md5"] != file.md5:
+            dirty_files.append(file)
+
+    current = set(file.origin for file in files)
+    removed = [origin for origin in manifest if origin not in current]
+    return dirty_files, removed
+
+
 def _split_text_with_regex_from_end(text: str, separator: str, keep_separator: bool) -> List[str]:
     # Now that we have the separator, split the text
     if separator:
@@ -251,14 +291,8 @@ class FeatureStore:
             documents.append(chunk)
         return documents
 
-    def ingress_response(self, files: list, work_dir: str):
-        """Extract the features required for the response pipeline based on the
-        document."""
-        feature_dir = os.path.join(work_dir, "db_response")
-        if not os.path.exists(feature_dir):
-            os.makedirs(feature_dir)
-
-        # logger.info('glob {} in dir {}'.format(files, file_dir))
+    def get_response_documents(self, files: list):
+        """Split documents for the response pipeline."""
         file_opr = FileOperation()
         documents = []
 
@@ -285,18 +319,26 @@ class FeatureStore:
                 text = file.prefix + text
                 documents += self.get_text_documents(text, file)
 
-        if len(documents) < 1:
-            return
-        vs = Vectorstore.from_documents(documents, self.embeddings)
-        vs.save_local(feature_dir)
+        self.add_chunk_offsets(documents)
+        return documents
 
-    def ingress_reject(self, files: list, work_dir: str):
-        """Extract the features required for the reject pipeline based on
-        documents."""
-        feature_dir = os.path.join(work_dir, "db_reject")
-        if not os.path.exists(feature_dir):
-            os.makedirs(feature_dir)
+    def add_chunk_offsets(self, documents: list):
+        """Write the offset of each chunk in its source text into metadata, so
+        that `Retriever.query` can slice the context without searching.
 
+        `start_index` is -1 if the chunk is not a verbatim part of the text.
+        """
+        file_opr = FileOperation()
+        texts = dict()
+        for doc in documents:
+            read_path = doc.metadata["read"]
+            if read_path not in texts:
+                # 和 query 时读到的文本保持一致
+                texts[read_path], _ = file_opr.read(read_path)
+            doc.metadata["start_index"] = texts[read_path].find(doc.page_content)
+
+    def get_reject_documents(self, files: list):
+        """Split documents for the reject pipeline."""
         documents = []
         file_opr = FileOperation()
 
@@ -325,10 +367,97 @@ class FeatureStore:
                 text = file.basename + text
                 documents += self.get_text_documents(text, file)
 
-        if len(documents) < 1:
+        return documents
+
+    def embed_chunks(self, texts: list):
+        """Embed chunks once: duplicated texts are embedded only one time and
+        sorted by length so that each batch has similar length (less padding).
+
+        Returns:
+            dict: text -> embedding
+        """
+        unique_texts = sorted(set(texts), key=len)
+        logger.info("embedding {} chunks ({} unique)".format(len(texts), len(unique_texts)))
+        vectors = self.embeddings.embed_documents(unique_texts)
+        return dict(zip(unique_texts, vectors))
+
+    def build_vector_stores(self, documents_dict: dict, work_dir: str):
+        """Build several FAISS indexes from one shared embedding pass.
+
+        Args:
+            documents_dict (dict): feature dir name -> documents, e.g. {"db_response": [...], "db_reject": [...]}
+        """
+        all_texts = [doc.page_content for documents in documents_dict.values() for doc in documents]
+        if len(all_texts) < 1:
             return
-        vs = Vectorstore.from_documents(documents, self.embeddings)
-        vs.save_local(feature_dir)
+        text2vec = self.embed_chunks(all_texts)
+
+        for feature_name, documents in documents_dict.items():
+            if len(documents) < 1:
+                continue
+            feature_dir = os.path.join(work_dir, feature_name)
+            if not os.path.exists(feature_dir):
+                os.makedirs(feature_dir)
+
+            vs = Vectorstore.from_embeddings(
+                text_embeddings=[(doc.page_content, text2vec[doc.page_content]) for doc in documents],
+                embedding=self.embeddings,
+                metadatas=[doc.metadata for doc in documents],
+            )
+            vs.save_local(feature_dir)
+
+    def update_vector_stores(self, documents_dict: dict, ids_dict: dict, stale_ids_dict: dict, work_dir: str):
+        """Update existing FAISS indexes in place: delete vectors of stale
+        chunks and add vectors of new chunks, embedding only the new ones.
+
+        Args:
+            documents_dict (dict): feature dir name -> new documents
+            ids_dict (dict): feature dir name -> chunk ids of the new documents
+            stale_ids_dict (dict): feature dir name -> chunk ids to delete
+        """
+        all_texts = [doc.page_content for documents in documents_dict.values() for doc in documents]
+        text2vec = self.embed_chunks(all_texts) if len(all_texts) > 0 else {}
+
+        for feature_name in FEATURE_NAMES:
+            documents = documents_dict.get(feature_name, [])
+            ids = ids_dict.get(feature_name, [])
+            stale_ids = stale_ids_dict.get(feature_name, [])
+            feature_dir = os.path.join(work_dir, feature_name)
+
+            vs = None
+            if os.path.exists(os.path.join(feature_dir, "index.faiss")):
+                vs = Vectorstore.load_local(feature_dir, embeddings=self.embeddings, allow_dangerous_deserialization=True)
+
+                stale_ids = list(set(stale_ids) & set(vs.index_to_docstore_id.values()))
+                if len(stale_ids) > 0:
+                    vs.delete(stale_ids)
+
+            if len(documents) > 0:
+                text_embeddings = [(doc.page_content, text2vec[doc.page_content]) for doc in documents]
+                metadatas = [doc.metadata for doc in documents]
+                if vs is None:
+                    vs = Vectorstore.from_embeddings(
+                        text_embeddings=text_embeddings, embedding=self.embeddings, metadatas=metadatas, ids=ids
+                    )
+                else:
+                    vs.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+
+            if vs is None:
+                continue
+            logger.info("{}: -{} +{} chunks, total {}".format(feature_name, len(stale_ids), len(documents), vs.index.ntotal))
+            if not os.path.exists(feature_dir):
+                os.makedirs(feature_dir)
+            vs.save_local(feature_dir)
+
+    def ingress_response(self, files: list, work_dir: str):
+        """Extract the features required for the response pipeline based on the
+        document."""
+        self.build_vector_stores({"db_response": self.get_response_documents(files)}, work_dir)
+
+    def ingress_reject(self, files: list, work_dir: str):
+        """Extract the features required for the reject pipeline based on
+        documents."""
+        self.build_vector_stores({"db_reject": self.get_reject_documents(files)}, work_dir)
 
     def preprocess(self, files: list, work_dir: str):
         """Preprocesses files in a given directory. Copies each file to
@@ -404,9 +533,79 @@ class FeatureStore:
         configuration file.
         """
         logger.info("initialize response and reject feature store, you only need call this once.")  # noqa E501
-        self.preprocess(files=files, work_dir=work_dir)
-        self.ingress_response(files=files, work_dir=work_dir)
-        self.ingress_reject(files=files, work_dir=work_dir)
+        manifest = load_manifest(work_dir)
+        dirty_files, removed = diff_manifest(files, manifest)
+        self.sync(dirty_files, removed, manifest, work_dir)
+
+    def sync(self, dirty_files: list, removed: list, manifest: dict, work_dir: str):
+        """Incrementally sync the feature store with the manifest: only added
+        or changed files are embedded, vectors of changed or removed files are
+        deleted.
+
+        Args:
+            dirty_files (list): added or changed files, with `md5` filled by `diff_manifest`
+            removed (list): origins of files that no longer exist
+            manifest (dict): manifest loaded by `load_manifest`, updated in place
+        """
+        if len(manifest) == 0 and any(os.path.exists(os.path.join(work_dir, name)) for name in FEATURE_NAMES):
+            # 旧版本生成的数据库没有 manifest，无法知道每个向量属于哪个文件，整体重建
+            logger.warning("vector db without manifest, rebuild all")
+            for name in FEATURE_NAMES:
+                shutil.rmtree(os.path.join(work_dir, name), ignore_errors=True)
+
+        logger.info("sync feature store: {} added or changed, {} removed".format(len(dirty_files), len(removed)))
+
+        stale_ids_dict = {name: [] for name in FEATURE_NAMES}
+        stale_reads = set()
+        for origin in removed + [file.origin for file in dirty_files]:
+            record = manifest.pop(origin, None)
+            if record is None:
+                continue
+            for name in FEATURE_NAMES:
+                stale_ids_dict[name] += record["ids"].get(name, [])
+            stale_reads.add(record["read"])
+
+        self.preprocess(files=dirty_files, work_dir=work_dir)
+
+        # response 和 reject 共用一次 embedding，相同的 chunk 只算一次
+        # 按文件逐个切分，记录每个 chunk 属于哪个源文件：内容相同的 pdf / word 预处理文件（copypath）相同，不能用 copypath 反查
+        documents_dict = {name: [] for name in FEATURE_NAMES}
+        document_files = {name: [] for name in FEATURE_NAMES}
+        for file in dirty_files:
+            for name, documents in [
+                ("db_response", self.get_response_documents([file])),
+                ("db_reject", self.get_reject_documents([file])),
+            ]:
+                documents_dict[name] += documents
+                document_files[name] += [file] * len(documents)
+
+        # chunk id = 文件 md5 + 文件路径 hash + 序号，写入 manifest 用于之后删除
+        for file in dirty_files:
+            if file.state:
+                manifest[file.origin] = {"md5": file.md5, "read": file.copypath, "ids": {name: [] for name in FEATURE_NAMES}}
+            else:
+                # 处理失败的文件也记录下来，内容不变就不再重试
+                manifest[file.origin] = {"md5": file.md5, "read": file.copypath, "ids": {}}
+
+        ids_dict = {}
+        for name, documents in documents_dict.items():
+            ids_dict[name] = []
+            for doc, file in zip(documents, document_files[name]):
+                file_ids = manifest[file.origin]["ids"][name]
+                path_hash = hashlib.sha256(file.origin.encode("utf-8")).hexdigest()[0:8]
+                chunk_id = "{}-{}-{}".format(file.md5, path_hash, len(file_ids))
+                file_ids.append(chunk_id)
+                ids_dict[name].append(chunk_id)
+
+        self.update_vector_stores(documents_dict, ids_dict, stale_ids_dict, work_dir)
+
+        # 删除不再使用的预处理文件
+        used_reads = set(record["read"] for record in manifest.values())
+        for read in stale_reads - used_reads:
+            if read and os.path.exists(read):
+                os.remove(read)
+
+        save_manifest(manifest, work_dir)
 
 
 def parse_args():
@@ -513,15 +712,20 @@ def gen_vector_db(config_path, source_dir, work_dir, test_mode=False, update_rej
     # 必须是绝对路径，否则加载会有问题
     work_dir = str(Path(work_dir).absolute())
 
+    # walk all files in repo dir，和 manifest 对比，只处理新增、修改和删除的文件
+    file_opr = FileOperation()
+    files = file_opr.scan_dir(repo_dir=source_dir)
+    manifest = load_manifest(work_dir)
+    dirty_files, removed = diff_manifest(files, manifest)
+    if len(dirty_files) == 0 and len(removed) == 0 and not test_mode and not update_reject:
+        logger.info("vector db is up to date, skip")
+        return
+
     cache = CacheRetriever(config_path=config_path)
 
     # 生成向量数据库
     fs_init = FeatureStore(embeddings=cache.embeddings, reranker=cache.reranker, config_path=config_path)
-
-    # walk all files in repo dir
-    file_opr = FileOperation()
-    files = file_opr.scan_dir(repo_dir=source_dir)
-    fs_init.initialize(files=files, work_dir=work_dir)
+    fs_init.sync(dirty_files, removed, manifest, work_dir)
     file_opr.summarize(files)
     del fs_init
 
@@ -16,6 +16,7 @@ class FileName:
         self.basename = os.path.basename(filename)
         self.origin = os.path.join(root, filename)
         self.copypath = ""
+        self.md5 = ""
         self._type = _type
         self.state = True
         self.reason = ""
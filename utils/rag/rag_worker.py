@@ -7,6 +7,7 @@ RAG 模型相关操作, 包括:
 """
 
 import shutil
+import time
 from pathlib import Path
 
 import streamlit as st
@@ -30,10 +31,12 @@ def build_rag_prompt(rag_retriever: CacheRetriever, product_name, prompt):
         print(f" @@@ GOT real_retriever == tuple : {real_retriever}")
         return ""
 
+    t_start = time.time()
     chunk, db_context, references = real_retriever.query(
         f"商品名：{product_name}。{prompt}", context_max_length=CONTEXT_MAX_LENGTH - 2 * len(GENERATE_TEMPLATE)
     )
     print(f"db_context = {db_context}")
+    print(f"RAG 耗时 {time.time() - t_start:.3f}s, cache = {real_retriever.cache_stats()}")
 
     if db_context is not None and len(db_context) > 1:
         prompt_rag = GENERATE_TEMPLATE.format(db_context, prompt)
@@ -60,16 +63,15 @@ def init_rag_retriever(rag_config: str, db_path: str):
 
 def gen_rag_db(force_gen=False):
     """
-    生成向量数据库。
+    生成 / 增量更新向量数据库。
+
+    数据库目录下的 manifest.json 记录了每个说明书的内容 hash 和对应的 chunk id，
+    每次调用只会 embedding 新增或修改过的说明书，并删除已移除说明书的向量，耗时只和改动量有关。
 
     参数:
-    force_gen - 布尔值，当设置为 True 时，即使数据库已存在也会重新生成数据库。
+    force_gen - 布尔值，当设置为 True 时，删除已有数据库并全部重新生成。
     """
 
-    # 检查数据库目录是否存在，如果存在且force_gen为False，则不执行生成操作
-    if Path(WEB_CONFIGS.RAG_VECTOR_DB_DIR).exists() and not force_gen:
-        return
-
     if force_gen and Path(WEB_CONFIGS.RAG_VECTOR_DB_DIR).exists():
         shutil.rmtree(WEB_CONFIGS.RAG_VECTOR_DB_DIR)
 
@@ -86,8 +88,8 @@ def gen_rag_db(force_gen=False):
             info["instruction"], Path(WEB_CONFIGS.PRODUCT_INSTRUCTION_DIR_GEN_DB_TMP).joinpath(Path(info["instruction"]).name)
         )
 
-    print("Generating rag database, pls wait ...")
-    # 调用函数生成向量数据库
+    print("Syncing rag database, pls wait ...")
+    # 调用函数生成向量数据库，只处理有改动的说明书
     gen_vector_db(
         WEB_CONFIGS.RAG_CONFIG_PATH,
         str(Path(WEB_CONFIGS.PRODUCT_INSTRUCTION_DIR_GEN_DB_TMP).absolute()),
@@ -1,7 +1,11 @@
 """extract feature and search with user query."""
 
+import hashlib
 import os
+import re
+import threading
 import time
+from collections import OrderedDict
 
 import numpy as np
 import yaml
@@ -23,27 +27,141 @@ except:
     from file_operation import FileOperation
 
 
+MANIFEST_NAME = "manifest.json"
+
+
+def normalize_question(question: str):
+    """Strip and merge whitespace, used as the key of the query caches."""
+    return re.sub(r"\s+", " ", question.strip())
+
+
+class TTLCache:
+    """LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None and time.time() - item[0] > self.ttl:
+                self.data.pop(key)
+                item = None
+
+            if item is None:
+                self.misses += 1
+                return None
+
+            self.data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = (time.time(), value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "size": len(self.data),
+        }
+
+
+class DocumentStore:
+    """Hold the text of every source file in memory, so that building the
+    context of a query is pure slicing instead of re-reading files."""
+
+    def __init__(self) -> None:
+        self.texts = dict()
+        self.file_opr = FileOperation()
+
+    def load(self, read_paths):
+        for read_path in read_paths:
+            self.get(read_path)
+        logger.info("document store loaded {} files, {} chars".format(len(self.texts), sum(len(t) for t in self.texts.values())))
+
+    def get(self, read_path: str):
+        """Returns (file text, error), reading the file only at the first time."""
+        if read_path in self.texts:
+            return self.texts[read_path], None
+
+        file_text, error = self.file_opr.read(read_path)
+        if error is None:
+            self.texts[read_path] = file_text
+        return file_text, error
+
+
 class Retriever:
     """Tokenize and extract features from the project's documents, for use in
     the reject pipeline and response pipeline."""
 
-    def __init__(self, embeddings, reranker, work_dir: str, reject_throttle: float) -> None:
+    def __init__(
+        self,
+        embeddings,
+        reranker,
+        work_dir: str,
+        reject_throttle: float,
+        query_cache_size: int = 1024,
+        query_cache_ttl: float = 3600,
+    ) -> None:
         """Init with model device type and config."""
         self.reject_throttle = reject_throttle
-        self.rejecter = Vectorstore.load_local(
-            os.path.join(work_dir, "db_reject"), embeddings=embeddings, allow_dangerous_deserialization=True
+        self.embeddings = embeddings
+        self.reranker = reranker
+        self.work_dir = work_dir
+        self.manifest_path = os.path.join(work_dir, MANIFEST_NAME)
+        self.manifest_mtime = self.get_manifest_mtime()
+        self.reload_lock = threading.Lock()
+        self.load_vectorstores()
+
+        # 两级缓存：问题 -> embedding，(问题, 候选集 hash) -> rerank 结果
+        # 向量数据库的 manifest 变化后重新加载索引，两级缓存一起失效
+        self.embedding_cache = TTLCache(max_size=query_cache_size, ttl=query_cache_ttl)
+        self.rerank_cache = TTLCache(max_size=query_cache_size, ttl=query_cache_ttl)
+
+    def load_vectorstores(self):
+        """Load the reject / response FAISS index and the source texts they
+        point to. New objects are built first and then swapped in, so a
+        running query keeps using a consistent set."""
+        rejecter = Vectorstore.load_local(
+            os.path.join(self.work_dir, "db_reject"), embeddings=self.embeddings, allow_dangerous_deserialization=True
         )
-        self.retriever = Vectorstore.load_local(
-            os.path.join(work_dir, "db_response"),
-            embeddings=embeddings,
+        retriever = Vectorstore.load_local(
+            os.path.join(self.work_dir, "db_response"),
+            embeddings=self.embeddings,
             allow_dangerous_deserialization=True,
             distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
         ).as_retriever(search_type="similarity", search_kwargs={"score_threshold": 0.15, "k": 30})
-        self.compression_retriever = ContextualCompressionRetriever(base_compressor=reranker, base_retriever=self.retriever)
+
+        # 预先读入所有说明书，query 时不再重复读文件
+        doc_store = DocumentStore()
+        docstore = retriever.vectorstore.docstore
+        doc_store.load(set(doc.metadata["read"] for doc in docstore._dict.values() if "read" in doc.metadata))
+
+        self.rejecter = rejecter
+        self.retriever = retriever
+        self.compression_retriever = ContextualCompressionRetriever(base_compressor=self.reranker, base_retriever=retriever)
+        self.doc_store = doc_store
 
     def is_reject(self, question, k=30, disable_throttle=False):
         """If no search results below the threshold can be found from the
         database, reject this query."""
+        self.check_manifest()
         if disable_throttle:
             # for searching throttle during update sample
             docs_with_score = self.rejecter.similarity_search_with_relevance_scores(question, k=1)
@@ -94,6 +212,62 @@ class Retriever:
             yaml.dump(config, f)
         logger.info(f"The optimal threshold is: {optimal_threshold}, saved it to {config_path}")  # noqa E501
 
+    def get_manifest_mtime(self):
+        if not os.path.exists(self.manifest_path):
+            return None
+        return os.stat(self.manifest_path).st_mtime_ns
+
+    def check_manifest(self):
+        """Reload the vector db and drop the query caches if it was updated."""
+        if self.get_manifest_mtime() == self.manifest_mtime:
+            return
+
+        with self.reload_lock:
+            manifest_mtime = self.get_manifest_mtime()
+            if manifest_mtime == self.manifest_mtime:
+                # 其他线程已经重新加载
+                return
+
+            logger.info("vector db manifest changed, reload vector db and clear query caches")
+            try:
+                self.load_vectorstores()
+            except Exception as e:
+                # 同步还没写完等情况，继续用旧索引，下次 query 时重试
+                logger.error(f"reload vector db failed, keep the old one: {e}")
+                return
+
+            self.manifest_mtime = manifest_mtime
+            self.embedding_cache.clear()
+            self.rerank_cache.clear()
+
+    def get_relevant_documents(self, question: str):
+        """Same as `self.compression_retriever.get_relevant_documents`, with
+        the query embedding and the rerank result cached."""
+        self.check_manifest()
+        question = normalize_question(question)
+
+        embedding = self.embedding_cache.get(question)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(question)
+            self.embedding_cache.put(question, embedding)
+
+        candidates = self.retriever.vectorstore.similarity_search_by_vector(embedding, **self.retriever.search_kwargs)
+        if len(candidates) == 0:
+            return []
+
+        candidate_hash = hashlib.sha1(
+            "\n".join("{}|{}".format(doc.metadata.get("read", ""), doc.page_content) for doc in candidates).encode("utf-8")
+        ).hexdigest()
+        rerank_key = (question, candidate_hash)
+        docs = self.rerank_cache.get(rerank_key)
+        if docs is None:
+            docs = list(self.reranker.compress_documents(candidates, question))
+            self.rerank_cache.put(rerank_key, docs)
+        return docs
+
+    def cache_stats(self):
+        return {"embedding": self.embedding_cache.stats(), "rerank": self.rerank_cache.stats()}
+
     def query(self, question: str, context_max_length: int = 16000):  # , tracker: QueryTracker = None):
         """Processes a query and returns the best match from the vector store
         database. If the question is rejected, returns None.
@@ -121,7 +295,7 @@ class Retriever:
         # if reject:
         # return None, None, [docs[0][0].metadata['source']]
 
-        docs = self.compression_retriever.get_relevant_documents(question)
+        docs = self.get_relevant_documents(question)
 
         print(f"DEBUG 1: {docs}")
 
@@ -133,7 +307,6 @@ class Retriever:
 
         # add file text to context, until exceed `context_max_length`
 
-        file_opr = FileOperation()
         for idx, doc in enumerate(docs):
             chunk = doc.page_content
             chunks.append(chunk)
@@ -143,7 +316,7 @@ class Retriever:
                     "If you are using the version before 20240319, please rerun `python3 -m huixiangdou.service.feature_store`"
                 )
                 raise Exception("huixiangdou version mismatch")
-            file_text, error = file_opr.read(doc.metadata["read"])
+            file_text, error = self.doc_store.get(doc.metadata["read"])
             if error is not None:
                 # read file failed, skip
                 print(f"DEBUG 2: error")
@@ -163,7 +336,10 @@ class Retriever:
                 add_len = context_max_length - len(context)
                 if add_len <= 0:
                     break
-                chunk_index = file_text.find(chunk)
+                # chunk 在文件中的位置在入库时已经算好，旧数据库没有则现场查找
+                chunk_index = doc.metadata.get("start_index")
+                if chunk_index is None:
+                    chunk_index = file_text.find(chunk)
                 if chunk_index == -1:
                     # chunk not in file_text
                     context += chunk
@@ -193,6 +369,7 @@ class CacheRetriever:
             config = yaml.safe_load(f)["feature_store"]
             embedding_model_path = config["embedding_model_path"]
             reranker_model_path = config["reranker_model_path"]
+            embedding_batch_size = config.get("embedding_batch_size", 1)
 
         embedding_model_path = snapshot_download(embedding_model_path, cache_dir=WEB_CONFIGS.RAG_MODEL_DIR)
         reranker_model_path = snapshot_download(reranker_model_path, cache_dir=WEB_CONFIGS.RAG_MODEL_DIR)
@@ -202,7 +379,7 @@ class CacheRetriever:
         self.embeddings = HuggingFaceEmbeddings(
             model_name=embedding_model_path,
             model_kwargs={"device": "cuda"},
-            encode_kwargs={"batch_size": 1, "normalize_embeddings": True},
+            encode_kwargs={"batch_size": embedding_batch_size, "normalize_embeddings": True},
         )
         self.embeddings.client = self.embeddings.client.half()
         reranker_args = {"model": reranker_model_path, "top_n": 7, "device": "cuda", "use_fp16": True}
@@ -217,7 +394,10 @@ class CacheRetriever:
             return None, "workdir or config.yaml not exist"
 
         with open(config_path, "r", encoding="utf-8") as f:
-            reject_throttle = yaml.safe_load(f)["feature_store"]["reject_throttle"]
+            config = yaml.safe_load(f)["feature_store"]
+            reject_throttle = config["reject_throttle"]
+            query_cache_size = config.get("query_cache_size", 1024)
+            query_cache_ttl = config.get("query_cache_ttl", 3600)
 
         if len(self.cache) >= self.max_len:
             # drop the oldest one
@@ -235,7 +415,12 @@ class CacheRetriever:
                 del del_value["retriever"]
 
         retriever = Retriever(
-            embeddings=self.embeddings, reranker=self.reranker, work_dir=work_dir, reject_throttle=reject_throttle
+            embeddings=self.embeddings,
+            reranker=self.reranker,
+            work_dir=work_dir,
+            reject_throttle=reject_throttle,
+            query_cache_size=query_cache_size,
+            query_cache_ttl=query_cache_ttl,
         )
         self.cache[fs_id] = {"retriever": retriever, "time": time.time()}
         return retriever
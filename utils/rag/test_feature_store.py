@@ -0,0 +1,103 @@
+"""
+增量同步的 manifest 比较、chunk 在原文中的偏移、embedding 去重
+"""
+
+import pytest
+
+feature_store = pytest.importorskip("utils.rag.feature_store")
+Document = pytest.importorskip("langchain_core.documents").Document
+file_operation = pytest.importorskip("utils.rag.file_operation")
+FileName = file_operation.FileName
+
+
+def scan(root):
+    return [FileName(str(root), path.name, "md") for path in sorted(root.glob("*.md"))]
+
+
+def make_manifest(files):
+    return {file.origin: {"md5": file.md5, "read": file.origin, "ids": {}} for file in files}
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    root = tmp_path.joinpath("source")
+    root.mkdir()
+    for name, text in [("a.md", "# A\n\nalpha"), ("b.md", "# B\n\nbeta"), ("c.md", "# C\n\ngamma")]:
+        root.joinpath(name).write_text(text, encoding="utf-8")
+    return root
+
+
+def test_manifest_round_trip(source_dir, tmp_path):
+    work_dir = tmp_path.joinpath("work")
+    work_dir.mkdir()
+    assert feature_store.load_manifest(str(work_dir)) == {}
+
+    files = scan(source_dir)
+    dirty_files, removed = feature_store.diff_manifest(files, {})
+    assert [file.origin for file in dirty_files] == [file.origin for file in files]
+    assert removed == []
+
+    manifest = make_manifest(files)
+    feature_store.save_manifest(manifest, str(work_dir))
+    assert feature_store.load_manifest(str(work_dir)) == manifest
+    assert not work_dir.joinpath(feature_store.MANIFEST_NAME + ".tmp").exists()
+
+    # 文件没有变化，什么都不用做
+    dirty_files, removed = feature_store.diff_manifest(scan(source_dir), feature_store.load_manifest(str(work_dir)))
+    assert dirty_files == []
+    assert removed == []
+
+
+def test_diff_changed_and_removed(source_dir):
+    manifest = make_manifest(feature_store.diff_manifest(scan(source_dir), {})[0])
+
+    source_dir.joinpath("a.md").write_text("# A\n\nalpha changed", encoding="utf-8")
+    source_dir.joinpath("c.md").unlink()
+    source_dir.joinpath("d.md").write_text("# D\n\ndelta", encoding="utf-8")
+    # 只改 mtime 不改内容，不算变化
+    source_dir.joinpath("b.md").write_text("# B\n\nbeta", encoding="utf-8")
+
+    dirty_files, removed = feature_store.diff_manifest(scan(source_dir), manifest)
+    assert sorted(file.basename for file in dirty_files) == ["a.md", "d.md"]
+    assert removed == [str(source_dir.joinpath("c.md"))]
+
+
+def test_add_chunk_offsets(tmp_path):
+    text = "第一段内容。\n\n第二段内容，重复。\n\n第二段内容，重复。\n\nthe end"
+    read_path = tmp_path.joinpath("doc.md")
+    read_path.write_text(text, encoding="utf-8")
+
+    chunks = ["第一段内容。", "第二段内容，重复。", "the end", "不在原文中"]
+    documents = [Document(page_content=chunk, metadata={"source": "doc.md", "read": str(read_path)}) for chunk in chunks]
+
+    store = feature_store.FeatureStore.__new__(feature_store.FeatureStore)
+    store.add_chunk_offsets(documents)
+
+    # 偏移对应 query 时读到的文本（read 会合并空行）
+    text, _ = file_operation.FileOperation().read(str(read_path))
+    for doc in documents[:3]:
+        start = doc.metadata["start_index"]
+        assert start >= 0
+        assert text[start : start + len(doc.page_content)] == doc.page_content
+    assert documents[3].metadata["start_index"] == -1
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+
+def test_embed_chunks_dedup():
+    store = feature_store.FeatureStore.__new__(feature_store.FeatureStore)
+    store.embeddings = FakeEmbeddings()
+
+    texts = ["ccc", "a", "bb", "a", "ccc"]
+    text2vec = store.embed_chunks(texts)
+
+    # 重复的文本只算一次，按长度排序送入
+    assert store.embeddings.calls == [["a", "bb", "ccc"]]
+    assert text2vec == {"a": [1.0], "bb": [2.0], "ccc": [3.0]}
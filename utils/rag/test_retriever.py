@@ -0,0 +1,28 @@
+"""
+DocumentStore 只在第一次读文件，查询缓存的 key 归一化
+"""
+
+import pytest
+
+retriever = pytest.importorskip("utils.rag.retriever")
+
+
+def test_document_store_reads_once(tmp_path):
+    read_path = tmp_path.joinpath("doc.md")
+    read_path.write_text("原文内容", encoding="utf-8")
+
+    store = retriever.DocumentStore()
+    store.load([str(read_path)])
+    assert store.get(str(read_path)) == ("原文内容", None)
+
+    # 已经加载的文件不再重新读
+    read_path.write_text("修改后的内容", encoding="utf-8")
+    assert store.get(str(read_path)) == ("原文内容", None)
+
+    # 新的 store 读到的是最新内容
+    assert retriever.DocumentStore().get(str(read_path)) == ("修改后的内容", None)
+
+
+def test_normalize_question():
+    assert retriever.normalize_question("  你好\n  世界\t! ") == "你好 世界 !"
+    assert retriever.normalize_question("a  b") == retriever.normalize_question("a b")
@@ -9,7 +9,7 @@ from tqdm import tqdm
 
 from utils.tts.gpt_sovits.AR.models.utils import (dpo_loss, get_batch_logps,
                                                   make_pad_mask, make_reject_y,
-                                                  sample, topk_sampling)
+                                                  sample_fused, topk_sampling)
 from utils.tts.gpt_sovits.AR.modules.embedding import (SinePositionalEmbedding,
                                                        TokenEmbedding)
 from utils.tts.gpt_sovits.AR.modules.transformer import (
@@ -298,6 +298,19 @@ class Text2SemanticDecoder(nn.Module):
         # 错位
         return targets[:, :-1], targets[:, 1:]
 
+    def init_static_cache(self, max_len):
+        """预分配定长 kv cache，buffer 在第一次前向时按 k/v 的 shape 创建，之后每步原地写入"""
+        return {
+            "all_stage": self.num_layers,
+            "k": [None] * self.num_layers,  ###[max_len, bsz, dim] 的 buffer
+            "v": [None] * self.num_layers,
+            "static": True,
+            "max_len": max_len,
+            "kv_len": 0,  ###已写入的长度
+            "first_infer": 1,
+            "stage": 0,
+        }
+
     def infer_panel(
         self,
         x,  #####全部文本token
@@ -308,109 +321,134 @@ class Text2SemanticDecoder(nn.Module):
         top_p: int = 100,
         early_stop_num: int = -1,
         temperature: float = 1.0,
+        max_steps: int = 1500,
+    ):
+        """单句解码，等价于 batch size 为 1 的 infer_panel_batch
+
+        Returns:
+            tuple: (y, idx)，调用方使用 y[:, -idx:] 取生成的 semantic token
+        """
+        pred_semantic = self.infer_panel_batch(
+            x,
+            x_lens,
+            prompts,
+            bert_feature,
+            top_k=top_k,
+            top_p=top_p,
+            early_stop_num=early_stop_num,
+            temperature=temperature,
+            max_steps=max_steps,
+        )[0]
+        return pred_semantic.unsqueeze(0), pred_semantic.shape[0]
+
+    def infer_panel_batch(
+        self,
+        x,  #####全部文本token, [bsz, x_len_max] 右侧 padding
+        x_lens,  #####每一行的真实长度, [bsz]
+        prompts,  ####参考音频token, [1, prefix_len]，所有句子共用
+        bert_feature,  #####[bsz, 1024, x_len_max] 右侧 padding
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        max_steps: int = 1500,
+        generators: list = None,  ####每一行的 torch.Generator，None 则使用全局随机数
+        eos_check_interval: int = 8,  ####每隔多少步把 EOS 状态同步到 CPU 判断是否全部结束
     ):
+        """多句一起自回归解码，每一行单独判断 EOS，全部结束后退出
+
+        Returns:
+            list: 每一句生成的 semantic token，1 维 tensor，与 infer_panel 返回值经过 [:, -idx:] 截取后的结果一致
+        """
         x = self.ar_text_embedding(x)
         x = x + self.bert_proj(bert_feature.transpose(1, 2))
         x = self.ar_text_position(x)
 
-        # AR Decoder
-        y = prompts
+        bsz, x_len = x.shape[0], x.shape[1]
 
-        x_len = x.shape[1]
-        x_attn_mask = torch.zeros((x_len, x_len), dtype=torch.bool)
-        stop = False
-        # print(1111111,self.num_layers)
-        cache = {
-            "all_stage": self.num_layers,
-            "k": [None] * self.num_layers,  ###根据配置自己手写
-            "v": [None] * self.num_layers,
-            # "xy_pos":None,##y_pos位置编码每次都不一样的没法缓存，每次都要重新拼xy_pos.主要还是写法原因，其实是可以历史统一一样的，但也没啥计算量就不管了
-            "y_emb": None,  ##只需要对最新的samples求emb，再拼历史的就行
-            # "logits":None,###原版就已经只对结尾求再拼接了，不用管
-            # "xy_dec":None,###不需要，本来只需要最后一个做logits
-            "first_infer": 1,
-            "stage": 0,
-        }
-        ###################  first step ##########################
-        if y is not None:
+        # x 右侧 padding 的位置作为 key 时全部屏蔽，作为 query 时仍能看到真实的 x，不会出现整行都是 -inf
+        key_padding_mask = make_pad_mask(x_lens, x_len)
+
+        # AR Decoder
+        if prompts is not None:
+            y = prompts.expand(bsz, -1)
             y_emb = self.ar_audio_embedding(y)
             y_len = y_emb.shape[1]
             prefix_len = y.shape[1]
             y_pos = self.ar_audio_position(y_emb)
             xy_pos = torch.concat([x, y_pos], dim=1)
-            cache["y_emb"] = y_emb
-            ref_free = False
         else:
-            y_emb = None
             y_len = 0
             prefix_len = 0
-            y_pos = None
             xy_pos = x
-            y = torch.zeros(x.shape[0], 0, dtype=torch.int, device=x.device)
-            ref_free = True
+            y = torch.zeros(bsz, 0, dtype=torch.int, device=x.device)
 
-        x_attn_mask_pad = F.pad(
-            x_attn_mask,
-            (0, y_len),  ###xx的纯0扩展到xx纯0+xy纯1，(x,x+y)
-            value=True,
-        )
-        y_attn_mask = F.pad(  ###yy的右上1扩展到左边xy的0,(y,x+y)
+        # 预分配 y、key padding mask 和 kv cache，每步原地写入
+        cache = self.init_static_cache(x_len + prefix_len + max_steps)
+        y_buffer = torch.zeros(bsz, prefix_len + max_steps, dtype=torch.int, device=x.device)
+        y_buffer[:, :prefix_len] = y
+        y = y_buffer[:, :prefix_len]
+
+        x_attn_mask = torch.zeros((x_len, x_len), dtype=torch.bool)
+        x_attn_mask_pad = F.pad(x_attn_mask, (0, y_len), value=True)
+        y_attn_mask = F.pad(
             torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1),
             (x_len, 0),
             value=False,
         )
         xy_attn_mask = torch.concat([x_attn_mask_pad, y_attn_mask], dim=0).to(x.device)
 
-        for idx in tqdm(range(1500)):
-            
+        key_padding_mask = F.pad(key_padding_mask, (0, prefix_len + max_steps), value=False)
+        src_len = x_len + y_len
+        xy_attn_mask = xy_attn_mask.unsqueeze(0).logical_or(key_padding_mask[:, :src_len].unsqueeze(1))  # [bsz, src_len, src_len]
+        xy_attn_mask = xy_attn_mask.unsqueeze(1).expand(-1, self.num_head, -1, -1).reshape(bsz * self.num_head, src_len, src_len)
+        ###后续每步只有一个 query，mask 就是 key padding mask 的前缀
+        step_attn_mask = key_padding_mask.view(bsz, 1, 1, -1).expand(-1, self.num_head, -1, -1).reshape(bsz * self.num_head, 1, -1)
+
+        # EOS 状态全部保存在 device 上，只有每 eos_check_interval 步才同步一次
+        finished = torch.zeros(bsz, dtype=torch.bool, device=x.device)
+        end_idx = torch.full((bsz,), -1, dtype=torch.long, device=x.device)
+
+        for idx in tqdm(range(max_steps)):
+
             xy_dec, _ = self.h((xy_pos, None), mask=xy_attn_mask, cache=cache)
-            logits = self.ar_predict_layer(xy_dec[:, -1])  ##不用改，如果用了cache的默认就是只有一帧，取最后一帧一样的
-            # samples = topk_sampling(logits, top_k=top_k, top_p=1.0, temperature=temperature)
+            logits = self.ar_predict_layer(xy_dec[:, -1])
             if idx == 0:  ###第一次跑不能EOS否则没有了
                 logits = logits[:, :-1]  ###刨除1024终止符号的概率
-            samples = sample(logits[0], y, top_k=top_k, top_p=top_p, repetition_penalty=1.35, temperature=temperature)[
-                0
-            ].unsqueeze(0)
-            # 本次生成的 semantic_ids 和之前的 y 构成新的 y
-            # print(samples.shape)#[1,1]#第一个1是bs
-            y = torch.concat([y, samples], dim=1)
+            samples = sample_fused(
+                logits, y, generators=generators, top_k=top_k, top_p=top_p, repetition_penalty=1.35, temperature=temperature
+            )
+            y_buffer[:, prefix_len + idx : prefix_len + idx + 1] = samples
+            y = y_buffer[:, : prefix_len + idx + 1]
+
+            is_eos = (torch.argmax(logits, dim=-1) == self.EOS) | (samples[:, 0] == self.EOS)
+            end_idx = torch.where(is_eos & ~finished, idx, end_idx)
+            finished |= is_eos
 
             if early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num:
                 print("use early stop num:", early_stop_num)
-                stop = True
+                break
 
-            if torch.argmax(logits, dim=-1)[0] == self.EOS or samples[0, 0] == self.EOS:
-                # print(torch.argmax(logits, dim=-1)[0] == self.EOS, samples[0, 0] == self.EOS)
-                stop = True
-            if stop:
-                # if prompts.shape[1] == y.shape[1]:
-                #     y = torch.concat([y, torch.zeros_like(samples)], dim=1)
-                #     print("bad zero prediction")
-                if y.shape[1] == 0:
-                    y = torch.concat([y, torch.zeros_like(samples)], dim=1)
-                    print("bad zero prediction")
-                print(f"T2S Decoding EOS [{prefix_len} -> {y.shape[1]}]")
+            if (idx + 1) % eos_check_interval == 0 and finished.all():
                 break
 
             ####################### update next step ###################################
             cache["first_infer"] = 0
-            if cache["y_emb"] is not None:
-                y_emb = torch.cat([cache["y_emb"], self.ar_audio_embedding(y[:, -1:])], dim=1)
-                cache["y_emb"] = y_emb
-                y_pos = self.ar_audio_position(y_emb)
-                xy_pos = y_pos[:, -1:]
-            else:
-                y_emb = self.ar_audio_embedding(y[:, -1:])
-                cache["y_emb"] = y_emb
-                y_pos = self.ar_audio_position(y_emb)
-                xy_pos = y_pos
-            y_len = y_pos.shape[1]
-
-            ###最右边一列（是错的）
-            # xy_attn_mask=torch.ones((1, x_len+y_len), dtype=torch.bool,device=xy_pos.device)
-            # xy_attn_mask[:,-1]=False
-            ###最下面一行（是对的）
-            xy_attn_mask = torch.zeros((1, x_len + y_len), dtype=torch.bool, device=xy_pos.device)
-        if ref_free:
-            return y[:, :-1], 0
-        return y[:, :-1], idx - 1
+            ###只对最新的 token 求 emb 和位置编码
+            xy_pos = self.ar_audio_position.forward_step(self.ar_audio_embedding(samples), y.shape[1] - 1)
+            src_len += 1
+            xy_attn_mask = step_attn_mask[:, :, :src_len]
+
+        end_idx = end_idx.tolist()
+        print(f"T2S Batch Decoding EOS [{prefix_len} -> {end_idx}]")
+
+        pred_semantic_list = []
+        for row in range(bsz):
+            row_idx = idx if end_idx[row] < 0 else end_idx[row]
+            # 与 infer_panel 一致：去掉 EOS，取最后 idx - 1 个 token
+            pred_semantic = y[row, prefix_len + 1 : prefix_len + row_idx]
+            if pred_semantic.shape[0] == 0:
+                pred_semantic = torch.zeros(1, dtype=y.dtype, device=y.device)
+                print("bad zero prediction")
+            pred_semantic_list.append(pred_semantic)
+        return pred_semantic_list
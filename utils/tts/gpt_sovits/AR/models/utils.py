@@ -102,8 +102,15 @@ from typing import Optional, Tuple
 
 def multinomial_sample_one_no_sync(
     probs_sort,
+    generators: Optional[list] = None,
 ):  # Does multinomial sampling without a cuda synchronization
-    q = torch.empty_like(probs_sort).exponential_(1)
+    if generators is None:
+        q = torch.empty_like(probs_sort).exponential_(1)
+    else:
+        # 每一行使用自己的随机数生成器，采样结果与 batch 的组成无关
+        q = torch.stack(
+            [torch.empty_like(row).exponential_(1, generator=generator) for row, generator in zip(probs_sort, generators)]
+        )
     return torch.argmax(probs_sort / q, dim=-1, keepdim=True).to(dtype=torch.int)
 
 
@@ -161,6 +168,50 @@ def sample(
     idx_next = multinomial_sample_one_no_sync(probs)
     return idx_next, probs
 
+def sample_fused(
+    logits,
+    previous_tokens: Optional[torch.Tensor] = None,
+    generators: Optional[list] = None,
+    temperature: float = 1.0,
+    top_k: Optional[int] = None,
+    top_p: Optional[int] = None,
+    repetition_penalty: float = 1.0,
+) -> torch.Tensor:
+    """batch 采样，和逐句调用 sample 的结果分布一致，全程在 device 上，不会触发同步
+
+    先取 top-k 候选，top-p 只在这 k 个候选上做（归一化仍然使用全词表的 logsumexp），
+    省掉了对整个词表的 sort 和两次 scatter。
+
+    Args:
+        logits: [bsz, vocab]
+        previous_tokens: [bsz, T]
+
+    Returns:
+        torch.Tensor: [bsz, 1] 采样得到的 token
+    """
+    if previous_tokens is not None and repetition_penalty != 1.0:
+        previous_tokens = previous_tokens.long()
+        score = torch.gather(logits, dim=1, index=previous_tokens)
+        score = torch.where(
+            score < 0, score * repetition_penalty, score / repetition_penalty
+        )
+        logits = logits.scatter(dim=1, index=previous_tokens, src=score)
+
+    if top_k is None or top_k <= 0:
+        top_k = logits.size(-1)
+    topk_logits, topk_indices = torch.topk(logits, min(top_k, logits.size(-1)))  # 降序
+
+    if top_p is not None and top_p < 1.0:
+        log_norm = torch.logsumexp(logits, dim=-1, keepdim=True)
+        cum_probs = torch.cumsum(torch.exp(topk_logits - log_norm), dim=-1)
+        indices_to_remove = cum_probs > top_p
+        indices_to_remove[:, 0] = False  # keep at least one option
+        topk_logits = topk_logits.masked_fill(indices_to_remove, -float("Inf"))
+
+    probs = torch.nn.functional.softmax(topk_logits / max(temperature, 1e-5), dim=-1)
+    idx_next = multinomial_sample_one_no_sync(probs, generators)
+    return torch.gather(topk_indices, dim=1, index=idx_next.long()).to(dtype=torch.int)
+
 def dpo_loss(policy_chosen_logps: torch.FloatTensor,
              policy_rejected_logps: torch.FloatTensor,
              reference_chosen_logps: torch.FloatTensor,
@@ -79,3 +79,12 @@ class SinePositionalEmbedding(nn.Module):
         output = x.unsqueeze(-1) if x.ndim == 2 else x
         output = output * self.x_scale + self.alpha * self.pe[:, : x.size(1)]
         return self.dropout(output)
+
+    def forward_step(self, x: torch.Tensor, pos: int) -> torch.Tensor:
+        """只对从 pos 开始的新 token 加位置编码，等价于 forward(全部序列)[:, pos:]"""
+        if self.pe.size(1) < pos + x.size(1):
+            self.extend_pe(x.new_zeros(1, pos + x.size(1)))
+        elif self.pe.dtype != x.dtype or self.pe.device != x.device:
+            self.pe = self.pe.to(dtype=x.dtype, device=x.device)
+        output = x * self.x_scale + self.alpha * self.pe[:, pos : pos + x.size(1)]
+        return self.dropout(output)
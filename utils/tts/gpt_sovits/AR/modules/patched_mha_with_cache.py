@@ -265,7 +265,24 @@ def multi_head_attention_forward_patched(
             b_k,
             b_v,
         )
-    if cache != None:
+    if cache != None and cache.get("static", False):
+        ###预分配的定长 kv buffer，原地写入，不再每步 torch.cat
+        kv_start = cache["kv_len"]
+        kv_end = kv_start + k.shape[0]
+        if cache["k"][cache["stage"]] is None:
+            buffer_shape = (cache["max_len"],) + tuple(k.shape[1:])
+            cache["k"][cache["stage"]] = torch.empty(buffer_shape, dtype=k.dtype, device=k.device)
+            cache["v"][cache["stage"]] = torch.empty(buffer_shape, dtype=v.dtype, device=v.device)
+        assert kv_end <= cache["max_len"], f"kv cache overflow: {kv_end} > {cache['max_len']}"
+        cache["k"][cache["stage"]][kv_start:kv_end] = k
+        cache["v"][cache["stage"]][kv_start:kv_end] = v
+        k = cache["k"][cache["stage"]][:kv_end]
+        v = cache["v"][cache["stage"]][:kv_end]
+        src_len = kv_end
+        cache["stage"] = (cache["stage"] + 1) % cache["all_stage"]
+        if cache["stage"] == 0:  ###所有 layer 都写完了再移动写指针
+            cache["kv_len"] = kv_end
+    elif cache != None:
         if cache["first_infer"] == 1:
             cache["k"][cache["stage"]] = k
             # print(0,cache["k"].shape)
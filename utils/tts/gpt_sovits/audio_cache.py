@@ -0,0 +1,138 @@
+"""
+TTS 整句音频缓存
+
+相同的回复句子不再重新合成：按 (句子文本, 音色, 参考音频 hash, GPT / SoVITS 权重 hash, 采样参数, seed) 作为 key，
+把 int16 PCM 存到磁盘，总大小超过上限时按 LRU 淘汰。
+开启缓存时每句话的 T2S 采样和 SoVITS 先验噪声都使用由 key 推出的固定 seed，保证缓存的音频和重新生成的一致。
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from utils.tts.gpt_sovits.feature_cache import normalize_cache_text
+
+
+def get_file_md5(file_path, chunk_size=1 << 20):
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class TTSAudioCache:
+    """磁盘上的整句音频 LRU 缓存
+
+    Args:
+        cache_dir (str): 缓存目录
+        max_mb (float): 缓存总大小上限（MB）
+        base_seed (int): 全局 seed，参与 key 和每句 seed 的计算
+    """
+
+    def __init__(self, cache_dir, max_mb=512, base_seed=0):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.base_seed = base_seed
+        self.lock = threading.Lock()
+
+        # key -> 文件大小，按最近使用时间排序（最旧的在前）
+        self.index = OrderedDict()
+        self.total_bytes = 0
+        for pcm_path in sorted(self.cache_dir.glob("*.npy"), key=lambda p: p.stat().st_mtime):
+            if pcm_path.name.endswith(".tmp.npy"):
+                # 旧版本写到一半留下的临时文件
+                pcm_path.unlink(missing_ok=True)
+                continue
+            size = pcm_path.stat().st_size
+            self.index[pcm_path.stem] = size
+            self.total_bytes += size
+
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, text, voice_id, text_language, top_k, top_p, temperature, is_half):
+        key_str = "|".join(
+            [
+                normalize_cache_text(text),
+                voice_id,
+                text_language,
+                f"{top_k}",
+                f"{top_p}",
+                f"{temperature}",
+                f"{int(is_half)}",
+                f"{self.base_seed}",
+            ]
+        )
+        return hashlib.sha1(key_str.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def key_to_seed(key):
+        """由 key 推出固定的采样 seed"""
+        return int(key[:8], 16)
+
+    def contains(self, key):
+        """只查索引，不读文件也不计入命中统计"""
+        with self.lock:
+            return key in self.index
+
+    def get(self, key):
+        """命中返回 float 音频（与 decode_semantic 的输出一致），否则返回 None"""
+        pcm_path = self.cache_dir.joinpath(f"{key}.npy")
+
+        with self.lock:
+            if key not in self.index:
+                self.misses += 1
+                return None
+            self.index.move_to_end(key)
+            self.hits += 1
+
+        try:
+            pcm = np.load(pcm_path)
+            os.utime(pcm_path)  # 更新 mtime，重启后依然能按 LRU 顺序淘汰
+        except Exception as e:
+            print(f"TTS audio cache 读取失败 {key}: {e}")
+            with self.lock:
+                self.total_bytes -= self.index.pop(key, 0)
+                self.hits -= 1
+                self.misses += 1
+            return None
+
+        return pcm.astype(np.float32) / 32768
+
+    def put(self, key, audio):
+        pcm = np.clip(audio * 32768, -32768, 32767).astype(np.int16)
+
+        pcm_path = self.cache_dir.joinpath(f"{key}.npy")
+        # 临时文件不用 .npy 后缀，写到一半中断时不会在重启后被当成缓存加载
+        tmp_path = self.cache_dir.joinpath(f"{key}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, pcm)
+        os.replace(tmp_path, pcm_path)
+        size = pcm_path.stat().st_size
+
+        with self.lock:
+            self.total_bytes += size - self.index.get(key, 0)
+            self.index[key] = size
+            self.index.move_to_end(key)
+
+            # 超出上限，淘汰最久没用的
+            while self.total_bytes > self.max_bytes and len(self.index) > 1:
+                old_key, old_size = self.index.popitem(last=False)
+                self.total_bytes -= old_size
+                self.cache_dir.joinpath(f"{old_key}.npy").unlink(missing_ok=True)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "size_mb": round(self.total_bytes / 1024 / 1024, 2),
+            "entries": len(self.index),
+        }
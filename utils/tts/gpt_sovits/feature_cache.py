@@ -0,0 +1,243 @@
+"""
+TTS 前端特征缓存
+
+催收话术里有大量重复的句子（问候语、法律声明、还款提醒），对这些句子缓存 get_phones_and_bert 的结果，
+跳过 clean_text / G2P / BERT 前向。
+
+- 内存：LRU，按 (规范化文本, 语种, is_half, 文本前端版本, BERT 模型指纹) 的 hash 作为 key
+- 磁盘（可选）：<key>.npy 保存 BERT 特征；<key>.json 保存 phones 等，重启 Streamlit 后依然有效，总大小超过上限时按 LRU 淘汰
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from utils.tts.gpt_sovits.text import TEXT_FRONTEND_VERSION
+
+
+def normalize_cache_text(text: str):
+    """去掉首尾空白并合并连续空白，作为缓存 key 的文本部分"""
+    return re.sub(r"\s+", " ", text.strip())
+
+
+class PhoneBertCache:
+    """phones + BERT 特征的两级缓存
+
+    Args:
+        max_size (int): 内存 LRU 最多保存的条数
+        cache_dir (str | None): 磁盘缓存目录，None 则只用内存
+        max_disk_mb (float): 磁盘缓存总大小上限（MB）
+    """
+
+    def __init__(self, max_size=1024, cache_dir=None, max_disk_mb=1024):
+        self.max_size = max_size
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.model_fingerprint = ""  # BERT 模型指纹，加载模型后通过 set_model_fingerprint 设置
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        # 磁盘上的 key -> 文件大小（npy + json），按最近使用时间排序（最旧的在前）
+        self.disk_index = OrderedDict()
+        self.disk_bytes = 0
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            for meta_path in sorted(self.cache_dir.glob("*.json"), key=lambda p: p.stat().st_mtime):
+                bert_path = meta_path.with_suffix(".npy")
+                if "." in meta_path.stem or not bert_path.exists():
+                    continue  # 写到一半留下的临时文件，或者缺了 npy
+                size = meta_path.stat().st_size + bert_path.stat().st_size
+                self.disk_index[meta_path.stem] = size
+                self.disk_bytes += size
+
+        # 统计
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0  # 命中时省下的计算时间（按首次计算耗时估计）
+
+    def set_model_fingerprint(self, fingerprint):
+        """换了 BERT 模型后 key 随之变化，磁盘上旧模型算出的特征不会再被命中"""
+        self.model_fingerprint = fingerprint
+
+    def make_key(self, text, language, is_half):
+        key_str = "|".join(
+            [
+                normalize_cache_text(text),
+                language,
+                f"{int(is_half)}",
+                f"{TEXT_FRONTEND_VERSION}",  # phones / word2ph 由文本前端计算
+                self.model_fingerprint,  # BERT 特征由 BERT 模型计算
+            ]
+        )
+        return hashlib.sha1(key_str.encode("utf-8")).hexdigest()
+
+    def _remove_from_disk(self, key):
+        self.cache_dir.joinpath(f"{key}.json").unlink(missing_ok=True)
+        self.cache_dir.joinpath(f"{key}.npy").unlink(missing_ok=True)
+
+    def _load_from_disk(self, key):
+        if self.cache_dir is None:
+            return None
+
+        with self.lock:
+            if key not in self.disk_index:
+                return None
+            self.disk_index.move_to_end(key)
+
+        meta_path = self.cache_dir.joinpath(f"{key}.json")
+        bert_path = self.cache_dir.joinpath(f"{key}.npy")
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            bert = np.load(bert_path)
+            os.utime(meta_path)  # 更新 mtime，重启后依然能按 LRU 顺序淘汰
+        except Exception as e:
+            print(f"TTS feature cache 读取失败 {key}: {e}")
+            with self.lock:
+                self.disk_bytes -= self.disk_index.pop(key, 0)
+            return None
+
+        return meta, bert
+
+    def _save_to_disk(self, key, meta, bert: np.ndarray):
+        if self.cache_dir is None:
+            return
+
+        # 先写临时文件再替换，避免多进程同时读写出现半个文件；临时文件不用 .npy / .json 后缀，启动时不会被当成缓存
+        bert_path = self.cache_dir.joinpath(f"{key}.npy")
+        bert_tmp_path = self.cache_dir.joinpath(f"{key}.{os.getpid()}.npy.tmp")
+        with open(bert_tmp_path, "wb") as f:
+            np.save(f, bert)
+        os.replace(bert_tmp_path, bert_path)
+
+        meta_path = self.cache_dir.joinpath(f"{key}.json")
+        meta_tmp_path = self.cache_dir.joinpath(f"{key}.{os.getpid()}.json.tmp")
+        with open(meta_tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_tmp_path, meta_path)
+        size = meta_path.stat().st_size + bert_path.stat().st_size
+
+        with self.lock:
+            self.disk_bytes += size - self.disk_index.get(key, 0)
+            self.disk_index[key] = size
+            self.disk_index.move_to_end(key)
+
+            # 超出上限，淘汰最久没用的
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk_index) > 1:
+                old_key, old_size = self.disk_index.popitem(last=False)
+                self.disk_bytes -= old_size
+                self._remove_from_disk(old_key)
+
+    def _put_memory(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def get(self, text, language, is_half, device):
+        """查缓存，先查内存再查磁盘
+
+        Returns:
+            tuple | None: (phones, bert, norm_text)，bert 在 device 上；未命中返回 None
+        """
+        key = self.make_key(text, language, is_half)
+
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += value["cost"]
+
+        if value is None:
+            disk_value = self._load_from_disk(key)
+            if disk_value is not None:
+                meta, bert = disk_value
+                value = {
+                    "phones": meta["phones"],
+                    "norm_text": meta["norm_text"],
+                    "cost": meta["cost"],
+                    "bert": torch.from_numpy(bert),  # 直接读入内存，不再额外复制一次
+                }
+                with self.lock:
+                    self._put_memory(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self.saved_seconds += value["cost"]
+
+        if value is None:
+            return None
+        return list(value["phones"]), value["bert"].to(device), value["norm_text"]
+
+    def put(self, text, language, is_half, phones, bert, norm_text, cost):
+        """写入新计算的结果，cost 为计算耗时（秒）"""
+        key = self.make_key(text, language, is_half)
+
+        bert_cpu = bert.detach().cpu()
+        value = {"phones": list(phones), "norm_text": norm_text, "cost": cost, "bert": bert_cpu}
+        with self.lock:
+            self._put_memory(key, value)
+            self.misses += 1
+
+        try:
+            self._save_to_disk(key, {"phones": value["phones"], "norm_text": norm_text, "cost": cost}, bert_cpu.numpy())
+        except Exception as e:
+            print(f"TTS feature cache 写入失败 {key}: {e}")
+
+    def get_or_compute(self, text, language, is_half, compute_fn, device):
+        """命中缓存直接返回，否则调用 compute_fn 计算并写入缓存
+
+        Args:
+            compute_fn (callable): 返回 (phones, bert, norm_text)
+
+        Returns:
+            tuple: (phones, bert, norm_text)，bert 在 device 上
+        """
+        return self.get_or_compute_batch([text], language, is_half, lambda _: [compute_fn()], device)[0]
+
+    def get_or_compute_batch(self, texts, language, is_half, compute_batch_fn, device):
+        """多句一起查缓存，未命中的句子一起交给 compute_batch_fn 计算并写入缓存
+
+        Args:
+            compute_batch_fn (callable): 输入未命中的文本 list，返回同样长度的 (phones, bert, norm_text) list
+
+        Returns:
+            list: 每句的 (phones, bert, norm_text)，命中缓存的 bert 在 device 上
+        """
+        results = [self.get(text, language, is_half, device) for text in texts]
+
+        miss_idx = [text_idx for text_idx, result in enumerate(results) if result is None]
+        if len(miss_idx) == 0:
+            return results
+
+        t_start = time.time()
+        computed = compute_batch_fn([texts[text_idx] for text_idx in miss_idx])
+        cost = (time.time() - t_start) / len(miss_idx)  # 一起计算的耗时按句平摊
+
+        for text_idx, (phones, bert, norm_text) in zip(miss_idx, computed):
+            self.put(texts[text_idx], language, is_half, phones, bert, norm_text, cost)
+            results[text_idx] = (phones, bert, norm_text)
+
+        return results
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "memory_size": len(self.memory),
+            "disk_size_mb": round(self.disk_bytes / 1024 / 1024, 2),
+        }
@@ -8,6 +8,7 @@ import re
 import shutil
 import time
 from dataclasses import dataclass
+from typing import Optional
 from io import BytesIO
 from pathlib import Path
 
@@ -17,12 +18,15 @@ import numpy as np
 import soundfile as sf
 import streamlit as st
 import torch
+from torch.nn.utils.rnn import pad_sequence
 from transformers import AutoModelForMaskedLM, AutoTokenizer
 from transformers.models.bert.modeling_bert import BertForMaskedLM
 from transformers.models.bert.tokenization_bert_fast import BertTokenizerFast
 
 from utils import HParams
 from utils.tts.gpt_sovits.AR.models.t2s_lightning_module import Text2SemanticLightningModule
+from utils.tts.gpt_sovits.audio_cache import TTSAudioCache, get_file_md5
+from utils.tts.gpt_sovits.feature_cache import PhoneBertCache
 from utils.tts.gpt_sovits.module import cnhubert
 from utils.tts.gpt_sovits.module.cnhubert import CNHubert
 from utils.tts.gpt_sovits.module.mel_processing import spectrogram_torch
@@ -30,8 +34,25 @@ from utils.tts.gpt_sovits.module.models import SynthesizerTrn
 from utils.tts.gpt_sovits.text import cleaned_text_to_sequence
 from utils.tts.gpt_sovits.text.cleaner import clean_text
 from utils.tts.gpt_sovits.utils import load_audio
+from utils.tts.gpt_sovits.voice_profile import (
+    VoiceProfile,
+    get_model_dir_fingerprint,
+    get_voice_profile_path,
+    load_voice_profile,
+    make_voice_profile_key,
+    save_voice_profile,
+)
 from utils.web_configs import WEB_CONFIGS
 
+dict_language = {
+    "中文": "all_zh",  # 全部按中文识别
+    "英文": "en",  # 全部按英文识别#######不变
+    "日文": "all_ja",  # 全部按日文识别
+    "中英混合": "zh",  # 按中英混合识别####不变
+    "日英混合": "ja",  # 按日英混合识别####不变
+    "多语种混合": "auto",  # 多语种启动切分识别语种
+}
+
 symbol_splits = {
     "，",
     "。",
@@ -51,21 +72,57 @@ symbol_splits = {
 DEVICE = "cuda"
 HZ = 50
 
+PHONE_BERT_CACHE = PhoneBertCache(
+    max_size=WEB_CONFIGS.TTS_FEATURE_CACHE_SIZE,
+    cache_dir=WEB_CONFIGS.TTS_FEATURE_CACHE_DIR,
+    max_disk_mb=WEB_CONFIGS.TTS_FEATURE_CACHE_MAX_MB,
+)
+
+if WEB_CONFIGS.TTS_AUDIO_CACHE_DIR is not None:
+    TTS_AUDIO_CACHE = TTSAudioCache(
+        WEB_CONFIGS.TTS_AUDIO_CACHE_DIR,
+        max_mb=WEB_CONFIGS.TTS_AUDIO_CACHE_MAX_MB,
+        base_seed=WEB_CONFIGS.TTS_AUDIO_CACHE_SEED,
+    )
+else:
+    TTS_AUDIO_CACHE = None
 
-def get_bert_feature(text, bert_tokenizer, bert_model, word2ph):
+
+def truncate_bert_layers(bert_model, num_dropped=2):
+    """GPT-SoVITS 只用倒数第 3 层的 hidden state，后面 num_dropped 层直接去掉，不再计算也不保存所有层的输出"""
+    encoder = bert_model.bert.encoder
+    encoder.layer = encoder.layer[: len(encoder.layer) - num_dropped]
+    bert_model.config.num_hidden_layers = len(encoder.layer)
+    return bert_model
+
+
+def get_bert_feature_batch(text_list, word2ph_list, bert_tokenizer, bert_model):
+    """多段中文文本 padding 后一次 BERT 前向，并按 word2ph 展开到 phone 级别
+
+    只跑 BERT 主干，不计算用不到的 MLM head；load_tts_bert_model 已经去掉了最后 2 层，
+    主干的输出就是原模型倒数第 3 层的 hidden state
+
+    Returns:
+        list: 每段的 BERT 特征 [1024, phone 数]
+    """
     with torch.no_grad():
-        inputs = bert_tokenizer(text, return_tensors="pt")
+        inputs = bert_tokenizer(text_list, return_tensors="pt", padding=True)
         for i in inputs:
             inputs[i] = inputs[i].to(DEVICE)
-        res = bert_model(**inputs, output_hidden_states=True)
-        res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
-    assert len(word2ph) == len(text)
-    phone_level_feature = []
-    for i in range(len(word2ph)):
-        repeat_feature = res[i].repeat(word2ph[i], 1)
-        phone_level_feature.append(repeat_feature)
-    phone_level_feature = torch.cat(phone_level_feature, dim=0)
-    return phone_level_feature.T
+        hidden_states = bert_model.bert(**inputs)["last_hidden_state"]
+        token_len_list = inputs["attention_mask"].sum(dim=1).tolist()
+
+        bert_list = []
+        for batch_idx, (text, word2ph) in enumerate(zip(text_list, word2ph_list)):
+            assert len(word2ph) == len(text)
+            res = hidden_states[batch_idx, 1 : token_len_list[batch_idx] - 1]  # 去掉 [CLS] [SEP] 和 padding
+            phone_level_feature = torch.repeat_interleave(res, torch.tensor(word2ph, device=res.device), dim=0)
+            bert_list.append(phone_level_feature.T)
+    return bert_list
+
+
+def get_bert_feature(text, bert_tokenizer, bert_model, word2ph):
+    return get_bert_feature_batch([text], [word2ph], bert_tokenizer, bert_model)[0]
 
 
 def change_sovits_weights(sovits_path, is_half):
@@ -128,16 +185,6 @@ def clean_text_inf(text, language):
     return phones, word2ph, norm_text
 
 
-def get_bert_inf(phones, word2ph, bert_tokenizer, bert_model, norm_text, language, is_half=True):
-    language = language.replace("all_", "")
-    if language == "zh":
-        bert = get_bert_feature(norm_text, bert_tokenizer, bert_model, word2ph).to(DEVICE)  # .to(dtype)
-    else:
-        bert = torch.zeros((1024, len(phones)), dtype=torch.float16 if is_half else torch.float32).to(DEVICE)
-
-    return bert
-
-
 def get_first(text):
     pattern = "[" + "".join(re.escape(sep) for sep in symbol_splits) + "]"
     text = re.split(pattern, text)[0].strip()
@@ -145,6 +192,31 @@ def get_first(text):
 
 
 def get_phones_and_bert(text, bert_tokenizer, bert_model, language, is_half=True):
+    """获取 phones 和 BERT 特征，重复的文本直接走缓存"""
+    return get_phones_and_bert_batch([text], bert_tokenizer, bert_model, language, is_half)[0]
+
+
+def get_phones_and_bert_batch(texts, bert_tokenizer, bert_model, language, is_half=True):
+    """多句获取 phones 和 BERT 特征，命中缓存的直接返回，其余句子的中文片段一起跑一次 BERT
+
+    Returns:
+        list: 每句的 (phones, bert, norm_text)
+    """
+    return PHONE_BERT_CACHE.get_or_compute_batch(
+        texts,
+        language,
+        is_half,
+        lambda miss_texts: compute_phones_and_bert_batch(miss_texts, bert_tokenizer, bert_model, language, is_half),
+        DEVICE,
+    )
+
+
+def get_text_segments(text, language):
+    """按语种切分文本并做 G2P
+
+    Returns:
+        list: 每个片段的 (phones, word2ph, norm_text, lang)
+    """
     if language in {"en", "all_zh", "all_ja"}:
         language = language.replace("all_", "")
         if language == "en":
@@ -156,50 +228,78 @@ def get_phones_and_bert(text, bert_tokenizer, bert_model, language, is_half=True
         while "  " in formattext:
             formattext = formattext.replace("  ", " ")
         phones, word2ph, norm_text = clean_text_inf(formattext, language)
-        if language == "zh":
-            bert = get_bert_feature(norm_text, bert_tokenizer, bert_model, word2ph).to(DEVICE)
-        else:
-            bert = torch.zeros(
-                (1024, len(phones)),
-                dtype=torch.float16 if is_half else torch.float32,
-            ).to(DEVICE)
-    elif language in {"zh", "ja", "auto"}:
-        textlist = []
-        langlist = []
-        LangSegment.setfilters(["zh", "ja", "en", "ko"])
-        if language == "auto":
-            for tmp in LangSegment.getTexts(text):
-                if tmp["lang"] == "ko":
-                    langlist.append("zh")
-                    textlist.append(tmp["text"])
-                else:
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-        else:
-            for tmp in LangSegment.getTexts(text):
-                if tmp["lang"] == "en":
-                    langlist.append(tmp["lang"])
-                else:
-                    # 因无法区别中日文汉字,以用户输入为准
-                    langlist.append(language)
+        return [(phones, word2ph, norm_text, language)]
+
+    textlist = []
+    langlist = []
+    LangSegment.setfilters(["zh", "ja", "en", "ko"])
+    if language == "auto":
+        for tmp in LangSegment.getTexts(text):
+            if tmp["lang"] == "ko":
+                langlist.append("zh")
+                textlist.append(tmp["text"])
+            else:
+                langlist.append(tmp["lang"])
                 textlist.append(tmp["text"])
-        print(textlist)
-        print(langlist)
+    else:
+        for tmp in LangSegment.getTexts(text):
+            if tmp["lang"] == "en":
+                langlist.append(tmp["lang"])
+            else:
+                # 因无法区别中日文汉字,以用户输入为准
+                langlist.append(language)
+            textlist.append(tmp["text"])
+    print(textlist)
+    print(langlist)
+
+    segments = []
+    for i in range(len(textlist)):
+        phones, word2ph, norm_text = clean_text_inf(textlist[i], langlist[i])
+        segments.append((phones, word2ph, norm_text, langlist[i]))
+    return segments
+
+
+def compute_phones_and_bert(text, bert_tokenizer, bert_model, language, is_half=True):
+    return compute_phones_and_bert_batch([text], bert_tokenizer, bert_model, language, is_half)[0]
+
+
+def compute_phones_and_bert_batch(texts, bert_tokenizer, bert_model, language, is_half=True):
+    """多句计算 phones 和 BERT 特征，所有句子的中文片段 padding 后一次 BERT 前向，再按句拼回
+
+    Returns:
+        list: 每句的 (phones, bert, norm_text)
+    """
+    dtype = torch.float16 if is_half else torch.float32
+    segments_list = [get_text_segments(text, language) for text in texts]
+
+    zh_segments = [segment for segments in segments_list for segment in segments if segment[3] == "zh"]
+    zh_bert_list = []
+    if len(zh_segments) > 0:
+        zh_bert_list = get_bert_feature_batch(
+            [norm_text for _, _, norm_text, _ in zh_segments],
+            [word2ph for _, word2ph, _, _ in zh_segments],
+            bert_tokenizer,
+            bert_model,
+        )
+    zh_bert_iter = iter(zh_bert_list)
+
+    results = []
+    for segments in segments_list:
         phones_list = []
         bert_list = []
         norm_text_list = []
-        for i in range(len(textlist)):
-            lang = langlist[i]
-            phones, word2ph, norm_text = clean_text_inf(textlist[i], lang)
-            bert = get_bert_inf(phones, word2ph, bert_tokenizer, bert_model, norm_text, lang, is_half)
+        for phones, word2ph, norm_text, lang in segments:
+            if lang == "zh":
+                bert = next(zh_bert_iter)
+            else:
+                bert = torch.zeros((1024, len(phones)), dtype=dtype).to(DEVICE)
             phones_list.append(phones)
-            norm_text_list.append(norm_text)
             bert_list.append(bert)
+            norm_text_list.append(norm_text)
         bert = torch.cat(bert_list, dim=1)
-        phones = sum(phones_list, [])
-        norm_text = "".join(norm_text_list)
+        results.append((sum(phones_list, []), bert.to(dtype), "".join(norm_text_list)))
 
-    return phones, bert.to(torch.float16 if is_half else torch.float32), norm_text
+    return results
 
 
 def merge_short_text_in_array(texts, threshold):
@@ -220,6 +320,259 @@ def merge_short_text_in_array(texts, threshold):
     return result
 
 
+def get_target_text(text, text_language):
+    """句尾没有标点时补上"""
+    if text[-1] not in symbol_splits:
+        text += "。" if text_language != "en" else "."
+    return text
+
+
+def get_t2s_input_batch(
+    texts, text_language, bert_tokenizer, bert_model, bert1, phones1, ref_free=False, is_half=True, features=None
+):
+    """获取多句 T2S 模型的输入，所有句子的 BERT 特征一起计算
+
+    Args:
+        features (list | None): 与 texts 对齐的预先计算好的 (phones, bert, norm_text)，为 None 的句子在这里计算
+
+    Returns:
+        list: 每句的 (phones2, all_phoneme_ids, bert)，all_phoneme_ids 为 1 维 LongTensor，bert 为 [1024, len(all_phoneme_ids)]
+    """
+    texts = [get_target_text(text, text_language) for text in texts]
+    for text in texts:
+        print("=" * 20, "\n实际输入的目标文本(每句):", text)
+
+    features = list(features) if features is not None else [None] * len(texts)
+    miss_idx = [text_idx for text_idx, feature in enumerate(features) if feature is None]
+    if len(miss_idx) > 0:
+        miss_features = get_phones_and_bert_batch(
+            [texts[text_idx] for text_idx in miss_idx], bert_tokenizer, bert_model, text_language, is_half
+        )
+        for text_idx, feature in zip(miss_idx, miss_features):
+            features[text_idx] = feature
+
+    t2s_inputs = []
+    for phones2, bert2, norm_text2 in features:
+        print("=" * 20, "\n前端处理后的文本(每句):", norm_text2)
+        if not ref_free:
+            bert = torch.cat([bert1, bert2], 1)
+            all_phoneme_ids = torch.LongTensor(phones1 + phones2).to(DEVICE)
+        else:
+            bert = bert2
+            all_phoneme_ids = torch.LongTensor(phones2).to(DEVICE)
+        t2s_inputs.append((phones2, all_phoneme_ids, bert.to(DEVICE)))
+
+    return t2s_inputs
+
+
+def normalize_audio(audio):
+    max_audio = np.abs(audio).max()  # 简单防止 16bit 爆音
+    if max_audio > 1:
+        audio /= max_audio
+    return audio
+
+
+def decode_semantic(vq_model, pred_semantic, phones2, refer, ge=None, generator=None):
+    """semantic token 解码为音频
+
+    Args:
+        pred_semantic (torch.Tensor): 1 维 semantic token
+        ge (torch.Tensor | None): 预先计算的参考音频音色 embedding，None 则由 refer 计算
+        generator (torch.Generator | None): 先验采样噪声使用的 generator，None 则使用全局随机数
+
+    Returns:
+        np.ndarray: float 音频，幅值已限制在 [-1, 1]
+    """
+    pred_semantic = pred_semantic.unsqueeze(0).unsqueeze(0)  # mq要多unsqueeze一次
+
+    # audio = vq_model.decode(pred_semantic, all_phoneme_ids, refer).detach().cpu().numpy()[0, 0]
+    audio = (
+        vq_model.decode(pred_semantic, torch.LongTensor(phones2).to(DEVICE).unsqueeze(0), refer, ge=ge, generator=generator)
+        .detach()
+        .cpu()
+        .numpy()[0, 0]
+    )  ###试试重建不带上prompt部分
+    return normalize_audio(audio)
+
+
+def decode_semantic_batch(vq_model, pred_semantic_list, phones2_list, ge, generators=None):
+    """多句 semantic token 一起解码为音频
+
+    Args:
+        generators (list | None): 每句先验采样噪声使用的 generator，None 则使用全局随机数
+
+    Returns:
+        list: 每句的 float 音频，幅值已限制在 [-1, 1]
+    """
+    text_list = [torch.LongTensor(phones2).to(DEVICE) for phones2 in phones2_list]
+    audio_list = vq_model.decode_batch(pred_semantic_list, text_list, ge, generators=generators)
+    return [normalize_audio(audio.detach().float().cpu().numpy()) for audio in audio_list]
+
+
+def get_tts_wav_sentence(
+    text,
+    text_language,
+    bert_tokenizer,
+    bert_model,
+    vq_model,
+    max_sec,
+    t2s_model: Text2SemanticLightningModule,
+    prompt,
+    refer,
+    bert1,
+    phones1,
+    top_k=20,
+    top_p=0.6,
+    temperature=0.6,
+    ref_free=False,
+    is_half=True,
+    voice_id=None,
+    ge=None,
+):
+    """合成单句语音
+
+    Args:
+        text (str): 单句文本
+        text_language (str): 已转换的语种标识，如 "zh"、"all_zh"
+
+    Returns:
+        np.ndarray: float 音频，幅值已限制在 [-1, 1]
+    """
+    return get_tts_wav_batch(
+        [text],
+        text_language,
+        bert_tokenizer,
+        bert_model,
+        vq_model,
+        max_sec,
+        t2s_model,
+        prompt,
+        refer,
+        bert1,
+        phones1,
+        top_k=top_k,
+        top_p=top_p,
+        temperature=temperature,
+        ref_free=ref_free,
+        is_half=is_half,
+        voice_id=voice_id,
+        ge=ge,
+    )[0]
+
+
+def get_tts_wav_batch(
+    texts,
+    text_language,
+    bert_tokenizer,
+    bert_model,
+    vq_model,
+    max_sec,
+    t2s_model: Text2SemanticLightningModule,
+    prompt,
+    refer,
+    bert1,
+    phones1,
+    top_k=20,
+    top_p=0.6,
+    temperature=0.6,
+    ref_free=False,
+    is_half=True,
+    voice_id=None,
+    ge=None,
+    features=None,
+):
+    """多句一起送入 T2S 模型解码，自回归循环只跑一次，SoVITS 解码也是一个 batch
+
+    Args:
+        voice_id (str | None): 音色标识（音色名 + 参考音频 hash + GPT / SoVITS 权重 hash），不为 None 且开启了音频缓存时，
+            命中缓存的句子直接读取，其余句子使用固定 seed 采样后写入缓存
+        ge (torch.Tensor | None): 预先计算的参考音频音色 embedding（HandlerTTS.ge），None 则由 refer 计算
+        features (list | None): 与 texts 对齐的预先计算好的 (phones, bert, norm_text)，None 则现场计算
+
+    Returns:
+        list: 每句的 float 音频
+    """
+    use_audio_cache = TTS_AUDIO_CACHE is not None and voice_id is not None and not ref_free
+
+    audio_list = [None] * len(texts)
+    cache_keys = [None] * len(texts)
+    if use_audio_cache:
+        for text_idx, text in enumerate(texts):
+            cache_keys[text_idx] = TTS_AUDIO_CACHE.make_key(
+                text, voice_id, text_language, top_k, top_p, temperature, is_half
+            )
+            audio_list[text_idx] = TTS_AUDIO_CACHE.get(cache_keys[text_idx])
+        print(f"TTS audio cache: {TTS_AUDIO_CACHE.stats()}")
+
+    infer_idx = [text_idx for text_idx, audio in enumerate(audio_list) if audio is None]
+    if len(infer_idx) == 0:
+        return audio_list
+
+    t2s_inputs = get_t2s_input_batch(
+        [texts[text_idx] for text_idx in infer_idx],
+        text_language,
+        bert_tokenizer,
+        bert_model,
+        bert1,
+        phones1,
+        ref_free,
+        is_half,
+        features=[features[text_idx] for text_idx in infer_idx] if features is not None else None,
+    )
+    phones2_list = [phones2 for phones2, _, _ in t2s_inputs]
+    all_phoneme_ids_list = [all_phoneme_ids for _, all_phoneme_ids, _ in t2s_inputs]
+    bert_list = [bert for _, _, bert in t2s_inputs]
+
+    all_phoneme_len = torch.tensor([i.shape[0] for i in all_phoneme_ids_list]).to(DEVICE)
+    all_phoneme_ids = pad_sequence(all_phoneme_ids_list, batch_first=True)
+    bert = pad_sequence([i.T for i in bert_list], batch_first=True).transpose(1, 2)  # [bsz, 1024, x_len_max]
+
+    generators = None
+    decode_generators = [None] * len(infer_idx)
+    if use_audio_cache:
+        # 每句使用由缓存 key 推出的 seed，T2S 采样和 SoVITS 先验噪声各用一个 generator，
+        # 重新生成的音频和缓存一致，也不受同一个 batch 里其他句子的影响
+        generators = [
+            torch.Generator(device=DEVICE).manual_seed(TTS_AUDIO_CACHE.key_to_seed(cache_keys[text_idx]))
+            for text_idx in infer_idx
+        ]
+        decode_generators = [
+            torch.Generator(device=DEVICE).manual_seed(TTS_AUDIO_CACHE.key_to_seed(cache_keys[text_idx]))
+            for text_idx in infer_idx
+        ]
+
+    with torch.no_grad():
+        pred_semantic_list = t2s_model.model.infer_panel_batch(
+            all_phoneme_ids,
+            all_phoneme_len,
+            None if ref_free else prompt,
+            bert,
+            top_k=top_k,
+            top_p=top_p,
+            temperature=temperature,
+            early_stop_num=HZ * max_sec,
+            generators=generators,
+        )
+        if ge is None and refer is not None:
+            ge = vq_model.get_ge(refer)
+        if ge is not None:
+            decoded_list = decode_semantic_batch(
+                vq_model, pred_semantic_list, phones2_list, ge, generators=decode_generators if use_audio_cache else None
+            )
+        else:
+            decoded_list = [
+                decode_semantic(vq_model, p, phones2, refer, generator=generator)
+                for p, phones2, generator in zip(pred_semantic_list, phones2_list, decode_generators)
+            ]
+
+        for text_idx, audio in zip(infer_idx, decoded_list):
+            audio_list[text_idx] = audio
+            if use_audio_cache:
+                TTS_AUDIO_CACHE.put(cache_keys[text_idx], audio)
+
+    return audio_list
+
+
 def get_tts_wav(
     text,
     text_language,
@@ -245,17 +598,11 @@ def get_tts_wav(
     ref_free=False,
     is_half=True,
     process_bar=None,
+    batch_size=8,
+    voice_id=None,
+    ge=None,
 ):
 
-    dict_language = {
-        "中文": "all_zh",  # 全部按中文识别
-        "英文": "en",  # 全部按英文识别#######不变
-        "日文": "all_ja",  # 全部按日文识别
-        "中英混合": "zh",  # 按中英混合识别####不变
-        "日英混合": "ja",  # 按日英混合识别####不变
-        "多语种混合": "auto",  # 多语种启动切分识别语种
-    }
-
     prompt_language = dict_language[prompt_language]
     text_language = dict_language[text_language]
 
@@ -270,59 +617,71 @@ def get_tts_wav(
     texts = text.split("\n")
     texts = merge_short_text_in_array(texts, 5)  # 小于 5 个字符的句子和上一句合并
 
+    # 解决输入目标文本的空行导致报错的问题
+    texts = [text for text in texts if len(text.strip()) > 0]
+
     audio_opt = []
     # if not ref_free:
     #     phones1, bert1, _ = get_phones_and_bert(prompt_text, bert_tokenizer, bert_model, prompt_language, is_half)
 
-    for text_idx, text in enumerate(texts):
+    # 整段回复里需要合成的句子先一起算 phones + BERT（中文片段只跑一次 BERT），结果直接传给每个 batch，
+    # 不依赖特征缓存的容量；已有音频缓存的句子不用算
+    features = [None] * len(texts)
+    if TTS_AUDIO_CACHE is not None and voice_id is not None and not ref_free:
+        infer_idx = [
+            text_idx
+            for text_idx, text in enumerate(texts)
+            if not TTS_AUDIO_CACHE.contains(
+                TTS_AUDIO_CACHE.make_key(text, voice_id, text_language, top_k, top_p, temperature, is_half)
+            )
+        ]
+    else:
+        infer_idx = list(range(len(texts)))
+    if len(infer_idx) > 0:
+        infer_features = get_phones_and_bert_batch(
+            [get_target_text(texts[text_idx], text_language) for text_idx in infer_idx],
+            bert_tokenizer,
+            bert_model,
+            text_language,
+            is_half,
+        )
+        for text_idx, feature in zip(infer_idx, infer_features):
+            features[text_idx] = feature
+
+    # 每 batch_size 句一起解码
+    for batch_start in range(0, len(texts), batch_size):
+        batch_texts = texts[batch_start : batch_start + batch_size]
+
+        audio_list = get_tts_wav_batch(
+            batch_texts,
+            text_language,
+            bert_tokenizer,
+            bert_model,
+            vq_model,
+            max_sec,
+            t2s_model,
+            prompt,
+            refer,
+            bert1,
+            phones1,
+            top_k=top_k,
+            top_p=top_p,
+            temperature=temperature,
+            ref_free=ref_free,
+            is_half=is_half,
+            voice_id=voice_id,
+            ge=ge,
+            features=features[batch_start : batch_start + batch_size],
+        )
+        for audio in audio_list:
+            audio_opt.append(audio)
+            audio_opt.append(zero_wav)
 
         if process_bar is not None:
-            percent_complete = (text_idx + 1) / len(texts)
+            percent_complete = (batch_start + len(batch_texts)) / len(texts)
             process_bar.progress(percent_complete, text=f"正在生成语音 {round(percent_complete * 100, 2)} % ...")
 
-        # 解决输入目标文本的空行导致报错的问题
-        if len(text.strip()) == 0:
-            continue
-        if text[-1] not in symbol_splits:
-            text += "。" if text_language != "en" else "."
-        print("=" * 20, "\n实际输入的目标文本(每句):", text)
-        phones2, bert2, norm_text2 = get_phones_and_bert(text, bert_tokenizer, bert_model, text_language, is_half)
-        print("=" * 20, "\n前端处理后的文本(每句):", norm_text2)
-
-        if not ref_free:
-            bert = torch.cat([bert1, bert2], 1)
-            all_phoneme_ids = torch.LongTensor(phones1 + phones2).to(DEVICE).unsqueeze(0)
-        else:
-            pass
-            # bert = bert2
-            # all_phoneme_ids = torch.LongTensor(phones2).to(DEVICE).unsqueeze(0)
-
-        bert = bert.to(DEVICE).unsqueeze(0)
-        all_phoneme_len = torch.tensor([all_phoneme_ids.shape[-1]]).to(DEVICE)
-
-        with torch.no_grad():
-            pred_semantic, idx = t2s_model.model.infer_panel(
-                all_phoneme_ids,
-                all_phoneme_len,
-                None if ref_free else prompt,
-                bert,
-                top_k=top_k,
-                top_p=top_p,
-                temperature=temperature,
-                early_stop_num=HZ * max_sec,
-            )
-        pred_semantic = pred_semantic[:, -idx:].unsqueeze(0)  # .unsqueeze(0) # mq要多unsqueeze一次
-
-        # audio = vq_model.decode(pred_semantic, all_phoneme_ids, refer).detach().cpu().numpy()[0, 0]
-        audio = (
-            vq_model.decode(pred_semantic, torch.LongTensor(phones2).to(DEVICE).unsqueeze(0), refer).detach().cpu().numpy()[0, 0]
-        )  ###试试重建不带上prompt部分
-        max_audio = np.abs(audio).max()  # 简单防止 16bit 爆音
-        if max_audio > 1:
-            audio /= max_audio
-        audio_opt.append(audio)
-        audio_opt.append(zero_wav)
-
+    print(f"TTS feature cache: {PHONE_BERT_CACHE.stats()}")
     return hps.data.sampling_rate, (np.concatenate(audio_opt, 0) * 32768).astype(np.int16)
 
 
@@ -416,6 +775,42 @@ def cut_sentences(input_text, how_to_cut):
     return cut_txt
 
 
+class StreamSentenceSplitter:
+    """流式切句：LLM 边生成边喂入文本，遇到 symbol_splits 标点即切出完整句子
+
+    切句规则与 split_txt 一致，过短的句子（小于 min_len 个字符）会和下一句合并，效果同 merge_short_text_in_array
+    """
+
+    def __init__(self, min_len=5):
+        self.min_len = min_len
+        self.buffer = ""
+        self.pending = ""  # 已经切出但太短、等待与下一句合并的文本
+
+    def feed(self, text):
+        """喂入新生成的文本，返回已经完整的句子 list"""
+        self.buffer += text.replace("……", "。").replace("——", "，")
+
+        sentences = []
+        i_split_tail = 0
+        for i_split_head, char in enumerate(self.buffer):
+            if char not in symbol_splits:
+                continue
+            self.pending += self.buffer[i_split_tail : i_split_head + 1]
+            i_split_tail = i_split_head + 1
+            if len(self.pending.strip()) >= self.min_len:
+                sentences.append(self.pending)
+                self.pending = ""
+        self.buffer = self.buffer[i_split_tail:]
+        return sentences
+
+    def flush(self):
+        """生成结束，返回剩余的文本（可能为空）"""
+        rest = (self.pending + self.buffer).strip()
+        self.pending = ""
+        self.buffer = ""
+        return [rest] if len(rest) > 0 else []
+
+
 def get_gpt_and_sovits_model_path(voice_character_name: str, tts_model_root: Path):
     gpt_path_list = [i for i in tts_model_root.glob(f"{voice_character_name}*.ckpt")]
     sovits_path_list = [i for i in tts_model_root.glob(f"{voice_character_name}*.pth")]
@@ -430,7 +825,7 @@ def get_gpt_and_sovits_model_path(voice_character_name: str, tts_model_root: Pat
 class HandlerTTS:
     bert_tokenizer: BertTokenizerFast
     bert_model: BertForMaskedLM
-    ssl_model: CNHubert
+    ssl_model: Optional[CNHubert]  # 读取音色档案时不加载，为 None
     max_sec: KeyboardInterrupt
     t2s_model: Text2SemanticLightningModule
     vq_model: SynthesizerTrn
@@ -439,9 +834,76 @@ class HandlerTTS:
     prompt_text: str
     prompt: torch.Tensor
     refer: torch.Tensor
+    ge: torch.Tensor  # refer 的音色 embedding，加载音色时算好，每句解码不再重复计算
     bert1: torch.Tensor
     phones1: list
     zero_wav: np.ndarray
+    voice_id: str
+
+
+@st.cache_resource
+def load_tts_bert_model(bert_path, is_half=True):
+    """BERT 模型所有音色共用"""
+    print("Loading tts bert model...")
+    bert_tokenizer = AutoTokenizer.from_pretrained(bert_path)
+    bert_model = AutoModelForMaskedLM.from_pretrained(bert_path)
+    truncate_bert_layers(bert_model)
+    if is_half:
+        bert_model = bert_model.half()
+    bert_model = bert_model.to(DEVICE)
+    PHONE_BERT_CACHE.set_model_fingerprint(get_model_dir_fingerprint(bert_path))
+    print("load tts bert model done!")
+    return bert_tokenizer, bert_model
+
+
+@st.cache_resource
+def load_tts_ssl_model(cnhubert_base_path, is_half=True):
+    """CNHubert 只在计算音色档案时需要，按需加载"""
+    print("Loading tts ssl model...")
+    ssl_model = cnhubert.get_model(cnhubert_base_path)
+    if is_half:
+        ssl_model = ssl_model.half()
+    ssl_model = ssl_model.to(DEVICE)
+    print("load tts ssl model done !")
+    return ssl_model
+
+
+def compute_voice_profile(ref_wav_path, prompt_text, ssl_model, vq_model, hps, zero_wav, bert_tokenizer, bert_model, is_half=True):
+    """计算参考音频的 prompt semantic token、频谱、音色 embedding，以及参考文本的 phones 和 BERT 特征"""
+    print("=" * 20, "\n加载参考音频 。。。")
+    t1 = time.time()
+    with torch.no_grad():
+        wav16k, sr = librosa.load(ref_wav_path, sr=16000)
+        if wav16k.shape[0] > 160000 or wav16k.shape[0] < 48000:
+            raise OSError("参考音频在3~10秒范围外，请更换！")
+        wav16k = torch.from_numpy(wav16k)
+        zero_wav_torch = torch.from_numpy(zero_wav)
+
+        wav16k = wav16k.half()
+        zero_wav_torch = zero_wav_torch.half()
+
+        wav16k = wav16k.to(DEVICE)
+        zero_wav_torch = zero_wav_torch.to(DEVICE)
+
+        wav16k = torch.cat([wav16k, zero_wav_torch])
+        ssl_content = ssl_model.model(wav16k.unsqueeze(0))["last_hidden_state"].transpose(1, 2)  # .float()
+        codes = vq_model.extract_latent(ssl_content)
+
+        prompt_semantic = codes[0, 0]
+        prompt = prompt_semantic.unsqueeze(0).to(DEVICE)
+    print("加载 参考音频 用时: ", time.time() - t1)
+
+    t3 = time.time()
+    refer = get_spepc(hps, ref_wav_path)
+    if is_half:
+        refer = refer.half()
+    refer = refer.to(DEVICE)
+    with torch.no_grad():
+        ge = vq_model.get_ge(refer)
+    print("get_spepc 用时: ", time.time() - t3)
+
+    phones1, bert1, _ = get_phones_and_bert(prompt_text, bert_tokenizer, bert_model, dict_language["中英混合"], is_half)
+    return VoiceProfile(prompt=prompt, refer=refer, ge=ge, phones1=phones1, bert1=bert1)
 
 
 @st.cache_resource
@@ -486,20 +948,7 @@ def get_tts_model(voice_character_name="艾丝妲", is_half=True):
     print(f"cnhubert_base_path dir = {cnhubert_base_path}")
     print(f"bert_path dir = {bert_path}")
 
-    print("Loading tts bert model...")
-    bert_tokenizer = AutoTokenizer.from_pretrained(bert_path)
-    bert_model = AutoModelForMaskedLM.from_pretrained(bert_path)
-    if is_half:
-        bert_model = bert_model.half()
-    bert_model = bert_model.to(DEVICE)
-    print("load tts bert model done!")
-
-    print("Loading tts ssl model...")
-    ssl_model = cnhubert.get_model(cnhubert_base_path)
-    if is_half:
-        ssl_model = ssl_model.half()
-    ssl_model = ssl_model.to(DEVICE)
-    print("load tts ssl model done !")
+    bert_tokenizer, bert_model = load_tts_bert_model(bert_path, is_half)
 
     max_sec, t2s_model = change_gpt_weights(gpt_path, is_half)
     vq_model, hps = change_sovits_weights(sovits_path, is_half)
@@ -508,53 +957,30 @@ def get_tts_model(voice_character_name="艾丝妲", is_half=True):
         int(hps.data.sampling_rate * 0.3),
         dtype=np.float16 if is_half else np.float32,
     )
-    print("=" * 20, "\n加载参考音频 。。。")
-    t1 = time.time()
-    with torch.no_grad():
-        wav16k, sr = librosa.load(ref_wav_path, sr=16000)
-        if wav16k.shape[0] > 160000 or wav16k.shape[0] < 48000:
-            raise OSError("参考音频在3~10秒范围外，请更换！")
-        wav16k = torch.from_numpy(wav16k)
-        zero_wav_torch = torch.from_numpy(zero_wav)
-
-        wav16k = wav16k.half()
-        zero_wav_torch = zero_wav_torch.half()
-
-        wav16k = wav16k.to(DEVICE)
-        zero_wav_torch = zero_wav_torch.to(DEVICE)
-
-        wav16k = torch.cat([wav16k, zero_wav_torch])
-        ssl_content = ssl_model.model(wav16k.unsqueeze(0))["last_hidden_state"].transpose(1, 2)  # .float()
-        codes = vq_model.extract_latent(ssl_content)
-
-        prompt_semantic = codes[0, 0]
-        prompt = prompt_semantic.unsqueeze(0).to(DEVICE)
-    print("加载 参考音频 用时: ", time.time() - t1)
-
-    t3 = time.time()
-    refer = get_spepc(hps, ref_wav_path)
-    if is_half:
-        refer = refer.half()
-    refer = refer.to(DEVICE)
-    print("get_spepc 用时: ", time.time() - t3)
-
-    ref_free = False
-    dict_language = {
-        "中文": "all_zh",  # 全部按中文识别
-        "英文": "en",  # 全部按英文识别#######不变
-        "日文": "all_ja",  # 全部按日文识别
-        "中英混合": "zh",  # 按中英混合识别####不变
-        "日英混合": "ja",  # 按日英混合识别####不变
-        "多语种混合": "auto",  # 多语种启动切分识别语种
-    }
 
     prompt_text = prompt_text.strip("\n")
     if prompt_text[-1] not in symbol_splits:
         prompt_text += "。"
     print("=" * 20, "\n音频参考文本:", prompt_text)
 
-    if not ref_free:
-        phones1, bert1, _ = get_phones_and_bert(prompt_text, bert_tokenizer, bert_model, dict_language["中英混合"], is_half)
+    # 参考音频的推理结果保存为音色档案，再次启动时直接读取，不需要加载 CNHubert
+    profile_path = get_voice_profile_path(sovits_path)
+    profile_key = make_voice_profile_key(ref_wav_path, prompt_text, sovits_path, bert_path, is_half)
+    voice_profile = load_voice_profile(profile_path, profile_key, DEVICE)
+    ssl_model = None
+    if voice_profile is None:
+        ssl_model = load_tts_ssl_model(cnhubert_base_path, is_half)
+        voice_profile = compute_voice_profile(
+            ref_wav_path, prompt_text, ssl_model, vq_model, hps, zero_wav, bert_tokenizer, bert_model, is_half
+        )
+        try:
+            save_voice_profile(profile_path, profile_key, voice_profile)
+            print(f"保存音色档案: {profile_path}")
+        except Exception as e:
+            # 权重目录只读等情况，不影响使用，下次启动时重新计算
+            print(f"voice profile 写入失败 {profile_path}: {e}")
+    else:
+        print(f"读取音色档案: {profile_path}")
 
     tts_handler = HandlerTTS(
         bert_tokenizer=bert_tokenizer,
@@ -566,11 +992,14 @@ def get_tts_model(voice_character_name="艾丝妲", is_half=True):
         hps=hps,
         inp_ref=str(ref_wav_path),
         prompt_text=prompt_text,
-        prompt=prompt,
-        refer=refer,
-        bert1=bert1,
-        phones1=phones1,
+        prompt=voice_profile.prompt,
+        refer=voice_profile.refer,
+        ge=voice_profile.ge,
+        bert1=voice_profile.bert1,
+        phones1=voice_profile.phones1,
         zero_wav=zero_wav,
+        # 权重 hash 也作为音色的一部分，同名音色重新训练后不会读到旧权重合成的缓存音频
+        voice_id=f"{voice_character_name}:{get_file_md5(ref_wav_path)}:{get_file_md5(gpt_path)}:{get_file_md5(sovits_path)}",
     )
 
     return tts_handler
@@ -595,6 +1024,8 @@ def gen_tts_wav(
     zero_wav,
     wav_path_output,
     how_to_cut="凑四句一切",  # ["不切", "凑四句一切", "凑50字一切", "按中文句号。切", "按英文句号.切", "按标点符号切"]
+    voice_id=None,
+    ge=None,
 ):
 
     process_bar = st.progress(0, text="正在生成语音...")
@@ -625,6 +1056,8 @@ def gen_tts_wav(
         ref_free=False,
         is_half=True,
         process_bar=process_bar,
+        voice_id=voice_id,
+        ge=ge,
     )
 
     process_bar.progress(1, text=f"正在生成语音 100.00 % ...")
@@ -7,6 +7,7 @@ from torch.cuda.amp import autocast
 from torch.nn import Conv1d, Conv2d, ConvTranspose1d
 from torch.nn import functional as F
 from torch.nn.utils import remove_weight_norm, spectral_norm, weight_norm
+from torch.nn.utils.rnn import pad_sequence
 
 from utils.tts.gpt_sovits.module import attentions, commons, modules
 from utils.tts.gpt_sovits.module.commons import get_padding, init_weights
@@ -744,6 +745,8 @@ class SynthesizerTrn(nn.Module):
     Synthesizer for Training
     """
 
+    DEC_CONTEXT_FRAMES = 32  # decode_batch 中 dec 单侧感受野的上限（帧），HiFi-GAN 实际约十几帧
+
     def __init__(
         self,
         spec_channels,
@@ -888,12 +891,33 @@ class SynthesizerTrn(nn.Module):
         return o, y_mask, (z, z_p, m_p, logs_p)
 
     @torch.no_grad()
-    def decode(self, codes, text, refer, noise_scale=0.5):
-        ge = None
-        if refer is not None:
-            refer_lengths = torch.LongTensor([refer.size(2)]).to(refer.device)
-            refer_mask = torch.unsqueeze(commons.sequence_mask(refer_lengths, refer.size(2)), 1).to(refer.dtype)
-            ge = self.ref_enc(refer * refer_mask, refer_mask)
+    def get_ge(self, refer):
+        """参考音频频谱的音色 embedding [1, gin_channels, 1]，同一个参考音频只需要计算一次"""
+        refer_lengths = torch.LongTensor([refer.size(2)]).to(refer.device)
+        refer_mask = torch.unsqueeze(commons.sequence_mask(refer_lengths, refer.size(2)), 1).to(refer.dtype)
+        return self.ref_enc(refer * refer_mask, refer_mask)
+
+    @staticmethod
+    def get_noise(m_p, y_lengths, generators=None):
+        """先验采样的噪声
+
+        generators 不为 None 时每句用自己的 generator 只生成有效长度的噪声，padding 部分为 0，
+        同一句话的噪声和 batch 里的其他句子、padding 长度都无关，固定 seed 时单句解码和 batch 解码得到相同的噪声
+        """
+        if generators is None:
+            return torch.randn_like(m_p)
+        noise = torch.zeros_like(m_p)
+        for i, generator in enumerate(generators):
+            length = min(int(y_lengths[i]), m_p.size(2))
+            noise[i, :, :length] = torch.randn(
+                m_p.size(1), length, generator=generator, device=generator.device, dtype=m_p.dtype
+            ).to(m_p.device)
+        return noise
+
+    @torch.no_grad()
+    def decode(self, codes, text, refer, noise_scale=0.5, ge=None, generator=None):
+        if ge is None and refer is not None:
+            ge = self.get_ge(refer)
 
         y_lengths = torch.LongTensor([codes.size(2) * 2]).to(codes.device)
         text_lengths = torch.LongTensor([text.size(-1)]).to(text.device)
@@ -903,13 +927,66 @@ class SynthesizerTrn(nn.Module):
             quantized = F.interpolate(quantized, size=int(quantized.shape[-1] * 2), mode="nearest")
 
         x, m_p, logs_p, y_mask = self.enc_p(quantized, y_lengths, text, text_lengths, ge)
-        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+        noise = self.get_noise(m_p, y_lengths, None if generator is None else [generator])
+        z_p = m_p + noise * torch.exp(logs_p) * noise_scale
 
         z = self.flow(z_p, y_mask, g=ge, reverse=True)
 
         o = self.dec((z * y_mask)[:, :, :], g=ge)
         return o
 
+    @torch.no_grad()
+    def decode_batch(self, codes_list, text_list, ge, noise_scale=0.5, generators=None):
+        """多句一起解码，enc_p / flow 由 mask 处理 padding，dec 只跑一次
+
+        dec（HiFi-GAN）没有 mask，卷积的 bias 让置零的 padding 也产生非零激活，经感受野影响较短句子的最后几帧。
+        所以较短的句子把最后 2 * DEC_CONTEXT_FRAMES 帧单独再过一次 dec，替换掉最后 DEC_CONTEXT_FRAMES 帧的音频：
+        只要 dec 单侧感受野不超过 DEC_CONTEXT_FRAMES 帧，结果和逐句 decode 一致（除 batch 计算带来的浮点误差外）。
+
+        Args:
+            codes_list (list): 每句的 1 维 semantic token
+            text_list (list): 每句的 1 维 phoneme id
+            ge (torch.Tensor): get_ge 预先算好的音色 embedding
+            generators (list | None): 每句的 torch.Generator，不为 None 时噪声只由各句自己的 seed 决定
+
+        Returns:
+            list: 每句的 1 维音频 tensor
+        """
+        batch_size = len(codes_list)
+        y_lengths = torch.LongTensor([codes.size(0) * 2 for codes in codes_list]).to(ge.device)
+        text_lengths = torch.LongTensor([text.size(0) for text in text_list]).to(ge.device)
+        codes = pad_sequence(codes_list, batch_first=True).unsqueeze(0)  # [1, bsz, T]
+        text = pad_sequence(text_list, batch_first=True)
+        ge = ge.expand(batch_size, -1, -1)
+
+        quantized = self.quantizer.decode(codes)
+        if self.semantic_frame_rate == "25hz":
+            quantized = F.interpolate(quantized, size=int(quantized.shape[-1] * 2), mode="nearest")
+
+        x, m_p, logs_p, y_mask = self.enc_p(quantized, y_lengths, text, text_lengths, ge)
+        z_p = m_p + self.get_noise(m_p, y_lengths, generators) * torch.exp(logs_p) * noise_scale
+
+        z = self.flow(z_p, y_mask, g=ge, reverse=True)
+
+        z = z * y_mask
+        o = self.dec(z, g=ge)
+        hop_length = o.size(-1) // z.size(-1)
+
+        audio_list = []
+        for i in range(batch_size):
+            length = int(y_lengths[i])
+            audio = o[i, 0, : length * hop_length]
+            if length < z.size(-1):
+                # 结尾受 padding 影响的部分单独解码，左边多带 DEC_CONTEXT_FRAMES 帧上下文
+                tail_start = max(0, length - 2 * self.DEC_CONTEXT_FRAMES)
+                tail = self.dec(z[i : i + 1, :, tail_start:length], g=ge[i : i + 1])[0, 0]
+                replace_start = 0 if tail_start == 0 else length - self.DEC_CONTEXT_FRAMES
+                audio = torch.cat(
+                    [audio[: replace_start * hop_length], tail[(replace_start - tail_start) * hop_length :]], dim=0
+                )
+            audio_list.append(audio)
+        return audio_list
+
     def extract_latent(self, x):
         ssl = self.ssl_proj(x)
         quantized, codes, commit_loss, quantized_list = self.quantizer(ssl)
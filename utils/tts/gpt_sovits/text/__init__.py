@@ -2,6 +2,9 @@ from utils.tts.gpt_sovits.text.symbols import *
 
 _symbol_to_id = {s: i for i, s in enumerate(symbols)}
 
+# 文本前端（规范化、G2P、字典）的版本，输出的 phones 可能变化时加 1，让依赖 phones 的缓存失效
+TEXT_FRONTEND_VERSION = 2
+
 
 def cleaned_text_to_sequence(cleaned_text):
     """Converts a string of text to a sequence of IDs corresponding to the symbols in the text.
@@ -1,5 +1,6 @@
 import os
 import re
+from functools import lru_cache
 
 import cn2an
 from pypinyin import lazy_pinyin, Style
@@ -37,25 +38,47 @@ rep_map = {
     "～":"…",
 }
 
+# 多音节韵母 / 单音节拼音的改写规则
+v_rep_map = {
+    "uei": "ui",
+    "iou": "iu",
+    "uen": "un",
+}
+pinyin_rep_map = {
+    "ing": "ying",
+    "i": "yi",
+    "in": "yin",
+    "u": "wu",
+}
+single_rep_map = {
+    "v": "yu",
+    "e": "e",
+    "i": "y",
+    "u": "w",
+}
+
+# 正则只在模块加载时编译一次
+RE_REP_MAP = re.compile("|".join(re.escape(p) for p in rep_map.keys()))
+RE_NOT_ZH_OR_PUNCTUATION = re.compile(r"[^\u4e00-\u9fa5" + "".join(punctuation) + r"]+")
+RE_SENTENCE_SPLIT = re.compile(r"(?<=[{0}])\s*".format("".join(punctuation)))
+RE_ENGLISH = re.compile("[a-zA-Z]+")
+
 tone_modifier = ToneSandhi()
+text_normalizer = TextNormalizer()  # 无状态，所有调用共用一个
 
 
 def replace_punctuation(text):
     text = text.replace("嗯", "恩").replace("呣", "母")
-    pattern = re.compile("|".join(re.escape(p) for p in rep_map.keys()))
 
-    replaced_text = pattern.sub(lambda x: rep_map[x.group()], text)
+    replaced_text = RE_REP_MAP.sub(lambda x: rep_map[x.group()], text)
 
-    replaced_text = re.sub(
-        r"[^\u4e00-\u9fa5" + "".join(punctuation) + r"]+", "", replaced_text
-    )
+    replaced_text = RE_NOT_ZH_OR_PUNCTUATION.sub("", replaced_text)
 
     return replaced_text
 
 
 def g2p(text):
-    pattern = r"(?<=[{0}])\s*".format("".join(punctuation))
-    sentences = [i for i in re.split(pattern, text) if i.strip() != ""]
+    sentences = [i for i in RE_SENTENCE_SPLIT.split(text) if i.strip() != ""]
     phones, word2ph = _g2p(sentences)
     return phones, word2ph
 
@@ -73,13 +96,21 @@ def _get_initials_finals(word):
     return initials, finals
 
 
+@lru_cache(maxsize=65536)
+def _get_word_initials_finals(word, pos):
+    """单个词的声母和变调后的韵母，pypinyin + 变调只和 (词, 词性) 有关，重复的词直接走缓存"""
+    initials, finals = _get_initials_finals(word)
+    finals = tone_modifier.modified_tone(word, pos, finals)
+    return tuple(initials), tuple(finals)
+
+
 def _g2p(segments):
     phones_list = []
     word2ph = []
     for seg in segments:
         pinyins = []
         # Replace all English words in the sentence
-        seg = re.sub("[a-zA-Z]+", "", seg)
+        seg = RE_ENGLISH.sub("", seg)
         seg_cut = psg.lcut(seg)
         initials = []
         finals = []
@@ -87,14 +118,11 @@ def _g2p(segments):
         for word, pos in seg_cut:
             if pos == "eng":
                 continue
-            sub_initials, sub_finals = _get_initials_finals(word)
-            sub_finals = tone_modifier.modified_tone(word, pos, sub_finals)
-            initials.append(sub_initials)
-            finals.append(sub_finals)
+            sub_initials, sub_finals = _get_word_initials_finals(word, pos)
+            initials.extend(sub_initials)
+            finals.extend(sub_finals)
 
             # assert len(sub_initials) == len(sub_finals) == len(word)
-        initials = sum(initials, [])
-        finals = sum(finals, [])
         #
         for c, v in zip(initials, finals):
             raw_pinyin = c + v
@@ -113,30 +141,13 @@ def _g2p(segments):
 
                 if c:
                     # 多音节
-                    v_rep_map = {
-                        "uei": "ui",
-                        "iou": "iu",
-                        "uen": "un",
-                    }
                     if v_without_tone in v_rep_map.keys():
                         pinyin = c + v_rep_map[v_without_tone]
                 else:
                     # 单音节
-                    pinyin_rep_map = {
-                        "ing": "ying",
-                        "i": "yi",
-                        "in": "yin",
-                        "u": "wu",
-                    }
                     if pinyin in pinyin_rep_map.keys():
                         pinyin = pinyin_rep_map[pinyin]
                     else:
-                        single_rep_map = {
-                            "v": "yu",
-                            "e": "e",
-                            "i": "y",
-                            "u": "w",
-                        }
                         if pinyin[0] in single_rep_map.keys():
                             pinyin = single_rep_map[pinyin[0]] + pinyin[1:]
 
@@ -152,8 +163,7 @@ def _g2p(segments):
 
 def text_normalize(text):
     # https://github.com/PaddlePaddle/PaddleSpeech/tree/develop/paddlespeech/t2s/frontend/zh_normalization
-    tx = TextNormalizer()
-    sentences = tx.normalize(text)
+    sentences = text_normalizer.normalize(text)
     dest_text = ""
     for sentence in sentences:
         dest_text += replace_punctuation(sentence)
@@ -1,6 +1,9 @@
-from utils.tts.gpt_sovits.text import chinese, cleaned_text_to_sequence, symbols, english
+import importlib
 
-language_module_map = {"zh": chinese, "en": english}
+from utils.tts.gpt_sovits.text import chinese, cleaned_text_to_sequence, symbols
+
+# 中文前端启动时导入；英文前端（g2p_en / nltk / CMU 字典）只在 LangSegment 切出英文片段时才导入
+language_module_map = {"zh": chinese.__name__, "en": "utils.tts.gpt_sovits.text.english"}
 special = [
     # ("%", "zh", "SP"),
     ("￥", "zh", "SP2"),
@@ -16,7 +19,7 @@ def clean_text(text, language):
     for special_s, special_l, target_symbol in special:
         if special_s in text and language == special_l:
             return clean_special(text, language, special_s, target_symbol)
-    language_module = language_module_map[language]
+    language_module = importlib.import_module(language_module_map[language])
     norm_text = language_module.text_normalize(text)
     if language == "zh":
         phones, word2ph = language_module.g2p(norm_text)
@@ -36,7 +39,7 @@ def clean_special(text, language, special_s, target_symbol):
     特殊静音段sp符号处理
     """
     text = text.replace(special_s, ",")
-    language_module = language_module_map[language]
+    language_module = importlib.import_module(language_module_map[language])
     norm_text = language_module.text_normalize(text)
     phones = language_module.g2p(norm_text)
     new_ph = []
@@ -0,0 +1,117 @@
+"""
+英文 G2P 字典的二进制格式
+
+原来整本 CMU 字典 pickle 成 dict of list，加载要反序列化十几万个词，常驻几十 MB 的 Python 对象。
+这里改成按词排序后写成一个文件，mmap 打开后二分查找，只有真正查到的词才会解码：
+
+    magic(4B) | version(uint32) | count(uint32) | offsets(uint32 * (count + 1)) | entries
+
+每个 entry 为 utf-8 编码的 "词\\t音素 音素 ..."，offsets 为各 entry 相对 entries 起点的偏移。
+"""
+
+import mmap
+import os
+import struct
+from array import array
+
+CMU_DICT_MAGIC = b"CMUD"
+CMU_DICT_VERSION = 1
+HEADER = struct.Struct("<4sII")
+
+
+def save_cmu_dict(g2p_dict, file_path):
+    """把 {词: [[音素, ...]]} 写成二进制字典，只保留第一个读音"""
+    entries = sorted(
+        (word.encode("utf-8"), " ".join(prons[0]).encode("utf-8")) for word, prons in g2p_dict.items() if len(prons) > 0
+    )
+
+    offsets = array("I", [0])
+    data = bytearray()
+    for word, phones in entries:
+        data += word + b"\t" + phones
+        offsets.append(len(data))
+    if offsets.itemsize != 4:
+        raise RuntimeError("array('I') is not 32 bit on this platform")
+
+    # 先写临时文件再替换，避免中途出错留下半个文件
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(CMU_DICT_MAGIC, CMU_DICT_VERSION, len(entries)))
+        f.write(offsets.tobytes())
+        f.write(data)
+    os.replace(tmp_path, file_path)
+
+
+def is_cmu_dict_fresh(file_path, source_paths):
+    """二进制字典存在、版本一致且比所有源文件都新"""
+    if not os.path.exists(file_path):
+        return False
+
+    with open(file_path, "rb") as f:
+        header = f.read(HEADER.size)
+    if len(header) != HEADER.size or HEADER.unpack(header)[:2] != (CMU_DICT_MAGIC, CMU_DICT_VERSION):
+        return False
+
+    cache_mtime = os.path.getmtime(file_path)
+    return all(os.path.getmtime(source_path) <= cache_mtime for source_path in source_paths if os.path.exists(source_path))
+
+
+class CmuDict:
+    """只读的 mmap 字典，接口和原来的 {词: [[音素, ...]]} 保持一致
+
+    支持 `word in d`、`d[word]`、`d.get(word)` 以及 `del d[word]`（只在内存里屏蔽该词，不改文件）
+    """
+
+    def __init__(self, file_path):
+        with open(file_path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.count = HEADER.unpack_from(self.mm, 0)
+        if magic != CMU_DICT_MAGIC or version != CMU_DICT_VERSION:
+            raise ValueError(f"not a cmu dict file: {file_path}")
+
+        offsets_start = HEADER.size
+        self.data_start = offsets_start + (self.count + 1) * 4
+        self.offsets = memoryview(self.mm)[offsets_start : self.data_start].cast("I")
+        self.removed = set()
+
+    def _find(self, word):
+        """二分查找，返回音素字节串，找不到返回 None"""
+        key = word.encode("utf-8")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self.mm[self.data_start + self.offsets[mid] : self.data_start + self.offsets[mid + 1]]
+            entry_key, _, phones = entry.partition(b"\t")
+            if entry_key == key:
+                return phones
+            if entry_key < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def get(self, word, default=None):
+        if word in self.removed:
+            return default
+        phones = self._find(word)
+        if phones is None:
+            return default
+        return [phones.decode("utf-8").split(" ") if phones else []]
+
+    def __getitem__(self, word):
+        prons = self.get(word)
+        if prons is None:
+            raise KeyError(word)
+        return prons
+
+    def __contains__(self, word):
+        return word not in self.removed and self._find(word) is not None
+
+    def __delitem__(self, word):
+        if word not in self:
+            raise KeyError(word)
+        self.removed.add(word)
+
+    def __len__(self):
+        return self.count - len(self.removed)
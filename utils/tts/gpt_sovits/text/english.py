@@ -6,12 +6,14 @@ from builtins import str as unicode
 from string import punctuation
 
 import wordsegment
+import g2p_en.g2p as g2p_en_module
 from g2p_en import G2p
 from g2p_en.expand import normalize_numbers
 from nltk import pos_tag
 from nltk.tokenize import TweetTokenizer
 
 from utils.tts.gpt_sovits.text import symbols
+from utils.tts.gpt_sovits.text.cmu_dict import CmuDict, is_cmu_dict_fresh, save_cmu_dict
 
 word_tokenize = TweetTokenizer().tokenize
 
@@ -19,7 +21,7 @@ current_file_path = os.path.dirname(__file__)
 CMU_DICT_PATH = os.path.join(current_file_path, "cmudict.rep")
 CMU_DICT_FAST_PATH = os.path.join(current_file_path, "cmudict-fast.rep")
 CMU_DICT_HOT_PATH = os.path.join(current_file_path, "engdict-hot.rep")
-CACHE_PATH = os.path.join(current_file_path, "engdict_cache.pickle")
+CACHE_PATH = os.path.join(current_file_path, "engdict_cache.bin")
 NAMECACHE_PATH = os.path.join(current_file_path, "namedict_cache.pickle")
 
 arpa = {
@@ -184,22 +186,13 @@ def hot_reload_hot(g2p_dict):
     return g2p_dict
 
 
-def cache_dict(g2p_dict, file_path):
-    with open(file_path, "wb") as pickle_file:
-        pickle.dump(g2p_dict, pickle_file)
-
-
 def get_dict():
-    if os.path.exists(CACHE_PATH):
-        with open(CACHE_PATH, "rb") as pickle_file:
-            g2p_dict = pickle.load(pickle_file)
-    else:
-        g2p_dict = read_dict_new()
-        cache_dict(g2p_dict, CACHE_PATH)
+    # 源文件（含自定义发音）有改动时才重新生成二进制字典，平时直接 mmap 打开，按需查词
+    if not is_cmu_dict_fresh(CACHE_PATH, [CMU_DICT_PATH, CMU_DICT_FAST_PATH, CMU_DICT_HOT_PATH]):
+        g2p_dict = hot_reload_hot(read_dict_new())
+        save_cmu_dict(g2p_dict, CACHE_PATH)
 
-    g2p_dict = hot_reload_hot(g2p_dict)
-
-    return g2p_dict
+    return CmuDict(CACHE_PATH)
 
 
 def get_namedict():
@@ -212,36 +205,57 @@ def get_namedict():
     return name_dict
 
 
+# 适配中文及 g2p_en 标点，正则只在模块加载时编译一次
+RE_REP_MAP = [
+    (re.compile("[;:：，；]"), ","),
+    (re.compile('["’]'), "'"),
+    (re.compile("。"), "."),
+    (re.compile("！"), "!"),
+    (re.compile("？"), "?"),
+]
+RE_NOT_EN = re.compile("[^ A-Za-z'.,?!\-]")
+RE_IE = re.compile(r"(?i)i\.e\.")
+RE_EG = re.compile(r"(?i)e\.g\.")
+
+
 def text_normalize(text):
     # todo: eng text normalize
-    # 适配中文及 g2p_en 标点
-    rep_map = {
-        "[;:：，；]": ",",
-        '["’]': "'",
-        "。": ".",
-        "！": "!",
-        "？": "?",
-    }
-    for p, r in rep_map.items():
-        text = re.sub(p, r, text)
+    for p, r in RE_REP_MAP:
+        text = p.sub(r, text)
 
     # 来自 g2p_en 文本格式化处理
     # 增加大写兼容
     text = unicode(text)
     text = normalize_numbers(text)
     text = "".join(char for char in unicodedata.normalize("NFD", text) if unicodedata.category(char) != "Mn")  # Strip accents
-    text = re.sub("[^ A-Za-z'.,?!\-]", "", text)
-    text = re.sub(r"(?i)i\.e\.", "that is", text)
-    text = re.sub(r"(?i)e\.g\.", "for example", text)
+    text = RE_NOT_EN.sub("", text)
+    text = RE_IE.sub("that is", text)
+    text = RE_EG.sub("for example", text)
 
     return text
 
 
+class _EmptyCmudict:
+    """代替 nltk 的 cmudict，dict() 返回空字典"""
+
+    @staticmethod
+    def dict():
+        return {}
+
+
 class en_G2p(G2p):
     def __init__(self):
-        super().__init__()
-        # 分词初始化
-        wordsegment.load()
+        # G2p.__init__ 会把 nltk 的整本 cmudict 解析成 dict，随后又被下面的字典覆盖，初始化期间临时换成空字典；
+        # 字母表、音素表、模型参数和多音字表仍由 g2p_en 自己初始化，和所装的版本保持一致
+        cmudict = g2p_en_module.cmudict
+        g2p_en_module.cmudict = _EmptyCmudict
+        try:
+            super().__init__()
+        finally:
+            g2p_en_module.cmudict = cmudict
+
+        # 分词词频表较大，第一次需要拆复合词时再加载
+        self.wordsegment_loaded = False
 
         # 扩展过时字典, 添加姓名字典
         self.cmu = get_dict()
@@ -337,6 +351,9 @@ class en_G2p(G2p):
             return phones
 
         # 尝试进行分词，应对复合词
+        if not self.wordsegment_loaded:
+            wordsegment.load()
+            self.wordsegment_loaded = True
         comps = wordsegment.segment(word.lower())
 
         # 无法分词的送回去预测
@@ -347,12 +364,20 @@ class en_G2p(G2p):
         return [phone for comp in comps for phone in self.qryword(comp)]
 
 
-_g2p = en_G2p()
+_g2p = None
+
+
+def get_g2p():
+    """第一次遇到英文时再初始化 G2P 模型和字典"""
+    global _g2p
+    if _g2p is None:
+        _g2p = en_G2p()
+    return _g2p
 
 
 def g2p(text):
     # g2p_en 整段推理，剔除不存在的arpa返回
-    phone_list = _g2p(text)
+    phone_list = get_g2p()(text)
     phones = [ph if ph != "<unk>" else "UNK" for ph in phone_list if ph not in [" ", "<pad>", "UW", "</s>", "<s>"]]
 
     return replace_phs(phones)
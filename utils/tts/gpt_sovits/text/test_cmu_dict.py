@@ -0,0 +1,81 @@
+"""
+CmuDict 二进制字典和原来 {词: [[音素, ...]]} 字典的查询结果一致
+"""
+
+import os
+
+import pytest
+
+from utils.tts.gpt_sovits.text.cmu_dict import CmuDict, is_cmu_dict_fresh, save_cmu_dict
+
+G2P_DICT = {
+    "hello": [["HH", "AH0", "L", "OW1"], ["HH", "EH0", "L", "OW1"]],
+    "world": [["W", "ER1", "L", "D"]],
+    "a": [["AH0"], ["EY1"]],
+    "app": [["AE1", "P"]],
+    "apple": [["AE1", "P", "AH0", "L"]],
+    "zebra": [["Z", "IY1", "B", "R", "AH0"]],
+    "café": [["K", "AE0", "F", "EY1"]],
+    "o'clock": [["AH0", "K", "L", "AA1", "K"]],
+    "empty": [],
+}
+
+
+@pytest.fixture
+def cmu_dict(tmp_path):
+    file_path = tmp_path.joinpath("engdict.bin")
+    save_cmu_dict(G2P_DICT, file_path)
+    return CmuDict(file_path)
+
+
+def test_lookup_matches_dict(cmu_dict):
+    for word, prons in G2P_DICT.items():
+        if len(prons) == 0:
+            # 没有读音的词不写入
+            assert word not in cmu_dict
+            continue
+        assert word in cmu_dict
+        assert cmu_dict[word] == prons[:1]  # 只保留第一个读音
+        assert cmu_dict.get(word) == prons[:1]
+    assert len(cmu_dict) == sum(len(prons) > 0 for prons in G2P_DICT.values())
+
+
+def test_missing_word(cmu_dict):
+    for word in ["", "hell", "helloo", "aa", "zzz", "Hello"]:
+        assert word not in cmu_dict
+        assert cmu_dict.get(word, "default") == "default"
+        with pytest.raises(KeyError):
+            cmu_dict[word]
+
+
+def test_delete_only_masks_in_memory(cmu_dict, tmp_path):
+    del cmu_dict["app"]
+    assert "app" not in cmu_dict
+    assert cmu_dict.get("app") is None
+    assert "apple" in cmu_dict
+    assert len(cmu_dict) == len([p for p in G2P_DICT.values() if len(p) > 0]) - 1
+    with pytest.raises(KeyError):
+        del cmu_dict["app"]
+
+    # 文件本身没有变化
+    assert CmuDict(tmp_path.joinpath("engdict.bin"))["app"] == G2P_DICT["app"][:1]
+
+
+def test_is_cmu_dict_fresh(tmp_path):
+    source_path = tmp_path.joinpath("cmudict.rep")
+    source_path.write_text("hello HH AH0 L OW1\n")
+    file_path = tmp_path.joinpath("engdict.bin")
+    assert not is_cmu_dict_fresh(file_path, [source_path])
+
+    save_cmu_dict(G2P_DICT, file_path)
+    os.utime(source_path, (0, 0))
+    assert is_cmu_dict_fresh(file_path, [source_path])
+
+    # 源文件更新后需要重新生成
+    mtime = os.path.getmtime(file_path) + 10
+    os.utime(source_path, (mtime, mtime))
+    assert not is_cmu_dict_fresh(file_path, [source_path])
+
+    # 不是二进制字典的文件
+    file_path.write_bytes(b"not a cmu dict")
+    assert not is_cmu_dict_fresh(file_path, [])
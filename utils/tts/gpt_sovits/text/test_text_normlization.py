@@ -0,0 +1,76 @@
+"""
+预编译正则 + translate 版本的 TextNormalizer 和原版输出一致
+"""
+
+import re
+
+import pytest
+
+pytest.importorskip("pypinyin")
+
+from utils.tts.gpt_sovits.text.zh_normalization.text_normlization import TextNormalizer  # noqa: E402
+
+CORPUS = [
+    "您好，请问是张先生本人吗？我这边是消费金融公司的客服专员。",
+    "您在2024年3月5日的借款5000元已经逾期15天了，请问您什么时候方便处理一下？",
+    "根据合同约定，逾期期间每天会产生0.05%的罚息，逾期越久费用越高。",
+    "如果您今天18:30之前还款，我们可以帮您申请减免部分逾期费用。",
+    "您可以通过APP首页的还款入口，或者拨打客服电话4001234567进行还款。",
+    "好的，那我们约定本周五之前还款3000元，剩余部分下个月15号前结清，可以吗？",
+    "如有疑问，请在工作日9:00~18:00联系我们，再见。",
+    "α/β①②③（测试）《书名》【注】-x_y|z\\w <a> {b} #&@“引号”^ ！",
+    "ΓΔΘΛΞΠΣσςΦΨΩ γδεζηθικλμνξοπρτυφχψω ④⑤⑥⑦⑧⑨⑩ 3/4",
+    "a b,c;d?e!f”g：h、i",
+]
+
+OLD_POST_REPLACE = [
+    ("/", "每"), ("①", "一"), ("②", "二"), ("③", "三"), ("④", "四"), ("⑤", "五"), ("⑥", "六"), ("⑦", "七"),
+    ("⑧", "八"), ("⑨", "九"), ("⑩", "十"), ("α", "阿尔法"), ("β", "贝塔"), ("γ", "伽玛"), ("Γ", "伽玛"),
+    ("δ", "德尔塔"), ("Δ", "德尔塔"), ("ε", "艾普西龙"), ("ζ", "捷塔"), ("η", "依塔"), ("θ", "西塔"), ("Θ", "西塔"),
+    ("ι", "艾欧塔"), ("κ", "喀帕"), ("λ", "拉姆达"), ("Λ", "拉姆达"), ("μ", "缪"), ("ν", "拗"), ("ξ", "克西"),
+    ("Ξ", "克西"), ("ο", "欧米克伦"), ("π", "派"), ("Π", "派"), ("ρ", "肉"), ("ς", "西格玛"), ("Σ", "西格玛"),
+    ("σ", "西格玛"), ("τ", "套"), ("υ", "宇普西龙"), ("φ", "服艾"), ("Φ", "服艾"), ("χ", "器"), ("ψ", "普赛"),
+    ("Ψ", "普赛"), ("ω", "欧米伽"), ("Ω", "欧米伽"),
+]  # fmt: skip
+
+
+class OldTextNormalizer(TextNormalizer):
+    """原版实现：正则现场编译，_post_replace 逐个 str.replace"""
+
+    def __init__(self):
+        self.SENTENCE_SPLITOR = re.compile(r'([：、，；。？！,;?!][”’]?)')
+
+    def _split(self, text, lang="zh"):
+        if lang == "zh":
+            text = text.replace(" ", "")
+            text = re.sub(r'[——《》【】<>{}()（）#&@“”^_|\\]', '', text)
+        text = self.SENTENCE_SPLITOR.sub(r'\1\n', text)
+        text = text.strip()
+        return [sentence.strip() for sentence in re.split(r'\n+', text)]
+
+    def _post_replace(self, sentence):
+        for old, new in OLD_POST_REPLACE:
+            sentence = sentence.replace(old, new)
+        return re.sub(r'[-——《》【】<=>{}()（）#&@“”^_|\\]', '', sentence)
+
+
+@pytest.mark.parametrize("text", CORPUS)
+def test_split_matches_old(text):
+    for lang in ["zh", "en"]:
+        assert TextNormalizer()._split(text, lang) == OldTextNormalizer()._split(text, lang)
+
+
+@pytest.mark.parametrize("text", CORPUS)
+def test_post_replace_matches_old(text):
+    assert TextNormalizer()._post_replace(text) == OldTextNormalizer()._post_replace(text)
+
+
+@pytest.mark.parametrize("text", CORPUS)
+def test_normalize_matches_old(text):
+    assert TextNormalizer().normalize(text) == OldTextNormalizer().normalize(text)
+
+
+def test_normalizer_is_reusable():
+    tx = TextNormalizer()
+    first = [tx.normalize(text) for text in CORPUS]
+    assert [tx.normalize(text) for text in CORPUS] == first
@@ -0,0 +1,108 @@
+"""
+GPT-SoVITS 音色档案
+
+参考音频相关的推理结果只和 (参考音频, 参考文本, SoVITS 权重) 有关，第一次加载音色时计算后保存到权重旁边：
+
+- prompt   参考音频经 CNHubert + vq_model.extract_latent 得到的 semantic token
+- refer    参考音频的线性频谱（get_spepc，需要调用 ffmpeg 读取音频）
+- ge       refer 的音色 embedding
+- phones1 / bert1  参考文本的 phones 和 BERT 特征
+
+档案里记录了由上述输入、BERT 模型以及文本前端版本算出的 key，任意一项有变化时 key 对不上，重新计算。
+之后再启动时直接读取档案，不需要加载 CNHubert，也不需要再跑一遍 BERT。
+"""
+
+import hashlib
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import torch
+
+from utils.tts.gpt_sovits.audio_cache import get_file_md5
+from utils.tts.gpt_sovits.text import TEXT_FRONTEND_VERSION
+
+VOICE_PROFILE_VERSION = 1
+
+
+@dataclass
+class VoiceProfile:
+    prompt: torch.Tensor
+    refer: torch.Tensor
+    ge: torch.Tensor
+    phones1: list
+    bert1: torch.Tensor
+
+
+def get_model_dir_fingerprint(model_dir):
+    """模型目录的指纹：路径 + 各文件的大小和修改时间，权重很大，不计算 md5"""
+    model_dir = Path(model_dir)
+    items = [str(model_dir.absolute())]
+    if model_dir.is_dir():
+        for file_path in sorted(model_dir.iterdir()):
+            if file_path.is_file():
+                stat = file_path.stat()
+                items.append(f"{file_path.name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha1("|".join(items).encode("utf-8")).hexdigest()
+
+
+def make_voice_profile_key(ref_wav_path, prompt_text, sovits_path, bert_path, is_half):
+    key_str = "|".join(
+        [
+            f"{VOICE_PROFILE_VERSION}",
+            get_file_md5(ref_wav_path),
+            prompt_text,
+            get_file_md5(sovits_path),
+            get_model_dir_fingerprint(bert_path),  # bert1 由 BERT 模型计算
+            f"{TEXT_FRONTEND_VERSION}",  # phones1 由文本前端计算
+            f"{int(is_half)}",
+        ]
+    )
+    return hashlib.sha1(key_str.encode("utf-8")).hexdigest()
+
+
+def get_voice_profile_path(sovits_path):
+    """档案保存在 SoVITS 权重旁边：<权重名>.voice_profile.pt"""
+    sovits_path = Path(sovits_path)
+    return sovits_path.with_name(f"{sovits_path.stem}.voice_profile.pt")
+
+
+def load_voice_profile(profile_path, key, device):
+    """读取档案，不存在或 key 不匹配返回 None"""
+    if not Path(profile_path).exists():
+        return None
+
+    try:
+        data = torch.load(profile_path, map_location=device)
+    except Exception as e:
+        print(f"voice profile 读取失败 {profile_path}: {e}")
+        return None
+
+    if data.get("key") != key:
+        print(f"voice profile 已过期，重新计算: {profile_path}")
+        return None
+
+    return VoiceProfile(
+        prompt=data["prompt"],
+        refer=data["refer"],
+        ge=data["ge"],
+        phones1=data["phones1"],
+        bert1=data["bert1"],
+    )
+
+
+def save_voice_profile(profile_path, key, profile: VoiceProfile):
+    profile_path = Path(profile_path)
+    data = {
+        "key": key,
+        "prompt": profile.prompt.cpu(),
+        "refer": profile.refer.cpu(),
+        "ge": profile.ge.cpu(),
+        "phones1": profile.phones1,
+        "bert1": profile.bert1.cpu(),
+    }
+
+    # 先写临时文件再替换，避免中途出错留下半个文件
+    tmp_path = profile_path.with_name(f"{profile_path.name}.{os.getpid()}.tmp")
+    torch.save(data, tmp_path)
+    os.replace(tmp_path, profile_path)
@@ -1,11 +1,23 @@
+import queue
+import threading
 from datetime import datetime
+from io import BytesIO
 from pathlib import Path
 
+import numpy as np
+import soundfile as sf
 import streamlit as st
 
 # from utils.tts.sambert_hifigan.tts_sambert_hifigan import gen_tts_wav
 from utils.model_loader import TTS_HANDLER
-from utils.tts.gpt_sovits.inference_gpt_sovits import gen_tts_wav
+from utils.tts.gpt_sovits.inference_gpt_sovits import (
+    StreamSentenceSplitter,
+    dict_language,
+    gen_tts_wav,
+    get_first,
+    get_tts_wav_batch,
+    symbol_splits,
+)
 from utils.web_configs import WEB_CONFIGS
 
 
@@ -47,8 +59,224 @@ def gen_tts_in_spinner(cur_response):
                 TTS_HANDLER.phones1,
                 TTS_HANDLER.zero_wav,
                 tts_save_path,
+                voice_id=TTS_HANDLER.voice_id,
+                ge=TTS_HANDLER.ge,
             )
 
             show_audio(tts_save_path)
             st.toast("生成语音成功!")
     return tts_save_path
+
+
+class StreamTTSWorker:
+    """流式 TTS：后台线程合成切好的句子，LLM 还在生成时就可以拿到第一句的音频
+
+    合成时把队列里已经在排队的句子一起取出，整批走 T2S / BERT / SoVITS 的 batch 推理。
+
+    用法：
+        worker = StreamTTSWorker()
+        for token in llm_stream:
+            worker.feed(token)
+            for chunk in worker.get_ready_chunks():
+                ...  # 播放 / 发送 chunk
+        worker.finish()
+        for chunk in worker.get_ready_chunks(block=True):
+            ...
+        worker.save_wav(path)
+    """
+
+    _FINISH_TAG = None
+    ERROR_SILENCE_SEC_PER_CHAR = 0.2  # 合成失败的句子按字数估计时长，用静音占位
+
+    def __init__(
+        self,
+        tts_handler=TTS_HANDLER,
+        text_language="中英混合",
+        top_k=5,
+        top_p=1,
+        temperature=1,
+        is_half=True,
+        on_chunk=None,
+        max_batch_size=WEB_CONFIGS.TTS_STREAMING_MAX_BATCH,
+    ):
+        self.tts_handler = tts_handler
+        self.max_batch_size = max_batch_size
+        self.on_chunk = on_chunk  # 每合成一句后在后台线程中回调 on_chunk(chunk, sampling_rate)，例如送给流式数字人
+        self.text_language = dict_language[text_language]
+        self.sampling_params = dict(top_k=top_k, top_p=top_p, temperature=temperature, is_half=is_half)
+
+        self.splitter = StreamSentenceSplitter()
+        self.sentence_queue = queue.Queue()
+        self.chunk_queue = queue.Queue()
+        self.audio_opt = []
+        self.errors = []  # 合成失败的 (句子, 异常)，对应位置的音频为静音
+        self.finished = False
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @property
+    def sampling_rate(self):
+        return self.tts_handler.hps.data.sampling_rate
+
+    def feed(self, text):
+        """喂入 LLM 新生成的文本，切出的完整句子送入后台合成"""
+        for sentence in self.splitter.feed(text):
+            self.sentence_queue.put(sentence)
+
+    def finish(self):
+        """LLM 生成结束，送入剩余文本并通知后台线程退出，重复调用无影响"""
+        if self.finished:
+            return
+        self.finished = True
+        for sentence in self.splitter.flush():
+            self.sentence_queue.put(sentence)
+        self.sentence_queue.put(self._FINISH_TAG)
+
+    def _get_sentences(self):
+        """阻塞等到一句，再把队列里已经在排队的句子一起取出，凑成一个 batch"""
+        sentences = [self.sentence_queue.get()]
+        while sentences[-1] is not self._FINISH_TAG and len(sentences) < self.max_batch_size:
+            try:
+                sentences.append(self.sentence_queue.get_nowait())
+            except queue.Empty:
+                break
+        return sentences
+
+    def _synthesize(self, sentences):
+        """一个 batch 的句子一起合成（T2S、BERT、SoVITS 解码都是 batch），返回每句的 float 音频"""
+        return get_tts_wav_batch(
+            sentences,
+            self.text_language,
+            self.tts_handler.bert_tokenizer,
+            self.tts_handler.bert_model,
+            self.tts_handler.vq_model,
+            self.tts_handler.max_sec,
+            self.tts_handler.t2s_model,
+            self.tts_handler.prompt,
+            self.tts_handler.refer,
+            self.tts_handler.bert1,
+            self.tts_handler.phones1,
+            voice_id=self.tts_handler.voice_id,
+            ge=self.tts_handler.ge,
+            **self.sampling_params,
+        )
+
+    def _synthesize_safe(self, sentences):
+        """batch 合成失败时逐句重试，仍然失败的句子记录错误并用静音占位，不会从整段回复中消失"""
+        try:
+            return self._synthesize(sentences)
+        except Exception as e:
+            print(f"Stream TTS batch 生成失败，逐句重试: {e}")
+
+        audio_list = []
+        for sentence in sentences:
+            try:
+                audio_list.append(self._synthesize([sentence])[0])
+            except Exception as e:
+                print(f"Stream TTS 生成失败: {sentence}, {e}")
+                self.errors.append((sentence, e))
+                silence_len = int(len(sentence) * self.ERROR_SILENCE_SEC_PER_CHAR * self.sampling_rate)
+                audio_list.append(np.zeros(silence_len, dtype=np.float32))
+        return audio_list
+
+    def _run(self):
+        is_first = True
+        finished = False
+        while not finished:
+            sentences = self._get_sentences()
+            if sentences[-1] is self._FINISH_TAG:
+                sentences.pop()
+                finished = True
+            if len(sentences) == 0:
+                continue
+
+            if is_first and sentences[0][0] not in symbol_splits and len(get_first(sentences[0])) < 4:
+                sentences[0] = "。" + sentences[0]  # 同 get_tts_wav，开头太短时补标点
+            is_first = False
+
+            for audio in self._synthesize_safe(sentences):
+                audio = np.concatenate([audio, self.tts_handler.zero_wav], 0)
+                chunk = (audio * 32768).astype(np.int16)
+                self.audio_opt.append(chunk)
+                self.chunk_queue.put(chunk)
+                if self.on_chunk is not None:
+                    self.on_chunk(chunk, self.sampling_rate)
+
+        self.chunk_queue.put(self._FINISH_TAG)
+
+    def get_ready_chunks(self, block=False):
+        """获取已经合成好的音频 chunk（int16 PCM）
+
+        Args:
+            block (bool): True 则一直等到后台线程全部合成完成
+        """
+        while True:
+            try:
+                chunk = self.chunk_queue.get(block=block)
+            except queue.Empty:
+                return
+            if chunk is self._FINISH_TAG:
+                return
+            yield chunk
+
+    def save_wav(self, wav_path_output):
+        if len(self.audio_opt) == 0:
+            return None
+
+        wav = BytesIO()
+        sf.write(wav, np.concatenate(self.audio_opt, 0), self.sampling_rate, format="wav")
+        wav.seek(0)
+
+        with open(wav_path_output, "wb") as f:
+            f.write(wav.getvalue())
+        print("output:", wav_path_output)
+        return wav_path_output
+
+
+def chunk_to_wav_bytes(chunk, sampling_rate):
+    wav = BytesIO()
+    sf.write(wav, chunk, sampling_rate, format="wav")
+    return wav.getvalue()
+
+
+def start_stream_tts(on_chunk=None):
+    """开启流式 TTS，未启用 TTS 时返回 None"""
+    if TTS_HANDLER is None or not st.session_state.gen_tts_checkbox or not WEB_CONFIGS.TTS_STREAMING:
+        return None
+    return StreamTTSWorker(TTS_HANDLER, on_chunk=on_chunk)
+
+
+def show_stream_tts_chunks(stream_tts: StreamTTSWorker, block=False):
+    """在页面上逐句显示已经合成好的音频"""
+    if stream_tts is None:
+        return
+
+    for chunk in stream_tts.get_ready_chunks(block=block):
+        st.audio(chunk_to_wav_bytes(chunk, stream_tts.sampling_rate), format="audio/wav")
+
+
+def finish_stream_tts_in_spinner(stream_tts: StreamTTSWorker, show_chunks=True):
+    """LLM 生成完成后，等待剩余句子合成完毕并保存整段语音
+
+    Args:
+        show_chunks (bool): 是否在页面上显示每句的音频，流式数字人的视频已经带有声音时不需要
+    """
+    if stream_tts is None:
+        return None
+
+    stream_tts.finish()
+    with st.spinner("正在生成语音，请稍等..."):
+        if show_chunks:
+            show_stream_tts_chunks(stream_tts, block=True)
+        else:
+            stream_tts.thread.join()
+
+    if len(stream_tts.errors) > 0:
+        st.warning(f"有 {len(stream_tts.errors)} 句语音生成失败，已用静音代替：{'；'.join(s for s, _ in stream_tts.errors)}")
+
+    save_tag = datetime.now().strftime("%Y-%m-%d-%H-%M-%S") + ".wav"
+    tts_save_path = stream_tts.save_wav(str(Path(WEB_CONFIGS.TTS_WAV_GEN_PATH).joinpath(save_tag).absolute()))
+    if tts_save_path is not None:
+        st.toast("生成语音成功!")
+    return tts_save_path
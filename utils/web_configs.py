@@ -11,7 +11,7 @@
 - Agent 配置
 - ASR 配置
 """
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import os
 
 
@@ -89,6 +89,14 @@ class WebConfigs:
     #                               TTS 配置
     # ==================================================================
     TTS_WAV_GEN_PATH: str = r"./work_dirs/tts_wavs"
+    TTS_STREAMING: bool = True  # True LLM 边生成边逐句合成语音，False 生成完整回复后再合成
+    TTS_STREAMING_MAX_BATCH: int = 8  # 流式 TTS 时已经切好、在排队的句子一起合成，最多的句数
+    TTS_FEATURE_CACHE_DIR: str | None = r"./work_dirs/tts_feature_cache"  # phones + BERT 特征磁盘缓存，None 则只用内存缓存
+    TTS_FEATURE_CACHE_SIZE: int = 1024  # 内存缓存最多保存的句子数
+    TTS_FEATURE_CACHE_MAX_MB: int = 1024  # 特征磁盘缓存大小上限，超出后按 LRU 淘汰
+    TTS_AUDIO_CACHE_DIR: str | None = r"./work_dirs/tts_audio_cache"  # 整句音频缓存，None 则不缓存
+    TTS_AUDIO_CACHE_MAX_MB: int = 512  # 整句音频缓存大小上限，超出后按 LRU 淘汰
+    TTS_AUDIO_CACHE_SEED: int = 0  # 开启音频缓存时采样使用的全局 seed
     # TTS_MODEL_DIR: str = r"./weights/gpt_sovits_weights/" 
     TTS_MODEL_DIR: str = r"/root/models/speech_sambert-hifigan_tts_zhiyan_emo_zh-cn_16k"  # 修改为sambert模型路径
 
@@ -100,6 +108,17 @@ class WebConfigs:
     DIGITAL_HUMAN_BBOX_SHIFT: int = 0
     DIGITAL_HUMAN_VIDEO_PATH: str = r"./doc/digital_human/lelemiao_digital_human_video.mp4"
     DIGITAL_HUMAN_FPS: str = 25
+    DIGITAL_HUMAN_AVATAR_ID: str = "lelemiao"  # 默认形象，素材保存在 DIGITAL_HUMAN_GEN_PATH/<形象 ID>
+    # 其他形象：形象 ID -> (视频路径, bbox_shift)，启动时全部注册，第一次使用时预处理，
+    # 例如 {"xiaoming": ("./doc/digital_human/xiaoming.mp4", 0)}
+    DIGITAL_HUMAN_AVATARS: dict = field(default_factory=dict)
+    # 角色名（SALES_NAME）-> 形象 ID，没有配置的角色使用默认形象，例如 {"乐乐喵": "lelemiao"}
+    DIGITAL_HUMAN_ROLE_AVATARS: dict = field(default_factory=dict)
+    DIGITAL_HUMAN_MAX_GPU_AVATARS: int = 2  # 最多同时在 GPU 上的形象数，超出后按 LRU 挪回 CPU
+    DIGITAL_HUMAN_BATCH_SIZE: int = 8  # UNet 推理的 batch size，0 则在 DIGITAL_HUMAN_MEMORY_BUDGET_GB 内自动选择
+    DIGITAL_HUMAN_MEMORY_BUDGET_GB: float = 2.0  # 自动选择 batch size 时给 UNet + VAE 解码预留的显存，LLM 的 KV cache 需要留出这部分
+    DIGITAL_HUMAN_STREAMING: bool = True  # 流式生成数字人（需要开启 TTS_STREAMING），TTS 边合成边生成视频段
+    DIGITAL_HUMAN_STREAM_SEGMENT_SEC: float = 2.0  # 流式生成时每段视频的时长（秒）
 
     # ==================================================================
     #                             Agent 配置